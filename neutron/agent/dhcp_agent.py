@@ -15,8 +15,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import os
 import socket
+import time
 import uuid
 
 import eventlet
@@ -33,13 +35,13 @@ from neutron.common import constants
 from neutron.common import exceptions
 from neutron.common import legacy
 from neutron.common import topics
-from neutron.common import utils
 from neutron import context
 from neutron import manager
 from neutron.openstack.common import importutils
 from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.openstack.common.rpc import proxy
 from neutron.openstack.common import service
 from neutron.openstack.common import uuidutils
@@ -68,14 +70,40 @@ class DhcpAgent(manager.Manager):
                            "dedicated network. Requires "
                            "enable_isolated_metadata = True")),
         cfg.IntOpt('num_sync_threads', default=4,
-                   help=_('Number of threads to use during sync process.')),
+                   help=_('Number of threads processing the events and the '
+                          'sync of different networks concurrently.')),
+        cfg.IntOpt('sync_page_size', default=100,
+                   help=_('Number of networks whose subnets and ports are '
+                          'fetched per call during a sync.')),
+        cfg.FloatOpt('reload_allocations_window', default=0,
+                     help=_('Seconds to collect the port changes of a '
+                            'network before reloading its DHCP server '
+                            'once for all of them, 0 reloads it on every '
+                            'change')),
+        cfg.FloatOpt('lease_update_window', default=0,
+                     help=_('Seconds to collect the DHCP lease updates '
+                            'before sending them to the server in one call, '
+                            '0 sends every update at once')),
     ]
 
     def __init__(self, host=None):
         super(DhcpAgent, self).__init__(host=host)
         self.needs_resync = False
+        # the networks to sync again after errors specific to them
+        self.resync_networks = set()
+        self.use_networks_info = True
         self.conf = cfg.CONF
         self.cache = NetworkCache()
+        self.queue = NetworkEventQueue(self.conf.num_sync_threads)
+        # the networks of the ports whose updates are queued, for the
+        # deletes of ports not in the cache yet
+        self.queued_port_networks = {}
+        self.dirty_networks = set()
+        self._reload_timer = None
+        # the lease updates not sent yet, by network and IP address
+        self.pending_leases = {}
+        self._lease_timer = None
+        self.use_bulk_leases = True
         self.root_helper = config.get_root_helper(self.conf)
         self.dhcp_driver_cls = importutils.import_class(self.conf.dhcp_driver)
         ctx = context.get_admin_context_without_session()
@@ -135,43 +163,167 @@ class DhcpAgent(manager.Manager):
             return True
 
         except Exception:
-            self.needs_resync = True
+            self.schedule_resync(network.id)
             LOG.exception(_('Unable to %s dhcp.'), action)
 
+    def reload_allocations(self, network):
+        """Reload the allocations of a network now or on the next flush."""
+        if not self.conf.reload_allocations_window:
+            self.call_driver('reload_allocations', network)
+            return
+        self.dirty_networks.add(network.id)
+        if self._reload_timer is None:
+            self._reload_timer = eventlet.spawn_after(
+                self.conf.reload_allocations_window,
+                self.flush_allocations)
+
+    def flush_allocations(self):
+        """Queue the reload of the allocations of the dirty networks."""
+        self._reload_timer = None
+        network_ids, self.dirty_networks = self.dirty_networks, set()
+        for network_id in network_ids:
+            self.queue.put(network_id, self._reload_cached_allocations,
+                           network_id)
+
+    def _reload_cached_allocations(self, network_id):
+        network = self.cache.get_network_by_id(network_id)
+        if network:
+            self.call_driver('reload_allocations', network)
+
     def update_lease(self, network_id, ip_address, time_remaining):
+        """Send a lease update now or with the next flush."""
+        if not self.conf.lease_update_window:
+            self._update_lease(network_id, ip_address, time_remaining)
+            return
+        self.pending_leases.setdefault(network_id, {})[ip_address] = (
+            time_remaining, time.time())
+        if self._lease_timer is None:
+            self._lease_timer = eventlet.spawn_after(
+                self.conf.lease_update_window, self.flush_leases)
+
+    def _update_lease(self, network_id, ip_address, time_remaining):
         try:
             self.plugin_rpc.update_lease_expiration(network_id, ip_address,
                                                     time_remaining)
         except Exception:
-            self.needs_resync = True
+            self.schedule_resync(network_id)
             LOG.exception(_('Unable to update lease'))
 
-    def sync_state(self):
-        """Sync the local DHCP state with Neutron."""
+    def flush_leases(self):
+        """Send the pending lease updates in one call."""
+        self._lease_timer = None
+        pending_leases, self.pending_leases = self.pending_leases, {}
+        now = time.time()
+        # the time the updates waited is not left on the leases anymore
+        leases = dict(
+            (network_id, dict(
+                (ip_address, max(0, time_remaining - int(now - received)))
+                for ip_address, (time_remaining, received)
+                in network_leases.iteritems()))
+            for network_id, network_leases in pending_leases.iteritems())
+        if self.use_bulk_leases:
+            try:
+                self.plugin_rpc.update_lease_expirations(leases)
+                return
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'AttributeError':
+                    self._lease_update_failed(leases)
+                    return
+                LOG.warning(_("Server does not support "
+                              "update_lease_expirations, falling back to "
+                              "update_lease_expiration"))
+                self.use_bulk_leases = False
+            except Exception:
+                self._lease_update_failed(leases)
+                return
+        for network_id, network_leases in leases.iteritems():
+            for ip_address, time_remaining in network_leases.iteritems():
+                self._update_lease(network_id, ip_address, time_remaining)
+
+    def _lease_update_failed(self, leases):
+        for network_id in leases:
+            self.schedule_resync(network_id)
+        LOG.exception(_('Unable to update %d leases'),
+                      sum(len(ips) for ips in leases.itervalues()))
+
+    def schedule_resync(self, network_id=None):
+        """Sync a network, or all of them, on the next periodic resync."""
+        if network_id:
+            self.resync_networks.add(network_id)
+        else:
+            self.needs_resync = True
+
+    def sync_state(self, network_ids=None):
+        """Sync the local DHCP state with Neutron.
+
+        Only the given networks are synced when network_ids is not None.
+        """
         LOG.info(_('Synchronizing state'))
-        pool = eventlet.GreenPool(cfg.CONF.num_sync_threads)
-        known_network_ids = set(self.cache.get_network_ids())
 
         try:
-            active_networks = self.plugin_rpc.get_active_networks_info()
-            active_network_ids = set(network.id for network in active_networks)
-            for deleted_id in known_network_ids - active_network_ids:
-                self.disable_dhcp_helper(deleted_id)
-
-            for network in active_networks:
-                pool.spawn_n(self.configure_dhcp_for_network, network)
+            if network_ids is None:
+                known_network_ids = set(self.cache.get_network_ids())
+                network_ids = set(self.plugin_rpc.get_active_networks())
+                for deleted_id in known_network_ids - network_ids:
+                    self.queue.put(deleted_id, self.disable_dhcp_helper,
+                                   deleted_id)
+            self._sync_networks(sorted(network_ids))
 
         except Exception:
-            self.needs_resync = True
+            self.schedule_resync()
             LOG.exception(_('Unable to sync network state.'))
 
+    def _sync_networks(self, network_ids):
+        """Queue the configuration of networks fetched page by page."""
+        start = 0
+        while start < len(network_ids):
+            size = (self.use_networks_info and self.conf.sync_page_size or
+                    len(network_ids))
+            page = network_ids[start:start + size]
+            start += size
+            try:
+                networks = self._get_networks_info(page)
+            except Exception:
+                self.resync_networks.update(page)
+                LOG.exception(_('Unable to sync %d networks.'), len(page))
+                continue
+
+            # the others were deleted or disabled since
+            disabled_network_ids = set(page)
+            for network in networks:
+                disabled_network_ids.discard(network.id)
+                self.queue.put(network.id, self.configure_dhcp_for_network,
+                               network)
+            for network_id in disabled_network_ids:
+                self.queue.put(network_id, self.disable_dhcp_helper,
+                               network_id)
+
+    def _get_networks_info(self, network_ids):
+        if self.use_networks_info:
+            try:
+                return self.plugin_rpc.get_networks_info(network_ids)
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'AttributeError':
+                    raise
+                LOG.warning(_("Server does not support get_networks_info, "
+                              "falling back to get_active_networks_info"))
+                self.use_networks_info = False
+        network_ids = set(network_ids)
+        return [network
+                for network in self.plugin_rpc.get_active_networks_info()
+                if network.id in network_ids]
+
     def _periodic_resync_helper(self):
         """Resync the dhcp state at the configured interval."""
         while True:
             eventlet.sleep(self.conf.resync_interval)
             if self.needs_resync:
                 self.needs_resync = False
+                self.resync_networks = set()
                 self.sync_state()
+            elif self.resync_networks:
+                network_ids, self.resync_networks = self.resync_networks, set()
+                self.sync_state(network_ids)
 
     def periodic_resync(self):
         """Spawn a thread to periodically resync the dhcp state."""
@@ -182,7 +334,7 @@ class DhcpAgent(manager.Manager):
         try:
             network = self.plugin_rpc.get_network_info(network_id)
         except Exception:
-            self.needs_resync = True
+            self.schedule_resync(network_id)
             LOG.exception(_('Network %s RPC info call failed.'), network_id)
             return
         self.configure_dhcp_for_network(network)
@@ -222,9 +374,11 @@ class DhcpAgent(manager.Manager):
         try:
             network = self.plugin_rpc.get_network_info(network_id)
         except Exception:
-            self.needs_resync = True
+            self.schedule_resync(network_id)
             LOG.exception(_('Network %s RPC info call failed.'), network_id)
             return
+        # the network is reloaded, restarted or disabled below
+        self.dirty_networks.discard(network_id)
 
         old_cidrs = set(s.cidr for s in old_network.subnets if s.enable_dhcp)
         new_cidrs = set(s.cidr for s in network.subnets if s.enable_dhcp)
@@ -241,63 +395,72 @@ class DhcpAgent(manager.Manager):
         if new_cidrs:
             self.device_manager.update(network)
 
-    @utils.synchronized('dhcp-agent')
     def network_create_end(self, context, payload):
         """Handle the network.create.end notification event."""
         network_id = payload['network']['id']
-        self.enable_dhcp_helper(network_id)
+        self.queue.put(network_id, self.enable_dhcp_helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def network_update_end(self, context, payload):
         """Handle the network.update.end notification event."""
         network_id = payload['network']['id']
         if payload['network']['admin_state_up']:
-            self.enable_dhcp_helper(network_id)
+            self.queue.put(network_id, self.enable_dhcp_helper, network_id)
         else:
-            self.disable_dhcp_helper(network_id)
+            self.queue.put(network_id, self.disable_dhcp_helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def network_delete_end(self, context, payload):
         """Handle the network.delete.end notification event."""
-        self.disable_dhcp_helper(payload['network_id'])
+        network_id = payload['network_id']
+        self.queue.put(network_id, self.disable_dhcp_helper, network_id)
 
-    @utils.synchronized('dhcp-agent')
     def subnet_update_end(self, context, payload):
         """Handle the subnet.update.end notification event."""
         network_id = payload['subnet']['network_id']
-        self.refresh_dhcp_helper(network_id)
+        self.queue.put(network_id, self.refresh_dhcp_helper, network_id)
 
     # Use the update handler for the subnet create event.
     subnet_create_end = subnet_update_end
 
-    @utils.synchronized('dhcp-agent')
     def subnet_delete_end(self, context, payload):
         """Handle the subnet.delete.end notification event."""
         subnet_id = payload['subnet_id']
         network = self.cache.get_network_by_subnet_id(subnet_id)
         if network:
-            self.refresh_dhcp_helper(network.id)
+            self.queue.put(network.id, self.refresh_dhcp_helper, network.id)
 
-    @utils.synchronized('dhcp-agent')
     def port_update_end(self, context, payload):
         """Handle the port.update.end notification event."""
         port = DictModel(payload['port'])
-        network = self.cache.get_network_by_id(port.network_id)
-        if network:
-            self.cache.put_port(port)
-            self.call_driver('reload_allocations', network)
+        self.queued_port_networks[port.id] = port.network_id
+        self.queue.put(port.network_id, self._update_port, port)
 
     # Use the update handler for the port create event.
     port_create_end = port_update_end
 
-    @utils.synchronized('dhcp-agent')
+    def _update_port(self, port):
+        if self.queued_port_networks.get(port.id) == port.network_id:
+            del self.queued_port_networks[port.id]
+        network = self.cache.get_network_by_id(port.network_id)
+        if network:
+            self.cache.put_port(port)
+            self.reload_allocations(network)
+
     def port_delete_end(self, context, payload):
         """Handle the port.delete.end notification event."""
-        port = self.cache.get_port_by_id(payload['port_id'])
+        port_id = payload['port_id']
+        network_id = self.queued_port_networks.pop(port_id, None)
+        if not network_id:
+            network = self.cache.get_network_by_port_id(port_id)
+            network_id = network and network.id
+        if network_id:
+            self.queue.put(network_id, self._delete_port, port_id)
+
+    def _delete_port(self, port_id):
+        port = self.cache.get_port_by_id(port_id)
         if port:
             network = self.cache.get_network_by_id(port.network_id)
             self.cache.remove_port(port)
-            self.call_driver('reload_allocations', network)
+            self.reload_allocations(network)
 
     def enable_isolated_metadata_proxy(self, network):
 
@@ -369,6 +532,22 @@ class DhcpPluginApi(proxy.RpcProxy):
         self.context = context
         self.host = cfg.CONF.host
 
+    def get_active_networks(self):
+        """Make a remote process call to retrieve the active network ids."""
+        return self.call(self.context,
+                         self.make_msg('get_active_networks',
+                                       host=self.host),
+                         topic=self.topic)
+
+    def get_networks_info(self, network_ids):
+        """Make a remote process call to retrieve networks info."""
+        networks = self.call(self.context,
+                             self.make_msg('get_networks_info',
+                                           network_ids=network_ids,
+                                           host=self.host),
+                             topic=self.topic)
+        return [DictModel(n) for n in networks]
+
     def get_active_networks_info(self):
         """Make a remote process call to retrieve all network info."""
         networks = self.call(self.context,
@@ -440,6 +619,72 @@ class DhcpPluginApi(proxy.RpcProxy):
                                 host=self.host),
                   topic=self.topic)
 
+    def update_lease_expirations(self, leases):
+        """Make a remote process call to update ip lease expirations."""
+        return self.call(self.context,
+                         self.make_msg('update_lease_expirations',
+                                       leases=leases,
+                                       host=self.host),
+                         topic=self.topic)
+
+
+class NetworkEventQueue(object):
+    """Processes the events of each network in order.
+
+    The events of different networks are processed concurrently by up to
+    size green threads; queuing an event waits for one of them to be free
+    when they are all busy with other networks.
+    """
+
+    def __init__(self, size):
+        self.pool = eventlet.GreenPool(size)
+        self._events = {}
+        self.depth = 0
+        self.stats = {'events': 0,
+                      'max_depth': 0,
+                      'total_latency': 0.0,
+                      'max_latency': 0.0}
+
+    def put(self, network_id, func, *args):
+        """Queue the call of func with args after the network's events."""
+        self.depth += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.depth)
+        event = (func, args, time.time())
+        if network_id in self._events:
+            self._events[network_id].append(event)
+        else:
+            self._events[network_id] = collections.deque([event])
+            self.pool.spawn_n(self._process, network_id)
+
+    def _process(self, network_id):
+        events = self._events[network_id]
+        while events:
+            func, args, queued_at = events.popleft()
+            self.depth -= 1
+            latency = time.time() - queued_at
+            self.stats['events'] += 1
+            self.stats['total_latency'] += latency
+            self.stats['max_latency'] = max(self.stats['max_latency'],
+                                            latency)
+            try:
+                func(*args)
+            except Exception:
+                LOG.exception(_('Failed to process an event of network %s'),
+                              network_id)
+        del self._events[network_id]
+
+    def wait(self):
+        """Wait for the queued events to be processed."""
+        self.pool.waitall()
+
+    def get_state(self):
+        events = self.stats['events']
+        return {'queued_events': self.depth,
+                'max_queued_events': self.stats['max_depth'],
+                'mean_event_latency': round(
+                    events and self.stats['total_latency'] / events, 3),
+                'max_event_latency': round(self.stats['max_latency'], 3)}
+
 
 class NetworkCache(object):
     """Agent cache of the current network state."""
@@ -840,6 +1085,8 @@ class DhcpAgentWithStateReport(DhcpAgent):
         try:
             self.agent_state.get('configurations').update(
                 self.cache.get_state())
+            self.agent_state.get('configurations').update(
+                self.queue.get_state())
             ctx = context.get_admin_context_without_session()
             self.state_rpc.report_state(ctx, self.agent_state, self.use_call)
             self.use_call = False
@@ -97,6 +97,23 @@ class FirewallDriver(object):
         """Returns filtered ports."""
         pass
 
+    @property
+    def uses_ipset(self):
+        """Whether remote groups are matched through member sets.
+
+        Such drivers get rules which still refer to remote_group_id and
+        the members of the remote groups through
+        update_security_group_members.
+        """
+        return False
+
+    def update_security_group_members(self, sg_id, sg_members):
+        """Update the addresses of a remote security group.
+
+        sg_members maps an ethertype to the list of addresses.
+        """
+        raise NotImplementedError()
+
     @contextlib.contextmanager
     def defer_apply(self):
         """Defer apply context."""
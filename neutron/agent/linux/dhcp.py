@@ -20,7 +20,6 @@ import os
 import re
 import shutil
 import socket
-import StringIO
 import sys
 
 import netaddr
@@ -217,6 +216,10 @@ class Dnsmasq(DhcpLocalProcess):
 
     _TAG_PREFIX = 'tag%d'
 
+    # The port and host file lines of the ports of each network, by port id.
+    # The agent makes a driver per call, so they are kept on the class.
+    _hosts_lines = {}
+
     NEUTRON_NETWORK_ID_KEY = 'NEUTRON_NETWORK_ID'
     NEUTRON_RELAY_SOCKET_PATH_KEY = 'NEUTRON_RELAY_SOCKET_PATH'
     MINIMUM_VERSION = 2.59
@@ -336,20 +339,37 @@ class Dnsmasq(DhcpLocalProcess):
             LOG.debug(_('Pid %d is stale, relaunching dnsmasq'), self.pid)
         LOG.debug(_('Reloading allocations for network: %s'), self.network.id)
 
+    def _remove_config_files(self):
+        super(Dnsmasq, self)._remove_config_files()
+        self._hosts_lines.pop(self.network.id, None)
+
     def _output_hosts_file(self):
-        """Writes a dnsmasq compatible hosts file."""
+        """Writes a dnsmasq compatible hosts file.
+
+        The agent replaces the ports of its networks when they change, so
+        only the lines of the ports that are not those of the last call for
+        the network are rendered again.
+        """
         r = re.compile('[:.]')
-        buf = StringIO.StringIO()
+        cached_lines = self._hosts_lines.get(self.network.id, {})
+        hosts_lines = {}
+        buf = []
 
         for port in self.network.ports:
-            for alloc in port.fixed_ips:
-                name = '%s.%s' % (r.sub('-', alloc.ip_address),
-                                  self.conf.dhcp_domain)
-                buf.write('%s,%s,%s\n' %
-                          (port.mac_address, name, alloc.ip_address))
-
+            cached_port, lines = cached_lines.get(port.id, (None, None))
+            if cached_port is not port:
+                lines = ''.join(
+                    '%s,%s.%s,%s\n' % (port.mac_address,
+                                       r.sub('-', alloc.ip_address),
+                                       self.conf.dhcp_domain,
+                                       alloc.ip_address)
+                    for alloc in port.fixed_ips)
+            hosts_lines[port.id] = (port, lines)
+            buf.append(lines)
+
+        self._hosts_lines[self.network.id] = hosts_lines
         name = self.get_conf_file_name('host')
-        utils.replace_file(name, buf.getvalue())
+        utils.replace_file(name, ''.join(buf))
         return name
 
     def _output_opts_file(self):
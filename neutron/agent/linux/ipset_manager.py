@@ -0,0 +1,82 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Manages hash:ip sets with the ipset utility."""
+
+from neutron.agent.linux import utils as linux_utils
+from neutron.common import constants
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# ipset names are limited to 31 characters
+MAX_IPSET_NAME_LEN = 31
+IPSET_PREFIX = 'NET'
+IPSET_FAMILY = {constants.IPv4: 'inet',
+                constants.IPv6: 'inet6'}
+
+
+def get_ipset_name(security_group_id, ethertype):
+    """Return the name of the set holding the members of a group."""
+    return (IPSET_PREFIX + ethertype +
+            security_group_id)[:MAX_IPSET_NAME_LEN]
+
+
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    The members of every set created by this manager are kept in memory,
+    so membership changes are applied as a list of additions and
+    deletions fed to a single 'ipset restore' call.
+    """
+
+    def __init__(self, execute=None, root_helper=None):
+        if not execute:
+            execute = linux_utils.execute
+        self.execute = execute
+        self.root_helper = root_helper
+        self.ipsets = {}
+
+    def __contains__(self, name):
+        return name in self.ipsets
+
+    def set_members(self, name, ethertype, ips):
+        """Create the set if needed and make ips its only members."""
+        ips = set(ips)
+        current = self.ipsets.get(name)
+        lines = []
+        if current is None:
+            # The set may be left over by a previous run of the agent
+            lines.append('create %s hash:ip family %s' %
+                         (name, IPSET_FAMILY[ethertype]))
+            lines.append('flush %s' % name)
+            current = set()
+        lines.extend('add %s %s' % (name, ip) for ip in ips - current)
+        lines.extend('del %s %s' % (name, ip) for ip in current - ips)
+        if lines:
+            LOG.debug(_("Updating ipset %(name)s: %(count)d changes"),
+                      {'name': name, 'count': len(lines)})
+            self.execute(['ipset', 'restore', '-exist'],
+                         process_input='\n'.join(lines) + '\n',
+                         root_helper=self.root_helper)
+        self.ipsets[name] = ips
+
+    def destroy(self, name):
+        """Destroy a set which is no longer referenced by any rule."""
+        if self.ipsets.pop(name, None) is not None:
+            self.execute(['ipset', 'destroy', name],
+                         root_helper=self.root_helper)
@@ -19,12 +19,15 @@ import netaddr
 from oslo.config import cfg
 
 from neutron.agent import firewall
+from neutron.agent.linux import ipset_manager
 from neutron.agent.linux import iptables_manager
 from neutron.common import constants
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
+cfg.CONF.import_opt('enable_ipset', 'neutron.agent.securitygroups_rpc',
+                    group='SECURITYGROUP')
 SG_CHAIN = 'sg-chain'
 INGRESS_DIRECTION = 'ingress'
 EGRESS_DIRECTION = 'egress'
@@ -32,6 +35,10 @@ IP_SPOOF_FILTER = 'ip-spoof-filter'
 CHAIN_NAME_PREFIX = {INGRESS_DIRECTION: 'i',
                      EGRESS_DIRECTION: 'o',
                      IP_SPOOF_FILTER: 's'}
+DIRECTION_IP_PREFIX = {INGRESS_DIRECTION: 'source_ip_prefix',
+                       EGRESS_DIRECTION: 'dest_ip_prefix'}
+IPSET_DIRECTION = {INGRESS_DIRECTION: 'src',
+                   EGRESS_DIRECTION: 'dst'}
 LINUX_DEV_LEN = 14
 
 
@@ -46,19 +53,39 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             use_ipv6=True)
         # list of port which has security group
         self.filtered_ports = {}
+        self.enable_ipset = cfg.CONF.SECURITYGROUP.enable_ipset
+        self.ipset = ipset_manager.IpsetManager(
+            root_helper=cfg.CONF.AGENT.root_helper)
+        # member addresses of remote security groups by ethertype
+        self.sg_members = {}
+        # ipsets referenced by the current rules
+        self._used_ipsets = set()
         self._add_fallback_chain_v4v6()
 
     @property
     def ports(self):
         return self.filtered_ports
 
+    @property
+    def uses_ipset(self):
+        return self.enable_ipset
+
+    def update_security_group_members(self, sg_id, sg_members):
+        LOG.debug(_("Updating members of security group %s"), sg_id)
+        self.sg_members[sg_id] = sg_members
+        for ethertype in ipset_manager.IPSET_FAMILY:
+            name = ipset_manager.get_ipset_name(sg_id, ethertype)
+            if name in self.ipset:
+                self.ipset.set_members(name, ethertype,
+                                       sg_members.get(ethertype, []))
+
     def prepare_port_filter(self, port):
         LOG.debug(_("Preparing device (%s) filter"), port['device'])
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         # each security group has it own chains
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def update_port_filter(self, port):
         LOG.debug(_("Updating device (%s) filter"), port['device'])
@@ -69,7 +96,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._remove_chains()
         self.filtered_ports[port['device']] = port
         self._setup_chains()
-        self.iptables.apply()
+        self._apply()
 
     def remove_port_filter(self, port):
         LOG.debug(_("Removing device (%s) filter"), port['device'])
@@ -80,10 +107,26 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self._remove_chains()
         self.filtered_ports.pop(port['device'], None)
         self._setup_chains()
+        self._apply()
+
+    def _apply(self):
         self.iptables.apply()
+        if not self.iptables.iptables_apply_deferred:
+            self._remove_unused_ipsets()
+
+    def _remove_unused_ipsets(self):
+        # Sets can only be destroyed once no rule refers to them anymore
+        for name in set(self.ipset.ipsets) - self._used_ipsets:
+            self.ipset.destroy(name)
+        for sg_id in self.sg_members.keys():
+            if not any(ipset_manager.get_ipset_name(sg_id, ethertype) in
+                       self._used_ipsets
+                       for ethertype in ipset_manager.IPSET_FAMILY):
+                del self.sg_members[sg_id]
 
     def _setup_chains(self):
         """Setup ingress and egress chain for a port."""
+        self._used_ipsets = set()
         self._add_chain_by_name_v4v6(SG_CHAIN)
         for port in self.filtered_ports.values():
             self._setup_chain(port, INGRESS_DIRECTION)
@@ -257,6 +300,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                                    rule.get('protocol'),
                                    rule.get('port_range_min'),
                                    rule.get('port_range_max'))
+            args += self._ipset_arg(rule)
             args += ['-j RETURN']
             iptables_rules += [' '.join(args)]
 
@@ -302,6 +346,23 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             return ['-%s' % direction, ip_prefix]
         return []
 
+    def _ipset_arg(self, rule):
+        remote_group_id = rule.get('remote_group_id')
+        if not (self.enable_ipset and remote_group_id):
+            return []
+        direction = rule['direction']
+        if rule.get(DIRECTION_IP_PREFIX[direction]):
+            # remote group already converted to addresses by the server
+            return []
+        ethertype = rule['ethertype']
+        name = ipset_manager.get_ipset_name(remote_group_id, ethertype)
+        if name not in self.ipset:
+            members = self.sg_members.get(remote_group_id, {})
+            self.ipset.set_members(name, ethertype,
+                                   members.get(ethertype, []))
+        self._used_ipsets.add(name)
+        return ['-m set --match-set', name, IPSET_DIRECTION[direction]]
+
     def _port_chain_name(self, port, direction):
         return iptables_manager.get_chain_name(
             '%s%s' % (CHAIN_NAME_PREFIX[direction], port['device'][3:]))
@@ -311,6 +372,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
 
     def filter_defer_apply_off(self):
         self.iptables.defer_apply_off()
+        self._remove_unused_ipsets()
 
 
 class OVSHybridIptablesFirewallDriver(IptablesFirewallDriver):
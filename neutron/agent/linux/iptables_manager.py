@@ -23,9 +23,11 @@
 
 import inspect
 import os
+import time
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
+from neutron.openstack.common import excutils
 from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
@@ -94,6 +96,9 @@ class IptablesTable(object):
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
+        # Set whenever the table changes, cleared by IptablesManager once
+        # the table has been applied
+        self.dirty = True
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -112,6 +117,7 @@ class IptablesTable(object):
             self.chains.add(name)
         else:
             self.unwrapped_chains.add(name)
+        self.dirty = True
 
     def _select_chain_set(self, wrap):
         if wrap:
@@ -150,6 +156,7 @@ class IptablesTable(object):
             return
 
         chain_set.remove(name)
+        self.dirty = True
 
         if not wrap:
             # non-wrapped chains and rules need to be dealt with specially,
@@ -193,6 +200,7 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         self.rules.append(IptablesRule(chain, rule, wrap, top))
+        self.dirty = True
 
     def _wrap_target_chain(self, s):
         if s.startswith('$'):
@@ -210,6 +218,7 @@ class IptablesTable(object):
         chain = get_chain_name(chain, wrap)
         try:
             self.rules.remove(IptablesRule(chain, rule, wrap, top))
+            self.dirty = True
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
         except ValueError:
@@ -225,6 +234,37 @@ class IptablesTable(object):
                          if rule.chain == chain and rule.wrap == wrap]
         for rule in chained_rules:
             self.rules.remove(rule)
+        if chained_rules:
+            self.dirty = True
+
+    def get_state(self):
+        """Return what apply() puts in the kernel for this table.
+
+        The state is a tuple of the unwrapped chains and rules, which may
+        be shared with other components, and of a dict of the rules of
+        each wrapped chain, which belong to this component only. A rule
+        added twice to a wrapped chain keeps its last position.
+        """
+        unwrapped = (frozenset(self.unwrapped_chains),
+                     tuple((str(rule), rule.top) for rule in self.rules
+                           if not rule.wrap))
+        wrapped = dict((chain, []) for chain in self.chains)
+        for top in (True, False):
+            for rule in self.rules:
+                if rule.wrap and rule.top == top:
+                    wrapped[rule.chain].append(str(rule))
+        for chain, rules in wrapped.iteritems():
+            if len(set(rules)) == len(rules):
+                continue
+            seen = set()
+            unique = []
+            for rule in reversed(rules):
+                if rule not in seen:
+                    seen.add(rule)
+                    unique.append(rule)
+            unique.reverse()
+            wrapped[chain] = unique
+        return unwrapped, wrapped
 
 
 class IptablesManager(object):
@@ -261,6 +301,16 @@ class IptablesManager(object):
         self.root_helper = root_helper
         self.namespace = namespace
         self.iptables_apply_deferred = False
+        # State of every table as of the last successful apply, by
+        # (command, table name)
+        self.applied_state = {}
+        # Counters of the work done by _apply
+        self.stats = {'applies': 0,
+                      'skipped': 0,
+                      'partial_restores': 0,
+                      'full_restores': 0,
+                      'apply_time': 0.0,
+                      'restored_bytes': 0}
 
         self.ipv4 = {'filter': IptablesTable()}
         self.ipv6 = {'filter': IptablesTable()}
@@ -338,32 +388,151 @@ class IptablesManager(object):
     def _apply(self):
         """Apply the current in-memory set of iptables rules.
 
-        This will blow away any rules left over from previous runs of the
-        same component of Nova, and replace them with our current set of
-        rules. This happens atomically, thanks to iptables-restore.
+        The first time, this will blow away any rules left over from
+        previous runs of the same component of Nova, and replace them with
+        our current set of rules. This happens atomically, thanks to
+        iptables-restore.
+
+        Afterwards, tables which did not change since the last apply are
+        left alone, and when only wrapped chains changed, just those chains
+        are rewritten with iptables-restore --noflush.
 
         """
+        start = time.time()
         s = [('iptables', self.ipv4)]
         if self.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
+        restored_bytes = 0
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            all_tables = self.execute(args, root_helper=self.root_helper)
-            all_lines = all_tables.split('\n')
-            for table_name, table in tables.iteritems():
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
-
-            args = ['%s-restore' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            self.execute(args, process_input='\n'.join(all_lines),
-                         root_helper=self.root_helper)
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+            restored_bytes += self._apply_tables(cmd, tables)
+
+        elapsed = time.time() - start
+        self.stats['applies'] += 1
+        if not restored_bytes:
+            self.stats['skipped'] += 1
+        self.stats['apply_time'] += elapsed
+        self.stats['restored_bytes'] += restored_bytes
+        LOG.debug(_("IPTablesManager.apply completed with success: "
+                    "%(bytes)d bytes restored in %(time).3f seconds"),
+                  {'bytes': restored_bytes, 'time': elapsed})
+
+    def _apply_tables(self, cmd, tables):
+        """Apply the tables of one of iptables or ip6tables.
+
+        Returns the number of bytes fed to iptables-restore.
+        """
+        dirty = [table_name for table_name, table in tables.iteritems()
+                 if table.dirty]
+        if not dirty:
+            return 0
+
+        # Restoring yields to other green threads, whose changes to the
+        # tables mark them dirty again. So the flags are cleared before,
+        # and the states recorded as applied are taken before too.
+        states = self._take_states(tables, dirty)
+        try:
+            restored_bytes = None
+            if not self._need_full_restore(cmd, tables, states):
+                lines = []
+                for table_name, state in states.iteritems():
+                    lines += self._modified_chains(
+                        table_name, self.applied_state[(cmd, table_name)][1],
+                        state[1])
+                if not lines:
+                    restored_bytes = 0
+                else:
+                    try:
+                        restored_bytes = self._restore(cmd, lines,
+                                                       noflush=True)
+                        self.stats['partial_restores'] += 1
+                    except RuntimeError:
+                        LOG.exception(_("Failed to apply the modified "
+                                        "chains, restoring all %s tables"),
+                                      cmd)
+
+            if restored_bytes is None:
+                dirty = list(tables)
+                states = self._take_states(tables, dirty)
+                restored_bytes = self._restore_all(cmd, tables)
+                self.stats['full_restores'] += 1
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for table_name in dirty:
+                    tables[table_name].dirty = True
+
+        for table_name, state in states.iteritems():
+            self.applied_state[(cmd, table_name)] = state
+        return restored_bytes
+
+    def _take_states(self, tables, table_names):
+        states = {}
+        for table_name in table_names:
+            states[table_name] = tables[table_name].get_state()
+            tables[table_name].dirty = False
+        return states
+
+    def _need_full_restore(self, cmd, tables, states):
+        """Whether changes to the tables require the full cycle.
+
+        Only wrapped chains can be rewritten alone. Changes to unwrapped
+        chains, which are shared with other components, go through
+        iptables-save and iptables-restore, as does the first apply.
+        """
+        for table_name, state in states.iteritems():
+            applied = self.applied_state.get((cmd, table_name))
+            if applied is None or applied[0] != state[0]:
+                return True
+            table = tables[table_name]
+            if table.remove_rules or table.remove_chains:
+                return True
+        return False
+
+    def _modified_chains(self, table_name, applied, wrapped):
+        """Return iptables-restore --noflush input for the wrapped chains.
+
+        Declaring a chain creates it or flushes its rules, so the chains
+        which changed are declared and refilled, and the chains which went
+        away are declared and deleted.
+        """
+        changed = sorted(chain for chain, rules in wrapped.iteritems()
+                         if applied.get(chain) != rules)
+        removed = sorted(chain for chain in applied
+                         if chain not in wrapped)
+        if not changed and not removed:
+            return []
+        lines = ['*%s' % table_name]
+        lines += [':%s-%s - [0:0]' % (binary_name, chain)
+                  for chain in changed + removed]
+        for chain in changed:
+            lines += wrapped[chain]
+        lines += ['-X %s-%s' % (binary_name, chain) for chain in removed]
+        lines.append('COMMIT')
+        return lines
+
+    def _restore(self, cmd, lines, noflush=False):
+        args = ['%s-restore' % (cmd,)]
+        args.append(noflush and '--noflush' or '-c')
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        process_input = '\n'.join(lines)
+        if noflush:
+            process_input += '\n'
+        self.execute(args, process_input=process_input,
+                     root_helper=self.root_helper)
+        return len(process_input)
+
+    def _restore_all(self, cmd, tables):
+        args = ['%s-save' % (cmd,), '-c']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        all_tables = self.execute(args, root_helper=self.root_helper)
+        all_lines = all_tables.split('\n')
+        for table_name, table in tables.iteritems():
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                all_lines[start:end], table, table_name)
+        return self._restore(cmd, all_lines)
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -407,83 +576,6 @@ class IptablesManager(object):
                           '# Completed by iptables_manager']
             current_lines = fake_table
 
-        # Fill old_filter with any chains or rules we might have added,
-        # they could have a [packet:byte] count we want to preserve.
-        # Fill new_filter with any chains or rules without our name in them.
-        old_filter, new_filter = [], []
-        for line in current_lines:
-            (old_filter if binary_name in line else
-             new_filter).append(line.strip())
-
-        rules_index = self._find_rules_index(new_filter)
-
-        all_chains = [':%s' % name for name in unwrapped_chains]
-        all_chains += [':%s-%s' % (binary_name, name) for name in chains]
-
-        # Iterate through all the chains, trying to find an existing
-        # match.
-        our_chains = []
-        for chain in all_chains:
-            chain_str = str(chain).strip()
-
-            orig_filter = [s for s in old_filter if chain_str in s.strip()]
-            dup_filter = [s for s in new_filter if chain_str in s.strip()]
-            new_filter = [s for s in new_filter if chain_str not in s.strip()]
-
-            # if no old or duplicates, use original chain
-            if orig_filter:
-                # grab the last entry, if there is one
-                old = orig_filter[-1]
-                chain_str = str(old).strip()
-            elif dup_filter:
-                # grab the last entry, if there is one
-                dup = dup_filter[-1]
-                chain_str = str(dup).strip()
-            else:
-                # add-on the [packet:bytes]
-                chain_str += ' - [0:0]'
-
-            our_chains += [chain_str]
-
-        # Iterate through all the rules, trying to find an existing
-        # match.
-        our_rules = []
-        bot_rules = []
-        for rule in rules:
-            rule_str = str(rule).strip()
-            # Further down, we weed out duplicates from the bottom of the
-            # list, so here we remove the dupes ahead of time.
-
-            orig_filter = [s for s in old_filter if rule_str in s.strip()]
-            dup_filter = [s for s in new_filter if rule_str in s.strip()]
-            new_filter = [s for s in new_filter if rule_str not in s.strip()]
-
-            # if no old or duplicates, use original rule
-            if orig_filter:
-                # grab the last entry, if there is one
-                old = orig_filter[-1]
-                rule_str = str(old).strip()
-            elif dup_filter:
-                # grab the last entry, if there is one
-                dup = dup_filter[-1]
-                rule_str = str(dup).strip()
-                # backup one index so we write the array correctly
-                rules_index -= 1
-            else:
-                # add-on the [packet:bytes]
-                rule_str = '[0:0] ' + rule_str
-
-            if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                our_rules += [rule_str]
-            else:
-                bot_rules += [rule_str]
-
-        our_rules += bot_rules
-
-        new_filter[rules_index:rules_index] = our_rules
-        new_filter[rules_index:rules_index] = our_chains
-
         def _strip_packets_bytes(line):
             # strip any [packet:byte] counts at start or end of lines
             if line.startswith(':'):
@@ -496,66 +588,92 @@ class IptablesManager(object):
             line = line.strip()
             return line
 
-        seen_chains = set()
-
-        def _weed_out_duplicate_chains(line):
-            # ignore [packet:byte] counts at end of lines
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                if line in seen_chains:
-                    return False
-                else:
-                    seen_chains.add(line)
-
-            # Leave it alone
-            return True
-
-        seen_rules = set()
-
-        def _weed_out_duplicate_rules(line):
-            if line.startswith('['):
-                line = _strip_packets_bytes(line)
-                if line in seen_rules:
-                    return False
-                else:
-                    seen_rules.add(line)
+        # Index any chains or rules we might have added, they could have a
+        # [packet:byte] count we want to preserve, and the chains or rules
+        # without our name in them, by their text without the counts.
+        # Fill new_filter with the lines without our name in them.
+        old_lines, new_lines = {}, {}
+        new_filter = []
+        for line in current_lines:
+            line = line.strip()
+            if binary_name in line:
+                lines = old_lines
+            else:
+                lines = new_lines
+                new_filter.append(line)
+            if line.startswith(':') or line.startswith('['):
+                # the last occurrence takes precedence
+                lines[_strip_packets_bytes(line)] = line
+
+        # Find an existing line for each of our chains and rules, the ones
+        # without our name in them are moved to our section of the table.
+        moved = set()
+
+        def _find_line(key, default):
+            if key in new_lines:
+                moved.add(key)
+            return old_lines.get(key) or new_lines.get(key) or default
+
+        all_chains = [name for name in unwrapped_chains]
+        all_chains += ['%s-%s' % (binary_name, name) for name in chains]
+        our_chains = [_find_line(name, ':%s - [0:0]' % name)
+                      for name in all_chains]
 
-            # Leave it alone
-            return True
+        our_rules = []
+        bot_rules = []
+        for rule in rules:
+            rule_str = str(rule).strip()
+            rule_str = _find_line(rule_str, '[0:0] ' + rule_str)
+            if rule.top:
+                # rule.top == True means we want this rule to be at the top.
+                our_rules.append(rule_str)
+            else:
+                bot_rules.append(rule_str)
 
-        def _weed_out_removes(line):
-            # We need to find exact matches here
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
-            elif line.startswith('['):
-                line = _strip_packets_bytes(line)
-                for rule in remove_rules:
-                    rule_str = _strip_packets_bytes(str(rule))
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+        if moved:
+            new_filter = [line for line in new_filter
+                          if not ((line.startswith(':') or
+                                   line.startswith('[')) and
+                                  _strip_packets_bytes(line) in moved)]
 
-            # Leave it alone
-            return True
+        rules_index = self._find_rules_index(new_filter)
+        our_rules += bot_rules
+        new_filter[rules_index:rules_index] = our_chains + our_rules
 
         # We filter duplicates.  Go throught the chains and rules, letting
         # the *last* occurrence take precendence since it could have a
         # non-zero [packet:byte] count we want to preserve.  We also filter
-        # out anything in the "remove" list.
-        new_filter.reverse()
-        new_filter = [line for line in new_filter
-                      if _weed_out_duplicate_chains(line) and
-                      _weed_out_duplicate_rules(line) and
-                      _weed_out_removes(line)]
-        new_filter.reverse()
+        # out anything in the "remove" list, matching it exactly.
+        chains_to_remove = set(remove_chains)
+        rules_to_remove = {}
+        for rule in remove_rules:
+            rule_str = str(rule).strip()
+            rules_to_remove[rule_str] = rules_to_remove.get(rule_str, 0) + 1
+        seen_chains = set()
+        seen_rules = set()
+        filtered = []
+        for line in reversed(new_filter):
+            if line.startswith(':'):
+                line_key = _strip_packets_bytes(line)
+                if line_key in seen_chains:
+                    continue
+                seen_chains.add(line_key)
+                if line_key in chains_to_remove:
+                    chains_to_remove.remove(line_key)
+                    continue
+            elif line.startswith('['):
+                line_key = _strip_packets_bytes(line)
+                if line_key in seen_rules:
+                    continue
+                seen_rules.add(line_key)
+                if rules_to_remove.get(line_key):
+                    rules_to_remove[line_key] -= 1
+                    continue
+            filtered.append(line)
+        filtered.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
-        return new_filter
+        return filtered
@@ -18,6 +18,9 @@
 # @author: Dan Wendlandt, Nicira Networks, Inc.
 # @author: Dave Lapsley, Nicira Networks, Inc.
 
+import contextlib
+import itertools
+import operator
 import re
 
 from neutron.agent.linux import ip_lib
@@ -29,6 +32,11 @@ from neutron.plugins.openvswitch.common import constants
 LOG = logging.getLogger(__name__)
 
 
+def _get_json_ofport(ofport):
+    # the ofport of an interface being added is an empty set
+    return ofport if isinstance(ofport, int) else -1
+
+
 class VifPort:
     def __init__(self, port_name, ofport, vif_id, vif_mac, switch):
         self.port_name = port_name
@@ -49,6 +57,11 @@ class OVSBridge:
         self.br_name = br_name
         self.root_helper = root_helper
         self.re_id = self.re_compile_id()
+        self.defer_apply_flows = False
+        # (action, flow) pairs in the order they were requested
+        self.deferred_flows = []
+        # iface-ids of XenServer VIFs by xs-vif-uuid
+        self.xapi_iface_ids = {}
 
     def re_compile_id(self):
         external = 'external_ids\s*'
@@ -92,10 +105,11 @@ class OVSBridge:
         args = ["clear", table_name, record, column]
         self.run_vsctl(args)
 
-    def run_ofctl(self, cmd, args):
+    def run_ofctl(self, cmd, args, process_input=None):
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
         try:
-            return utils.execute(full_args, root_helper=self.root_helper)
+            return utils.execute(full_args, root_helper=self.root_helper,
+                                 process_input=process_input)
         except Exception as e:
             LOG.error(_("Unable to execute %(cmd)s. Exception: %(exception)s"),
                       {'cmd': full_args, 'exception': e})
@@ -146,6 +160,14 @@ class OVSBridge:
             flow_expr_arr.append(match)
         return flow_expr_arr
 
+    def _apply_flow(self, action, flow_str):
+        if self.defer_apply_flows:
+            self.deferred_flows.append((action, flow_str))
+        elif action == 'add':
+            self.run_ofctl("add-flow", [flow_str])
+        else:
+            self.run_ofctl("%s-flows" % action, [flow_str])
+
     def add_flow(self, **kwargs):
         if "actions" not in kwargs:
             raise Exception(_("Must specify one or more actions"))
@@ -155,7 +177,17 @@ class OVSBridge:
         flow_expr_arr = self._build_flow_expr_arr(**kwargs)
         flow_expr_arr.append("actions=%s" % (kwargs["actions"]))
         flow_str = ",".join(flow_expr_arr)
-        self.run_ofctl("add-flow", [flow_str])
+        self._apply_flow('add', flow_str)
+
+    def mod_flow(self, **kwargs):
+        if "actions" not in kwargs:
+            raise Exception(_("Must specify one or more actions"))
+        # like a deletion, a modification only takes a match
+        kwargs['delete'] = True
+        flow_expr_arr = self._build_flow_expr_arr(**kwargs)
+        flow_expr_arr.append("actions=%s" % (kwargs["actions"]))
+        flow_str = ",".join(flow_expr_arr)
+        self._apply_flow('mod', flow_str)
 
     def delete_flows(self, **kwargs):
         kwargs['delete'] = True
@@ -163,7 +195,41 @@ class OVSBridge:
         if "actions" in kwargs:
             flow_expr_arr.append("actions=%s" % (kwargs["actions"]))
         flow_str = ",".join(flow_expr_arr)
-        self.run_ofctl("del-flows", [flow_str])
+        self._apply_flow('del', flow_str)
+
+    def defer_apply_on(self):
+        self.defer_apply_flows = True
+
+    def defer_apply_off(self):
+        """Apply the deferred flows, one ovs-ofctl call per run of actions.
+
+        Consecutive flows of the same action are fed to a single ovs-ofctl
+        on its stdin, so the flows keep the order they were requested in.
+        """
+        deferred_flows, self.deferred_flows = self.deferred_flows, []
+        self.defer_apply_flows = False
+        for action, flows in itertools.groupby(deferred_flows,
+                                               operator.itemgetter(0)):
+            flows = [flow_str for action, flow_str in flows]
+            LOG.debug(_("Applying %(count)d deferred %(action)s flows to "
+                        "bridge %(bridge)s"),
+                      {'count': len(flows), 'action': action,
+                       'bridge': self.br_name})
+            self.run_ofctl("%s-flows" % action, ['-'],
+                           process_input='\n'.join(flows) + '\n')
+
+    @contextlib.contextmanager
+    def defer_apply(self):
+        """Defer the flow changes made within the block to its end."""
+        if self.defer_apply_flows:
+            # already deferred by an outer block
+            yield
+            return
+        self.defer_apply_on()
+        try:
+            yield
+        finally:
+            self.defer_apply_off()
 
     def add_tunnel_port(self, port_name, remote_ip,
                         tunnel_type=constants.TYPE_GRE,
@@ -222,57 +288,77 @@ class OVSBridge:
         return self.db_get_map("Interface", port_name, "statistics")
 
     def get_xapi_iface_id(self, xs_vif_uuid):
+        iface_id = self.xapi_iface_ids.get(xs_vif_uuid)
+        if iface_id:
+            return iface_id
         args = ["xe", "vif-param-get", "param-name=other-config",
                 "param-key=nicira-iface-id", "uuid=%s" % xs_vif_uuid]
         try:
-            return utils.execute(args, root_helper=self.root_helper).strip()
+            iface_id = utils.execute(args,
+                                     root_helper=self.root_helper).strip()
         except Exception as e:
             LOG.error(_("Unable to execute %(cmd)s. Exception: %(exception)s"),
                       {'cmd': args, 'exception': e})
+            return
+        if iface_id:
+            self.xapi_iface_ids[xs_vif_uuid] = iface_id
+        return iface_id
+
+    def _get_vif_id(self, external_ids):
+        """Return the iface-id of a VIF interface, None for other ones."""
+        if "attached-mac" not in external_ids:
+            return
+        if "iface-id" in external_ids:
+            return external_ids["iface-id"]
+        if "xs-vif-uuid" in external_ids:
+            # if this is a xenserver and iface-id is not automatically
+            # synced to OVS from XAPI, we grab it from XAPI directly
+            return self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
+
+    def _get_vif_interfaces(self, columns):
+        """Yield the rows of the Interface table for the bridge ports.
+
+        Each row maps the name and external_ids columns, followed by the
+        other requested columns, to their value. The iface-ids cached for
+        XenServer VIFs which are no longer on the bridge are dropped.
+        """
+        port_names = set(self.get_port_name_list())
+        columns = ['name', 'external_ids'] + columns
+        args = ['--format=json', '--', '--columns=%s' % ','.join(columns),
+                'list', 'Interface']
+        result = self.run_vsctl(args)
+        if not result:
+            return
+        xs_vif_uuids = set()
+        for row in jsonutils.loads(result)['data']:
+            row = dict(zip(columns, row))
+            if row['name'] not in port_names:
+                continue
+            row['external_ids'] = dict(row['external_ids'][1])
+            if 'xs-vif-uuid' in row['external_ids']:
+                xs_vif_uuids.add(row['external_ids']['xs-vif-uuid'])
+            yield row
+        for xs_vif_uuid in set(self.xapi_iface_ids) - xs_vif_uuids:
+            del self.xapi_iface_ids[xs_vif_uuid]
 
     # returns a VIF object for each VIF port
     def get_vif_ports(self):
         edge_ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids")
-            ofport = self.db_get_val("Interface", name, "ofport")
-            if "iface-id" in external_ids and "attached-mac" in external_ids:
-                p = VifPort(name, ofport, external_ids["iface-id"],
-                            external_ids["attached-mac"], self)
-                edge_ports.append(p)
-            elif ("xs-vif-uuid" in external_ids and
-                  "attached-mac" in external_ids):
-                # if this is a xenserver and iface-id is not automatically
-                # synced to OVS from XAPI, we grab it from XAPI directly
-                iface_id = self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
-                p = VifPort(name, ofport, iface_id,
-                            external_ids["attached-mac"], self)
-                edge_ports.append(p)
-
+        for row in self._get_vif_interfaces(['ofport']):
+            vif_id = self._get_vif_id(row['external_ids'])
+            if vif_id:
+                ofport = _get_json_ofport(row['ofport'])
+                edge_ports.append(VifPort(row['name'], ofport, vif_id,
+                                          row['external_ids']['attached-mac'],
+                                          self))
         return edge_ports
 
     def get_vif_port_set(self):
-        port_names = self.get_port_name_list()
         edge_ports = set()
-        args = ['--format=json', '--', '--columns=name,external_ids',
-                'list', 'Interface']
-        result = self.run_vsctl(args)
-        if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
-            if name not in port_names:
-                continue
-            external_ids = dict(row[1][1])
-            if "iface-id" in external_ids and "attached-mac" in external_ids:
-                edge_ports.add(external_ids['iface-id'])
-            elif ("xs-vif-uuid" in external_ids and
-                  "attached-mac" in external_ids):
-                # if this is a xenserver and iface-id is not automatically
-                # synced to OVS from XAPI, we grab it from XAPI directly
-                iface_id = self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
-                edge_ports.add(iface_id)
+        for row in self._get_vif_interfaces([]):
+            vif_id = self._get_vif_id(row['external_ids'])
+            if vif_id:
+                edge_ports.add(vif_id)
         return edge_ports
 
     def get_vif_port_by_id(self, port_id):
@@ -293,6 +379,29 @@ class OVSBridge:
             LOG.info(_("Unable to parse regex results. Exception: %s"), e)
             return
 
+    def get_vif_ports_by_ids(self, port_ids):
+        """Return the VifPorts of several iface-ids with one ovs-vsctl call.
+
+        The result maps each iface-id found in the database to its VifPort.
+        """
+        port_ids = set(port_ids)
+        vif_ports = {}
+        if not port_ids:
+            return vif_ports
+        args = ['--format=json', '--', '--columns=name,external_ids,ofport',
+                'list', 'Interface']
+        result = self.run_vsctl(args)
+        if not result:
+            return vif_ports
+        for name, external_ids, ofport in jsonutils.loads(result)['data']:
+            external_ids = dict(external_ids[1])
+            vif_id = external_ids.get('iface-id')
+            if vif_id not in port_ids or 'attached-mac' not in external_ids:
+                continue
+            vif_ports[vif_id] = VifPort(name, _get_json_ofport(ofport), vif_id,
+                                        external_ids['attached-mac'], self)
+        return vif_ports
+
     def delete_ports(self, all_ports=False):
         if all_ports:
             port_names = self.get_port_name_list()
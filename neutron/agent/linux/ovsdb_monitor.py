@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Watches an OVSDB table with a long-lived ovsdb-client monitor."""
+
+import shlex
+
+import eventlet
+from eventlet.green import subprocess
+from eventlet import queue
+
+from neutron.common import utils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class OvsdbMonitor(object):
+    """Runs 'ovsdb-client monitor' on a table and collects its updates.
+
+    ovsdb-client first prints the current rows of the table, then one
+    update per change to the monitored columns. Every line it prints is
+    queued as an update; get_updates() lets a caller wait for them
+    instead of polling the database.
+    """
+
+    def __init__(self, table_name, columns=None, root_helper=None):
+        self.table_name = table_name
+        self.columns = columns
+        self.root_helper = root_helper
+        self._process = None
+        self._reader = None
+        self._updates = queue.LightQueue()
+
+    def _cmd(self):
+        cmd = ['ovsdb-client', 'monitor', self.table_name]
+        if self.columns:
+            cmd.append(','.join(self.columns))
+        cmd.append('--format=json')
+        if self.root_helper:
+            cmd = shlex.split(self.root_helper) + cmd
+        return cmd
+
+    def start(self):
+        """Start ovsdb-client, stopping any previous instance."""
+        self.stop()
+        cmd = self._cmd()
+        LOG.debug(_("Starting OVSDB monitor: %s"), cmd)
+        self._process = utils.subprocess_popen(cmd,
+                                               stdout=subprocess.PIPE,
+                                               stderr=subprocess.PIPE)
+        self._reader = eventlet.spawn(self._read_updates, self._process)
+
+    def stop(self):
+        process, self._process = self._process, None
+        if self._reader:
+            self._reader.kill()
+            self._reader = None
+        if process and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def is_active(self):
+        """Whether ovsdb-client is still running."""
+        return self._process is not None and self._process.poll() is None
+
+    def _read_updates(self, process):
+        for line in iter(process.stdout.readline, ''):
+            line = line.strip()
+            if line:
+                self._updates.put(line)
+        process.wait()
+        LOG.error(_("OVSDB monitor of %(table)s exited with %(code)s: "
+                    "%(stderr)s"),
+                  {'table': self.table_name, 'code': process.returncode,
+                   'stderr': process.stderr.read()})
+        # wake up a waiting caller so that it notices the monitor is gone
+        self._updates.put(None)
+
+    def get_updates(self, timeout=0):
+        """Return the updates received since the last call.
+
+        Waits up to timeout seconds for the first update when there is
+        none yet, or until the monitor exits.
+        """
+        updates = []
+        try:
+            if timeout:
+                update = self._updates.get(timeout=timeout)
+            else:
+                update = self._updates.get_nowait()
+            while True:
+                if update is not None:
+                    updates.append(update)
+                update = self._updates.get_nowait()
+        except queue.Empty:
+            pass
+        return updates
@@ -68,10 +68,13 @@ class PluginApi(proxy.RpcProxy):
 
     API version history:
         1.0 - Initial version.
+        1.3 - get_devices_details_list and update_devices_down, only
+              supported by the openvswitch plugin.
 
     '''
 
     BASE_RPC_API_VERSION = '1.1'
+    BULK_DEVICES_RPC_API_VERSION = '1.3'
 
     def __init__(self, topic):
         super(PluginApi, self).__init__(
@@ -83,12 +86,26 @@ class PluginApi(proxy.RpcProxy):
                                        agent_id=agent_id),
                          topic=self.topic)
 
+    def get_devices_details_list(self, context, devices, agent_id):
+        return self.call(context,
+                         self.make_msg('get_devices_details_list',
+                                       devices=devices, agent_id=agent_id),
+                         version=self.BULK_DEVICES_RPC_API_VERSION,
+                         topic=self.topic)
+
     def update_device_down(self, context, device, agent_id):
         return self.call(context,
                          self.make_msg('update_device_down', device=device,
                                        agent_id=agent_id),
                          topic=self.topic)
 
+    def update_devices_down(self, context, devices, agent_id):
+        return self.call(context,
+                         self.make_msg('update_devices_down', devices=devices,
+                                       agent_id=agent_id),
+                         version=self.BULK_DEVICES_RPC_API_VERSION,
+                         topic=self.topic)
+
     def update_device_up(self, context, device, agent_id):
         return self.call(context,
                          self.make_msg('update_device_up', device=device,
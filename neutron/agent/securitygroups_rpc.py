@@ -16,19 +16,48 @@
 #    under the License.
 #
 
+import contextlib
+import time
+
+from eventlet import greenthread
 from oslo.config import cfg
 
+from neutron.common import constants
 from neutron.common import topics
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common.rpc import common as rpc_common
 
 LOG = logging.getLogger(__name__)
 SG_RPC_VERSION = "1.1"
+# Version of security_group_info_for_devices, security_group_info_for_groups
+# and security_group_member_ips, older servers reject them
+SG_INFO_RPC_VERSION = "1.2"
+
+IP_MASK = {constants.IPv4: 32,
+           constants.IPv6: 128}
+DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
+                       'egress': 'dest_ip_prefix'}
 
 security_group_opts = [
     cfg.StrOpt(
         'firewall_driver',
-        default='neutron.agent.firewall.NoopFirewallDriver')
+        default='neutron.agent.firewall.NoopFirewallDriver'),
+    cfg.BoolOpt(
+        'enable_ipset',
+        default=False,
+        help=_('Match remote security group members with one ipset per '
+               'group instead of one iptables rule per member address')),
+    cfg.FloatOpt(
+        'defer_apply_window',
+        default=0,
+        help=_('Seconds to wait for further firewall changes before '
+               'applying them, 0 applies every change at once')),
+    cfg.FloatOpt(
+        'defer_apply_max_latency',
+        default=2,
+        help=_('Maximum number of seconds a firewall change waits for '
+               'further changes before being applied'))
 ]
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
@@ -56,6 +85,35 @@ class SecurityGroupServerRpcApiMixin(object):
                          version=SG_RPC_VERSION,
                          topic=self.topic)
 
+    def security_group_info_for_devices(self, context, devices):
+        LOG.debug(_("Get security group information "
+                    "for devices via rpc %r"), devices)
+        return self.call(context,
+                         self.make_msg('security_group_info_for_devices',
+                                       devices=devices),
+                         version=SG_INFO_RPC_VERSION,
+                         topic=self.topic)
+
+    def security_group_info_for_groups(self, context, security_groups,
+                                       versions):
+        LOG.debug(_("Get definitions of security groups "
+                    "via rpc %r"), security_groups)
+        return self.call(context,
+                         self.make_msg('security_group_info_for_groups',
+                                       security_groups=security_groups,
+                                       versions=versions),
+                         version=SG_INFO_RPC_VERSION,
+                         topic=self.topic)
+
+    def security_group_member_ips(self, context, security_groups):
+        LOG.debug(_("Get member addresses of security groups "
+                    "via rpc %r"), security_groups)
+        return self.call(context,
+                         self.make_msg('security_group_member_ips',
+                                       security_groups=security_groups),
+                         version=SG_INFO_RPC_VERSION,
+                         topic=self.topic)
+
 
 class SecurityGroupAgentRpcCallbackMixin(object):
     """A mix-in that enable SecurityGroup agent
@@ -90,23 +148,150 @@ class SecurityGroupAgentRpcCallbackMixin(object):
         self.sg_agent.security_groups_provider_updated()
 
 
+class FirewallApplyScheduler(object):
+    """Coalesce the firewall changes of an agent into fewer applies.
+
+    The firewall stays in deferred apply mode while changes keep coming.
+    It is applied once no change came for window seconds, or max_latency
+    seconds after the first change not applied yet, whichever comes first.
+    A failed apply sets apply_failed, which the agent checks to resync.
+    """
+
+    def __init__(self, firewall, window, max_latency):
+        self.firewall = firewall
+        self.window = window
+        self.max_latency = max(window, max_latency)
+        self._first_change = None
+        self._pending = 0
+        self._active = 0
+        self._timer = None
+        self.apply_failed = False
+        self.stats = {'applies': 0,
+                      'changes': 0,
+                      'max_coalesced': 0}
+
+    @contextlib.contextmanager
+    def defer_apply(self):
+        """Defer the apply of the changes made in the context."""
+        if self._first_change is None:
+            self.firewall.filter_defer_apply_on()
+            self._first_change = time.time()
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._pending += 1
+            self._schedule()
+
+    def _schedule(self):
+        now = time.time()
+        deadline = min(now + self.window,
+                       self._first_change + self.max_latency)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = greenthread.spawn_after(max(deadline - now, 0),
+                                              self.apply)
+
+    def apply(self):
+        """Apply the pending changes now."""
+        if self._active:
+            # Changes are being made, the apply is scheduled again once
+            # they are done
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._first_change is None:
+            return
+        pending = self._pending
+        latency = time.time() - self._first_change
+        self._first_change = None
+        self._pending = 0
+        self.stats['applies'] += 1
+        self.stats['changes'] += pending
+        self.stats['max_coalesced'] = max(self.stats['max_coalesced'],
+                                          pending)
+        LOG.debug(_("Applying %(pending)d firewall changes after "
+                    "%(latency).3f seconds"),
+                  {'pending': pending, 'latency': latency})
+        try:
+            self.firewall.filter_defer_apply_off()
+        except Exception:
+            LOG.exception(_("Failed to apply firewall changes"))
+            self.apply_failed = True
+
+
 class SecurityGroupAgentRpcMixin(object):
     """A mix-in that enable SecurityGroup agent
     support in agent implementations.
     """
+    # set by init_firewall when firewall changes are coalesced
+    apply_scheduler = None
 
     def init_firewall(self):
         firewall_driver = cfg.CONF.SECURITYGROUP.firewall_driver
         LOG.debug(_("Init firewall settings (driver=%s)"), firewall_driver)
         self.firewall = importutils.import_object(firewall_driver)
+        self.apply_scheduler = None
+        if cfg.CONF.SECURITYGROUP.defer_apply_window > 0:
+            self.apply_scheduler = FirewallApplyScheduler(
+                self.firewall,
+                cfg.CONF.SECURITYGROUP.defer_apply_window,
+                cfg.CONF.SECURITYGROUP.defer_apply_max_latency)
+        self.use_ipset = self.firewall.uses_ipset
+        # security group definitions by id, see
+        # security_group_info_for_groups
+        self.sg_cache = {}
+        self.use_group_cache = True
+
+    def firewall_apply_failed(self):
+        """Return whether a coalesced firewall apply failed.
+
+        The caller is expected to resync its devices, the failure is
+        reported only once.
+        """
+        if self.apply_scheduler and self.apply_scheduler.apply_failed:
+            self.apply_scheduler.apply_failed = False
+            return True
+        return False
+
+    def _get_devices(self, device_ids):
+        """Return the devices with their security group rules.
+
+        With ipset the server does not expand remote groups into one rule
+        per member; the members are passed to the firewall once per group.
+        """
+        if self.use_ipset:
+            try:
+                info = self.plugin_rpc.security_group_info_for_devices(
+                    self.context, device_ids)
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+                LOG.warning(_("Server does not support "
+                              "security_group_info_for_devices, falling back "
+                              "to per member rules"))
+                self.use_ipset = False
+            else:
+                for sg_id, sg_members in info['sg_member_ips'].iteritems():
+                    self.firewall.update_security_group_members(sg_id,
+                                                                sg_members)
+                return info['devices']
+        return self.plugin_rpc.security_group_rules_for_devices(
+            self.context, device_ids)
+
+    def _defer_apply(self):
+        if self.apply_scheduler:
+            return self.apply_scheduler.defer_apply()
+        return self.firewall.defer_apply()
 
     def prepare_devices_filter(self, device_ids):
         if not device_ids:
             return
         LOG.info(_("Preparing filters for devices %s"), device_ids)
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, list(device_ids))
-        with self.firewall.defer_apply():
+        devices = self._get_devices(list(device_ids))
+        with self._defer_apply():
             for device in devices.values():
                 self.firewall.prepare_port_filter(device)
 
@@ -120,18 +305,138 @@ class SecurityGroupAgentRpcMixin(object):
     def security_groups_member_updated(self, security_groups):
         LOG.info(_("Security group "
                    "member updated %r"), security_groups)
+        if self.use_ipset:
+            self._update_security_group_members(security_groups)
+            return
         self._security_group_updated(
             security_groups,
             'security_group_source_groups')
 
+    def _update_security_group_members(self, security_groups):
+        remote_groups = set()
+        for device in self.firewall.ports.values():
+            remote_groups.update(
+                device.get('security_group_source_groups', []))
+        security_groups = remote_groups.intersection(security_groups)
+        if not security_groups:
+            return
+        members = self.plugin_rpc.security_group_member_ips(
+            self.context, list(security_groups))
+        for sg_id, sg_members in members.iteritems():
+            self.firewall.update_security_group_members(sg_id, sg_members)
+
     def _security_group_updated(self, security_groups, attribute):
         #check need update or not
+        security_groups = set(security_groups)
+        devices = [device for device in self.firewall.ports.values()
+                   if security_groups.intersection(device.get(attribute,
+                                                              []))]
+        if not devices:
+            return
+        if self.use_group_cache:
+            try:
+                self._refresh_devices_from_group_cache(devices)
+                return
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+                LOG.warning(_("Server does not support "
+                              "security_group_info_for_groups, refreshing "
+                              "devices from the server"))
+                self.use_group_cache = False
+        self.refresh_firewall([device['device'] for device in devices])
+
+    def _update_group_cache(self, security_groups):
+        """Fetch the groups whose definition changed, return their ids."""
+        known = set(security_groups)
+        for sg_id in security_groups:
+            group = self.sg_cache.get(sg_id)
+            if group:
+                known.update(rule['remote_group_id']
+                             for rule in group['rules']
+                             if rule.get('remote_group_id'))
+        versions = dict((sg_id, self.sg_cache[sg_id]['version'])
+                        for sg_id in known if sg_id in self.sg_cache)
+        groups = self.plugin_rpc.security_group_info_for_groups(
+            self.context, list(security_groups), versions)
+        self.sg_cache.update(groups)
+        return set(groups)
+
+    def _refresh_devices_from_group_cache(self, devices):
+        security_groups = set()
+        for device in devices:
+            security_groups.update(device.get('security_groups', []))
+        changed = self._update_group_cache(security_groups)
+        if not changed:
+            LOG.debug(_("Security groups %s did not change"),
+                      list(security_groups))
+            return
+        if self.use_ipset:
+            for sg_id in changed:
+                self.firewall.update_security_group_members(
+                    sg_id, self.sg_cache[sg_id]['members'])
+        with self._defer_apply():
+            for device in devices:
+                groups = set(device.get('security_groups', []))
+                if not self.use_ipset:
+                    groups.update(
+                        device.get('security_group_source_groups', []))
+                if not changed.intersection(groups):
+                    continue
+                LOG.debug(_("Update port filter for %s"), device['device'])
+                self.firewall.update_port_filter(
+                    self._build_device_from_group_cache(device))
+
+    def _build_device_from_group_cache(self, device):
+        """Rebuild the rules of a device from the cached groups.
+
+        Rules which do not belong to a security group, like the provider
+        rules, are kept from the device.
+        """
+        device = device.copy()
+        rules = [rule for rule in device.get('security_group_rules', [])
+                 if 'security_group_id' not in rule]
+        source_groups = set()
+        for sg_id in device.get('security_groups', []):
+            group = self.sg_cache.get(sg_id)
+            if not group:
+                continue
+            for rule in group['rules']:
+                remote_group_id = rule.get('remote_group_id')
+                if not remote_group_id:
+                    rules.append(rule.copy())
+                    continue
+                source_groups.add(remote_group_id)
+                if self.use_ipset:
+                    rules.append(rule.copy())
+                else:
+                    rules.extend(self._expand_remote_group_rule(device,
+                                                                rule))
+        device['security_group_rules'] = rules
+        device['security_group_source_groups'] = list(source_groups)
+        return device
+
+    def _expand_remote_group_rule(self, device, rule):
+        ethertype = rule['ethertype']
+        direction_ip_prefix = DIRECTION_IP_PREFIX[rule['direction']]
+        group = self.sg_cache.get(rule['remote_group_id'], {})
+        fixed_ips = set(device.get('fixed_ips', []))
+        rules = []
+        for ip in group.get('members', {}).get(ethertype, []):
+            if ip in fixed_ips:
+                continue
+            ip_rule = rule.copy()
+            ip_rule[direction_ip_prefix] = '%s/%s' % (ip, IP_MASK[ethertype])
+            rules.append(ip_rule)
+        return rules
+
+    def _prune_group_cache(self):
+        used = set()
         for device in self.firewall.ports.values():
-            if set(device.get(attribute,
-                              [])).intersection(
-                    set(security_groups)):
-                    self.refresh_firewall()
-                    return
+            used.update(device.get('security_groups', []))
+            used.update(device.get('security_group_source_groups', []))
+        for sg_id in set(self.sg_cache) - used:
+            del self.sg_cache[sg_id]
 
     def security_groups_provider_updated(self):
         LOG.info(_("Provider rule updated"))
@@ -141,21 +446,22 @@ class SecurityGroupAgentRpcMixin(object):
         if not device_ids:
             return
         LOG.info(_("Remove device filter for %r"), device_ids)
-        with self.firewall.defer_apply():
+        with self._defer_apply():
             for device_id in device_ids:
                 device = self.firewall.ports.get(device_id)
                 if not device:
                     continue
                 self.firewall.remove_port_filter(device)
+        self._prune_group_cache()
 
-    def refresh_firewall(self):
+    def refresh_firewall(self, device_ids=None):
         LOG.info(_("Refresh firewall rules"))
-        device_ids = self.firewall.ports.keys()
         if not device_ids:
-            return
-        devices = self.plugin_rpc.security_group_rules_for_devices(
-            self.context, device_ids)
-        with self.firewall.defer_apply():
+            device_ids = self.firewall.ports.keys()
+            if not device_ids:
+                return
+        devices = self._get_devices(device_ids)
+        with self._defer_apply():
             for device in devices.values():
                 LOG.debug(_("Update port filter for %s"), device['device'])
                 self.firewall.update_port_filter(device)
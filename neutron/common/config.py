@@ -74,6 +74,10 @@ core_opts = [
     cfg.IntOpt('dhcp_lease_duration', default=120,
                deprecated_name='dhcp_lease_time',
                help=_("DHCP lease duration")),
+    cfg.IntOpt('ip_recycle_interval', default=0,
+               help=_("Seconds between returning addresses with expired "
+                      "leases to the allocation pools in the background. "
+                      "0 disables the background recycler")),
     cfg.BoolOpt('dhcp_agent_notification', default=True,
                 help=_("Allow sending resource operation"
                        " notification to DHCP agent")),
@@ -17,6 +17,7 @@
 
 from neutron import context
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import rpc
 from neutron.openstack.common.rpc import dispatcher
 
 
@@ -42,3 +43,16 @@ class PluginRpcDispatcher(dispatcher.RpcDispatcher):
         neutron_ctxt = context.Context(user_id, tenant_id, **rpc_ctxt_dict)
         return super(PluginRpcDispatcher, self).dispatch(
             neutron_ctxt, version, method, namespace, **kwargs)
+
+
+def reset_connection_pool():
+    """Forget the pooled message broker connections of the parent process.
+
+    A forked process shares the sockets of the connections it inherited
+    with its parent. They are dropped without being closed, so that the
+    child opens its own connections on first use.
+    """
+    connection_cls = getattr(rpc._get_impl(), 'Connection', None)
+    if getattr(connection_cls, 'pool', None):
+        LOG.debug(_("Dropping the inherited RPC connection pool"))
+        connection_cls.pool = None
@@ -367,13 +367,18 @@ class DhcpAgentSchedulerDbMixin(dhcpagentscheduler
         else:
             return {'networks': []}
 
-    def list_active_networks_on_active_dhcp_agent(self, context, host):
+    def list_active_networks_on_active_dhcp_agent(self, context, host,
+                                                  network_ids=None):
+        """List the active networks of the agent, limited to network_ids."""
         agent = self._get_agent_by_type_and_host(
             context, constants.AGENT_TYPE_DHCP, host)
-        if not agent.admin_state_up:
+        if not agent.admin_state_up or network_ids == []:
             return []
         query = context.session.query(NetworkDhcpAgentBinding.network_id)
         query = query.filter(NetworkDhcpAgentBinding.dhcp_agent_id == agent.id)
+        if network_ids is not None:
+            query = query.filter(
+                NetworkDhcpAgentBinding.network_id.in_(network_ids))
 
         net_ids = [item[0] for item in query]
         if net_ids:
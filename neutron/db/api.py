@@ -27,6 +27,8 @@ LOG = logging.getLogger(__name__)
 
 _DB_ENGINE = None
 BASE = model_base.BASEV2
+# connection pools inherited from the parent process, see reset_pool()
+_INHERITED_POOLS = []
 
 
 def configure_db():
@@ -48,6 +50,28 @@ def clear_db(base=BASE):
     _DB_ENGINE = None
 
 
+def dispose():
+    """Close the idle connections of the engine.
+
+    The parent process calls it before forking, so that its children do
+    not start with connections it used.
+    """
+    session.get_engine(sqlite_fk=True).pool.dispose()
+
+
+def reset_pool():
+    """Give the engine a new, empty connection pool.
+
+    A forked process calls it so that it opens its own connections. The
+    connections of the old pool are shared with the parent and still
+    used by it, so they are neither closed nor garbage collected, which
+    would close them too.
+    """
+    engine = session.get_engine(sqlite_fk=True)
+    _INHERITED_POOLS.append(engine.pool)
+    engine.pool = engine.pool.recreate()
+
+
 def get_session(autocommit=True, expire_on_commit=False):
     """Helper method to grab session."""
     return session.get_session(autocommit=autocommit,
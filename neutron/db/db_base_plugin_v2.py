@@ -20,6 +20,7 @@ import random
 
 import netaddr
 from oslo.config import cfg
+import sqlalchemy as sa
 from sqlalchemy import orm
 from sqlalchemy.orm import exc
 
@@ -27,6 +28,7 @@ from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as q_exc
 from neutron.db import api as db
+from neutron.db import ipam
 from neutron.db import models_v2
 from neutron.db import sqlalchemyutils
 from neutron import neutron_plugin_base_v2
@@ -325,104 +327,68 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         if network_id in getattr(context, '_recycled_networks', set()):
             return
 
-        expired_qry = context.session.query(
-            models_v2.IPAllocation).with_lockmode('update')
-        expired_qry = expired_qry.filter_by(network_id=network_id,
-                                            port_id=None)
-        expired_qry = expired_qry.filter(
-            models_v2.IPAllocation.expiration <= timeutils.utcnow())
-
-        for expired in expired_qry:
-            NeutronDbPluginV2._recycle_ip(context,
-                                          network_id,
-                                          expired['subnet_id'],
-                                          expired['ip_address'])
+        NeutronDbPluginV2._recycle_expired_ips(context,
+                                               network_id=network_id)
 
         if hasattr(context, '_recycled_networks'):
             context._recycled_networks.add(network_id)
         else:
             context._recycled_networks = set([network_id])
 
+    @staticmethod
+    def _recycle_expired_ips(context, **filters):
+        """Recycle the expired allocations matching filters.
+
+        The expired addresses of a subnet are merged into its free ranges
+        at once and the allocations are removed with a single query, so
+        the number of queries does not grow with the number of addresses.
+        """
+        now = timeutils.utcnow()
+        expired_qry = context.session.query(
+            models_v2.IPAllocation.subnet_id,
+            models_v2.IPAllocation.ip_address).with_lockmode('update')
+        expired_qry = expired_qry.filter_by(port_id=None, **filters)
+        expired_qry = expired_qry.filter(
+            models_v2.IPAllocation.expiration <= now)
+
+        expired = {}
+        for subnet_id, ip_address in expired_qry:
+            expired.setdefault(subnet_id, []).append(ip_address)
+        if not expired:
+            return 0
+
+        driver = ipam.get_driver()
+        for subnet_id, ip_addresses in expired.iteritems():
+            driver.recycle_ips(context, subnet_id, ip_addresses)
+
+        delete_qry = context.session.query(models_v2.IPAllocation)
+        delete_qry = delete_qry.filter_by(port_id=None, **filters)
+        delete_qry = delete_qry.filter(
+            models_v2.IPAllocation.expiration <= now)
+        delete_qry.delete(synchronize_session='fetch')
+        return sum(len(ip_addresses) for ip_addresses in expired.values())
+
+    def recycle_expired_ip_allocations(self, context):
+        """Return all held ip allocations with expired leases to the pools.
+
+        Every subnet is handled in its own transaction.
+        """
+        subnet_qry = context.session.query(models_v2.IPAllocation.subnet_id)
+        subnet_qry = subnet_qry.filter_by(port_id=None).filter(
+            models_v2.IPAllocation.expiration <= timeutils.utcnow())
+        count = 0
+        for subnet_id, in subnet_qry.distinct().all():
+            with context.session.begin(subtransactions=True):
+                count += self._recycle_expired_ips(context,
+                                                   subnet_id=subnet_id)
+        return count
+
     @staticmethod
     def _recycle_ip(context, network_id, subnet_id, ip_address):
         """Return an IP address to the pool of free IP's on the network
         subnet.
         """
-        # Grab all allocation pools for the subnet
-        pool_qry = context.session.query(
-            models_v2.IPAllocationPool).with_lockmode('update')
-        allocation_pools = pool_qry.filter_by(subnet_id=subnet_id)
-        # Find the allocation pool for the IP to recycle
-        pool_id = None
-        for allocation_pool in allocation_pools:
-            allocation_pool_range = netaddr.IPRange(
-                allocation_pool['first_ip'],
-                allocation_pool['last_ip'])
-            if netaddr.IPAddress(ip_address) in allocation_pool_range:
-                pool_id = allocation_pool['id']
-                break
-        if not pool_id:
-            error_message = _("No allocation pool found for "
-                              "ip address:%s") % ip_address
-            raise q_exc.InvalidInput(error_message=error_message)
-        # Two requests will be done on the database. The first will be to
-        # search if an entry starts with ip_address + 1 (r1). The second
-        # will be to see if an entry ends with ip_address -1 (r2).
-        # If 1 of the above holds true then the specific entry will be
-        # modified. If both hold true then the two ranges will be merged.
-        # If there are no entries then a single entry will be added.
-        range_qry = context.session.query(
-            models_v2.IPAvailabilityRange).with_lockmode('update')
-        ip_first = str(netaddr.IPAddress(ip_address) + 1)
-        ip_last = str(netaddr.IPAddress(ip_address) - 1)
-        LOG.debug(_("Recycle %s"), ip_address)
-        try:
-            r1 = range_qry.filter_by(allocation_pool_id=pool_id,
-                                     first_ip=ip_first).one()
-            LOG.debug(_("Recycle: first match for %(first_ip)s-%(last_ip)s"),
-                      {'first_ip': r1['first_ip'], 'last_ip': r1['last_ip']})
-        except exc.NoResultFound:
-            r1 = []
-        try:
-            r2 = range_qry.filter_by(allocation_pool_id=pool_id,
-                                     last_ip=ip_last).one()
-            LOG.debug(_("Recycle: last match for %(first_ip)s-%(last_ip)s"),
-                      {'first_ip': r2['first_ip'], 'last_ip': r2['last_ip']})
-        except exc.NoResultFound:
-            r2 = []
-
-        if r1 and r2:
-            # Merge the two ranges
-            ip_range = models_v2.IPAvailabilityRange(
-                allocation_pool_id=pool_id,
-                first_ip=r2['first_ip'],
-                last_ip=r1['last_ip'])
-            context.session.add(ip_range)
-            LOG.debug(_("Recycle: merged %(first_ip1)s-%(last_ip1)s and "
-                        "%(first_ip2)s-%(last_ip2)s"),
-                      {'first_ip1': r2['first_ip'], 'last_ip1': r2['last_ip'],
-                       'first_ip2': r1['first_ip'], 'last_ip2': r1['last_ip']})
-            context.session.delete(r1)
-            context.session.delete(r2)
-        elif r1:
-            # Update the range with matched first IP
-            r1['first_ip'] = ip_address
-            LOG.debug(_("Recycle: updated first %(first_ip)s-%(last_ip)s"),
-                      {'first_ip': r1['first_ip'], 'last_ip': r1['last_ip']})
-        elif r2:
-            # Update the range with matched last IP
-            r2['last_ip'] = ip_address
-            LOG.debug(_("Recycle: updated last %(first_ip)s-%(last_ip)s"),
-                      {'first_ip': r2['first_ip'], 'last_ip': r2['last_ip']})
-        else:
-            # Create a new range
-            ip_range = models_v2.IPAvailabilityRange(
-                allocation_pool_id=pool_id,
-                first_ip=ip_address,
-                last_ip=ip_address)
-            context.session.add(ip_range)
-            LOG.debug(_("Recycle: created new %(first_ip)s-%(last_ip)s"),
-                      {'first_ip': ip_address, 'last_ip': ip_address})
+        ipam.get_driver().recycle_ip(context, subnet_id, ip_address)
         NeutronDbPluginV2._delete_ip_allocation(context, network_id, subnet_id,
                                                 ip_address)
 
@@ -450,6 +416,34 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                       {'network_id': network_id,
                        'ip_address': ip_address})
 
+    def update_fixed_ip_lease_expirations(self, context, network_id,
+                                          leases):
+        """Update the expiration of the fixed IPs of a network at once.
+
+        leases maps the IP addresses to their remaining lease seconds.
+        """
+        if not leases:
+            return
+        now = timeutils.utcnow()
+        expirations = sa.case(
+            [(ip_address, now + datetime.timedelta(seconds=lease_remaining))
+             for ip_address, lease_remaining in leases.iteritems()],
+            value=models_v2.IPAllocation.ip_address)
+
+        query = context.session.query(models_v2.IPAllocation)
+        query = query.filter(
+            models_v2.IPAllocation.network_id == network_id,
+            models_v2.IPAllocation.ip_address.in_(leases.keys()))
+        with context.session.begin(subtransactions=True):
+            updated = query.update(
+                {models_v2.IPAllocation.expiration: expirations},
+                synchronize_session=False)
+        if updated < len(leases):
+            LOG.debug(_("%(missing)d of %(count)d fixed IPs of the network "
+                        "%(network_id)s were not found."),
+                      {'missing': len(leases) - updated,
+                       'count': len(leases), 'network_id': network_id})
+
     @staticmethod
     def _delete_ip_allocation(context, network_id, subnet_id, ip_address):
 
@@ -472,66 +466,13 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         The IP address will be generated from one of the subnets defined on
         the network.
         """
-        range_qry = context.session.query(
-            models_v2.IPAvailabilityRange).join(
-                models_v2.IPAllocationPool).with_lockmode('update')
-        for subnet in subnets:
-            range = range_qry.filter_by(subnet_id=subnet['id']).first()
-            if not range:
-                LOG.debug(_("All IP's from subnet %(subnet_id)s (%(cidr)s) "
-                            "allocated"),
-                          {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
-                continue
-            ip_address = range['first_ip']
-            LOG.debug(_("Allocated IP - %(ip_address)s from %(first_ip)s "
-                        "to %(last_ip)s"),
-                      {'ip_address': ip_address,
-                       'first_ip': range['first_ip'],
-                       'last_ip': range['last_ip']})
-            if range['first_ip'] == range['last_ip']:
-                # No more free indices on subnet => delete
-                LOG.debug(_("No more free IP's in slice. Deleting allocation "
-                            "pool."))
-                context.session.delete(range)
-            else:
-                # increment the first free
-                range['first_ip'] = str(netaddr.IPAddress(ip_address) + 1)
-            return {'ip_address': ip_address, 'subnet_id': subnet['id']}
-        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+        return ipam.get_driver().generate_ip(context, subnets)
 
     @staticmethod
     def _allocate_specific_ip(context, subnet_id, ip_address):
         """Allocate a specific IP address on the subnet."""
-        ip = int(netaddr.IPAddress(ip_address))
-        range_qry = context.session.query(
-            models_v2.IPAvailabilityRange,
-            models_v2.IPAllocationPool).join(
-                models_v2.IPAllocationPool).with_lockmode('update')
-        results = range_qry.filter_by(subnet_id=subnet_id)
-        for (range, pool) in results:
-            first = int(netaddr.IPAddress(range['first_ip']))
-            last = int(netaddr.IPAddress(range['last_ip']))
-            if first <= ip <= last:
-                if first == last:
-                    context.session.delete(range)
-                    return
-                elif first == ip:
-                    range['first_ip'] = str(netaddr.IPAddress(ip_address) + 1)
-                    return
-                elif last == ip:
-                    range['last_ip'] = str(netaddr.IPAddress(ip_address) - 1)
-                    return
-                else:
-                    # Split into two ranges
-                    new_first = str(netaddr.IPAddress(ip_address) + 1)
-                    new_last = range['last_ip']
-                    range['last_ip'] = str(netaddr.IPAddress(ip_address) - 1)
-                    ip_range = models_v2.IPAvailabilityRange(
-                        allocation_pool_id=pool['id'],
-                        first_ip=new_first,
-                        last_ip=new_last)
-                    context.session.add(ip_range)
-                    return
+        ipam.get_driver().allocate_specific_ip(context, subnet_id,
+                                               ip_address)
 
     @staticmethod
     def _check_unique_ip(context, network_id, subnet_id, ip_address):
@@ -44,11 +44,27 @@ class DhcpRpcCallbackMixin(object):
             nets = plugin.get_networks(context, filters=filters)
         return nets
 
+    def _get_networks_info(self, context, networks):
+        """Add the DHCP enabled subnets and the ports of the networks."""
+        if not networks:
+            return networks
+        plugin = manager.NeutronManager.get_plugin()
+        networks_by_id = {}
+        for network in networks:
+            network['subnets'] = []
+            network['ports'] = []
+            networks_by_id[network['id']] = network
+        network_ids = [network['id'] for network in networks]
+        filters = {'network_id': network_ids}
+        for port in plugin.get_ports(context, filters=filters):
+            networks_by_id[port['network_id']]['ports'].append(port)
+        filters = {'network_id': network_ids, 'enable_dhcp': [True]}
+        for subnet in plugin.get_subnets(context, filters=filters):
+            networks_by_id[subnet['network_id']]['subnets'].append(subnet)
+        return networks
+
     def get_active_networks(self, context, **kwargs):
         """Retrieve and return a list of the active network ids."""
-        # NOTE(arosen): This method is no longer used by the DHCP agent but is
-        # left so that quantum-dhcp-agents will still continue to work if
-        # quantum-server is upgraded and not the agent.
         host = kwargs.get('host')
         LOG.debug(_('get_active_networks requested from %s'), host)
         nets = self._get_active_networks(context, **kwargs)
@@ -59,19 +75,30 @@ class DhcpRpcCallbackMixin(object):
         host = kwargs.get('host')
         LOG.debug(_('get_active_networks_info from %s'), host)
         networks = self._get_active_networks(context, **kwargs)
-        plugin = manager.NeutronManager.get_plugin()
-        filters = {'network_id': [network['id'] for network in networks]}
-        ports = plugin.get_ports(context, filters=filters)
-        filters['enable_dhcp'] = [True]
-        subnets = plugin.get_subnets(context, filters=filters)
+        return self._get_networks_info(context, networks)
 
-        for network in networks:
-            network['subnets'] = [subnet for subnet in subnets
-                                  if subnet['network_id'] == network['id']]
-            network['ports'] = [port for port in ports
-                                if port['network_id'] == network['id']]
+    def get_networks_info(self, context, **kwargs):
+        """Returns the subnets and ports of the given active networks.
 
-        return networks
+        The DHCP agent syncs the networks of get_active_networks a page of
+        network_ids at a time with it. Like get_active_networks, only the
+        networks scheduled to the agent are returned, but the networks are
+        not scheduled again.
+        """
+        host = kwargs.get('host')
+        network_ids = kwargs.get('network_ids')
+        LOG.debug(_('get_networks_info of %(count)d networks from %(host)s'),
+                  {'count': len(network_ids), 'host': host})
+        plugin = manager.NeutronManager.get_plugin()
+        if utils.is_extension_supported(
+            plugin, constants.DHCP_AGENT_SCHEDULER_EXT_ALIAS):
+            # the networks may have been removed from the agent since
+            networks = plugin.list_active_networks_on_active_dhcp_agent(
+                context, host, network_ids=network_ids)
+        else:
+            filters = dict(id=network_ids, admin_state_up=[True])
+            networks = plugin.get_networks(context, filters=filters)
+        return self._get_networks_info(context, networks)
 
     def get_network_info(self, context, **kwargs):
         """Retrieve and return a extended information about a network."""
@@ -224,6 +251,26 @@ class DhcpRpcCallbackMixin(object):
         plugin.update_fixed_ip_lease_expiration(context, network_id,
                                                 ip_address, lease_remaining)
 
+    def update_lease_expirations(self, context, **kwargs):
+        """Update the lease expiration of fixed_ips of several networks.
+
+        leases maps network ids to the remaining lease seconds of their IP
+        addresses.
+        """
+        host = kwargs.get('host')
+        leases = kwargs.get('leases')
+
+        LOG.debug(_('Updating %(count)d lease expirations on %(networks)d '
+                    'networks from %(host)s.'),
+                  {'count': sum(len(ips) for ips in leases.itervalues()),
+                   'networks': len(leases),
+                   'host': host})
+        plugin = manager.NeutronManager.get_plugin()
+
+        for network_id, network_leases in leases.iteritems():
+            plugin.update_fixed_ip_lease_expirations(context, network_id,
+                                                     network_leases)
+
     def create_dhcp_port(self, context, **kwargs):
         """Create the dhcp port."""
         host = kwargs.get('host')
@@ -0,0 +1,476 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""IP address management backends for NeutronDbPluginV2.
+
+A backend keeps the IPAvailabilityRange table of an allocation pool in
+sync with allocations; the IPAllocation rows are still handled by the
+plugin.
+"""
+
+import abc
+import bisect
+
+import netaddr
+from oslo.config import cfg
+import sqlalchemy as sa
+from sqlalchemy.orm import exc
+
+from neutron.common import exceptions as q_exc
+from neutron.db import models_v2
+from neutron.openstack.common import importutils
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import uuidutils
+
+
+LOG = logging.getLogger(__name__)
+
+ipam_opts = [
+    cfg.StrOpt('ipam_driver',
+               default='neutron.db.ipam.IntervalIpamDriver',
+               help=_("The driver used to manage IP availability ranges")),
+]
+
+cfg.CONF.register_opts(ipam_opts)
+
+
+class IPIntervalSet(object):
+    """Set of free addresses stored as disjoint integer intervals.
+
+    Interval starts are kept in a sorted list, so the interval holding an
+    address is found by binary search. Operations return the intervals
+    they removed and added, which is what has to be written back to the
+    database.
+    """
+
+    def __init__(self, ranges=()):
+        self._starts = []
+        self._ends = {}
+        for first, last in sorted(ranges):
+            if self._starts and self._ends[self._starts[-1]] + 1 >= first:
+                start = self._starts[-1]
+                self._ends[start] = max(self._ends[start], last)
+            else:
+                self._starts.append(first)
+                self._ends[first] = last
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __contains__(self, ip):
+        return self._find(ip) is not None
+
+    def ranges(self):
+        return [(first, self._ends[first]) for first in self._starts]
+
+    def _find(self, ip):
+        index = bisect.bisect_right(self._starts, ip) - 1
+        if index >= 0:
+            first = self._starts[index]
+            if ip <= self._ends[first]:
+                return index
+        return None
+
+    def _remove(self, index):
+        first = self._starts.pop(index)
+        return first, self._ends.pop(first)
+
+    def _add(self, first, last):
+        bisect.insort(self._starts, first)
+        self._ends[first] = last
+        return first, last
+
+    def first(self):
+        """Return the lowest free address or None."""
+        if self._starts:
+            return self._starts[0]
+
+    def take(self, ip):
+        """Mark ip as used, return (removed, added) or None if not free."""
+        index = self._find(ip)
+        if index is None:
+            return None
+        first, last = self._remove(index)
+        added = []
+        if first < ip:
+            added.append(self._add(first, ip - 1))
+        if ip < last:
+            added.append(self._add(ip + 1, last))
+        return [(first, last)], added
+
+    def release(self, ip):
+        """Mark ip as free, return (removed, added)."""
+        if ip in self:
+            return [], []
+        removed = []
+        first = last = ip
+        index = self._find(ip - 1)
+        if index is not None:
+            removed.append(self._remove(index))
+            first = removed[-1][0]
+        index = self._find(ip + 1)
+        if index is not None:
+            removed.append(self._remove(index))
+            last = removed[-1][1]
+        return removed, [self._add(first, last)]
+
+
+class _Pool(object):
+    def __init__(self, pool_id, first_ip, last_ip):
+        self.id = pool_id
+        first = netaddr.IPAddress(first_ip)
+        self.ip_version = first.version
+        self.first = int(first)
+        self.last = int(netaddr.IPAddress(last_ip))
+        self.version = None
+        self.free = None
+
+    def __contains__(self, ip):
+        return self.first <= ip <= self.last
+
+    def to_str(self, ip):
+        return str(netaddr.IPAddress(ip, self.ip_version))
+
+
+class IpamDriver(object):
+    """Base class for IPAM drivers."""
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def generate_ip(self, context, subnets):
+        """Take a free address from one of the subnets.
+
+        Return a dict with ip_address and subnet_id.
+        """
+
+    @abc.abstractmethod
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        """Take ip_address from the availability ranges of the subnet."""
+
+    @abc.abstractmethod
+    def recycle_ip(self, context, subnet_id, ip_address):
+        """Return ip_address to the availability ranges of the subnet."""
+
+    def recycle_ips(self, context, subnet_id, ip_addresses):
+        """Return several addresses to the availability ranges of a subnet.
+
+        The addresses are coalesced with the free ranges of their pool in
+        memory and only the ranges which changed are rewritten. Addresses
+        outside of the allocation pools are skipped.
+        """
+        pools = self._lock_pools(context, subnet_id)
+        changes = {}
+        for ip_address in ip_addresses:
+            ip = int(netaddr.IPAddress(ip_address))
+            for pool in pools:
+                if ip in pool:
+                    removed, added = changes.setdefault(pool, (set(), set()))
+                    diff = pool.free.release(ip)
+                    for first_last in diff[0]:
+                        if first_last in added:
+                            added.remove(first_last)
+                        else:
+                            removed.add(first_last)
+                    added.update(diff[1])
+                    break
+            else:
+                LOG.warning(_("No allocation pool found for ip address:%s"),
+                            ip_address)
+        LOG.debug(_("Recycle %(count)d addresses of subnet %(subnet_id)s"),
+                  {'count': len(ip_addresses), 'subnet_id': subnet_id})
+        for pool, (removed, added) in changes.iteritems():
+            self._write_ranges(context, pool, removed, added)
+        self._save(context, pools)
+
+    def _lock_pools(self, context, subnet_id):
+        """Lock the allocation pools of a subnet and load their ranges."""
+        query = context.session.query(
+            models_v2.IPAllocationPool.id,
+            models_v2.IPAllocationPool.first_ip,
+            models_v2.IPAllocationPool.last_ip,
+            models_v2.IPAllocationPool.version).with_lockmode('update')
+        pools = []
+        for pool_id, first_ip, last_ip, version in query.filter_by(
+                subnet_id=subnet_id):
+            pool = self._get_pool(pool_id, first_ip, last_ip)
+            if pool.version is None or pool.version != version:
+                pool.free = self._load_free(context, pool)
+                pool.version = version
+            pools.append(pool)
+        pools.sort(key=lambda p: p.first)
+        return pools
+
+    def _get_pool(self, pool_id, first_ip, last_ip):
+        return _Pool(pool_id, first_ip, last_ip)
+
+    def _load_free(self, context, pool):
+        query = context.session.query(
+            models_v2.IPAvailabilityRange.first_ip,
+            models_v2.IPAvailabilityRange.last_ip)
+        ranges = query.filter_by(allocation_pool_id=pool.id)
+        return IPIntervalSet((int(netaddr.IPAddress(first_ip)),
+                              int(netaddr.IPAddress(last_ip)))
+                             for first_ip, last_ip in ranges)
+
+    def _write_ranges(self, context, pool, removed, added):
+        """Write the ranges of a pool which changed in one pass."""
+        session = context.session
+        model = models_v2.IPAvailabilityRange
+        if removed:
+            session.query(model).filter(sa.or_(*[
+                sa.and_(model.allocation_pool_id == pool.id,
+                        model.first_ip == pool.to_str(first),
+                        model.last_ip == pool.to_str(last))
+                for first, last in removed])).delete(
+                    synchronize_session='evaluate')
+        if added:
+            session.execute(model.__table__.insert(), [
+                {'allocation_pool_id': pool.id,
+                 'first_ip': pool.to_str(first),
+                 'last_ip': pool.to_str(last)}
+                for first, last in added])
+        pool.version = uuidutils.generate_uuid()
+        session.query(models_v2.IPAllocationPool).filter_by(
+            id=pool.id).update({'version': pool.version},
+                               synchronize_session=False)
+
+    def _save(self, context, pools):
+        """Called with the pools once the changes are written."""
+
+
+class RangeTableIpamDriver(IpamDriver):
+    """Work directly on locked IPAvailabilityRange rows."""
+
+    def generate_ip(self, context, subnets):
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        for subnet in subnets:
+            range = range_qry.filter_by(subnet_id=subnet['id']).first()
+            if not range:
+                LOG.debug(_("All IP's from subnet %(subnet_id)s (%(cidr)s) "
+                            "allocated"),
+                          {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+                continue
+            ip_address = range['first_ip']
+            LOG.debug(_("Allocated IP - %(ip_address)s from %(first_ip)s "
+                        "to %(last_ip)s"),
+                      {'ip_address': ip_address,
+                       'first_ip': range['first_ip'],
+                       'last_ip': range['last_ip']})
+            if range['first_ip'] == range['last_ip']:
+                # No more free indices on subnet => delete
+                LOG.debug(_("No more free IP's in slice. Deleting allocation "
+                            "pool."))
+                context.session.delete(range)
+            else:
+                # increment the first free
+                range['first_ip'] = str(netaddr.IPAddress(ip_address) + 1)
+            return {'ip_address': ip_address, 'subnet_id': subnet['id']}
+        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange,
+            models_v2.IPAllocationPool).join(
+                models_v2.IPAllocationPool).with_lockmode('update')
+        results = range_qry.filter_by(subnet_id=subnet_id)
+        for (range, pool) in results:
+            first = int(netaddr.IPAddress(range['first_ip']))
+            last = int(netaddr.IPAddress(range['last_ip']))
+            if first <= ip <= last:
+                if first == last:
+                    context.session.delete(range)
+                    return
+                elif first == ip:
+                    range['first_ip'] = str(netaddr.IPAddress(ip_address) + 1)
+                    return
+                elif last == ip:
+                    range['last_ip'] = str(netaddr.IPAddress(ip_address) - 1)
+                    return
+                else:
+                    # Split into two ranges
+                    new_first = str(netaddr.IPAddress(ip_address) + 1)
+                    new_last = range['last_ip']
+                    range['last_ip'] = str(netaddr.IPAddress(ip_address) - 1)
+                    ip_range = models_v2.IPAvailabilityRange(
+                        allocation_pool_id=pool['id'],
+                        first_ip=new_first,
+                        last_ip=new_last)
+                    context.session.add(ip_range)
+                    return
+
+    def recycle_ip(self, context, subnet_id, ip_address):
+        # Grab all allocation pools for the subnet
+        pool_qry = context.session.query(
+            models_v2.IPAllocationPool).with_lockmode('update')
+        allocation_pools = pool_qry.filter_by(subnet_id=subnet_id)
+        # Find the allocation pool for the IP to recycle
+        pool_id = None
+        for allocation_pool in allocation_pools:
+            allocation_pool_range = netaddr.IPRange(
+                allocation_pool['first_ip'],
+                allocation_pool['last_ip'])
+            if netaddr.IPAddress(ip_address) in allocation_pool_range:
+                pool_id = allocation_pool['id']
+                break
+        if not pool_id:
+            error_message = _("No allocation pool found for "
+                              "ip address:%s") % ip_address
+            raise q_exc.InvalidInput(error_message=error_message)
+        # Two requests will be done on the database. The first will be to
+        # search if an entry starts with ip_address + 1 (r1). The second
+        # will be to see if an entry ends with ip_address -1 (r2).
+        # If 1 of the above holds true then the specific entry will be
+        # modified. If both hold true then the two ranges will be merged.
+        # If there are no entries then a single entry will be added.
+        range_qry = context.session.query(
+            models_v2.IPAvailabilityRange).with_lockmode('update')
+        ip_first = str(netaddr.IPAddress(ip_address) + 1)
+        ip_last = str(netaddr.IPAddress(ip_address) - 1)
+        LOG.debug(_("Recycle %s"), ip_address)
+        try:
+            r1 = range_qry.filter_by(allocation_pool_id=pool_id,
+                                     first_ip=ip_first).one()
+            LOG.debug(_("Recycle: first match for %(first_ip)s-%(last_ip)s"),
+                      {'first_ip': r1['first_ip'], 'last_ip': r1['last_ip']})
+        except exc.NoResultFound:
+            r1 = []
+        try:
+            r2 = range_qry.filter_by(allocation_pool_id=pool_id,
+                                     last_ip=ip_last).one()
+            LOG.debug(_("Recycle: last match for %(first_ip)s-%(last_ip)s"),
+                      {'first_ip': r2['first_ip'], 'last_ip': r2['last_ip']})
+        except exc.NoResultFound:
+            r2 = []
+
+        if r1 and r2:
+            # Merge the two ranges
+            ip_range = models_v2.IPAvailabilityRange(
+                allocation_pool_id=pool_id,
+                first_ip=r2['first_ip'],
+                last_ip=r1['last_ip'])
+            context.session.add(ip_range)
+            LOG.debug(_("Recycle: merged %(first_ip1)s-%(last_ip1)s and "
+                        "%(first_ip2)s-%(last_ip2)s"),
+                      {'first_ip1': r2['first_ip'], 'last_ip1': r2['last_ip'],
+                       'first_ip2': r1['first_ip'], 'last_ip2': r1['last_ip']})
+            context.session.delete(r1)
+            context.session.delete(r2)
+        elif r1:
+            # Update the range with matched first IP
+            r1['first_ip'] = ip_address
+            LOG.debug(_("Recycle: updated first %(first_ip)s-%(last_ip)s"),
+                      {'first_ip': r1['first_ip'], 'last_ip': r1['last_ip']})
+        elif r2:
+            # Update the range with matched last IP
+            r2['last_ip'] = ip_address
+            LOG.debug(_("Recycle: updated last %(first_ip)s-%(last_ip)s"),
+                      {'first_ip': r2['first_ip'], 'last_ip': r2['last_ip']})
+        else:
+            # Create a new range
+            ip_range = models_v2.IPAvailabilityRange(
+                allocation_pool_id=pool_id,
+                first_ip=ip_address,
+                last_ip=ip_address)
+            context.session.add(ip_range)
+            LOG.debug(_("Recycle: created new %(first_ip)s-%(last_ip)s"),
+                      {'first_ip': ip_address, 'last_ip': ip_address})
+
+
+class IntervalIpamDriver(IpamDriver):
+    """Keep the free addresses of each pool in memory as an IPIntervalSet.
+
+    Only the allocation pool rows are locked. Every change stores a new
+    random version on the pool row; the cached set of a pool is used as
+    long as the pool still has the version the cache was built from, and
+    is reloaded from IPAvailabilityRange otherwise. Changed ranges are
+    written back in one delete and one insert.
+    """
+
+    def __init__(self):
+        self._pools = {}
+
+    def _get_pool(self, pool_id, first_ip, last_ip):
+        # A cached pool is taken out of the cache while it is being
+        # changed, so a failed change can not leave a modified set
+        # behind.
+        pool = self._pools.pop(pool_id, None)
+        if pool is None:
+            pool = _Pool(pool_id, first_ip, last_ip)
+        return pool
+
+    def _save(self, context, pools):
+        for pool in pools:
+            self._pools[pool.id] = pool
+
+    def generate_ip(self, context, subnets):
+        for subnet in subnets:
+            pools = self._lock_pools(context, subnet['id'])
+            for pool in pools:
+                ip = pool.free.first()
+                if ip is not None:
+                    self._write_ranges(context, pool, *pool.free.take(ip))
+                    self._save(context, pools)
+                    ip_address = pool.to_str(ip)
+                    LOG.debug(_("Allocated IP - %(ip_address)s from pool "
+                                "%(pool_id)s"),
+                              {'ip_address': ip_address, 'pool_id': pool.id})
+                    return {'ip_address': ip_address,
+                            'subnet_id': subnet['id']}
+            self._save(context, pools)
+            LOG.debug(_("All IP's from subnet %(subnet_id)s (%(cidr)s) "
+                        "allocated"),
+                      {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+        raise q_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific_ip(self, context, subnet_id, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        pools = self._lock_pools(context, subnet_id)
+        for pool in pools:
+            if ip in pool:
+                changes = pool.free.take(ip)
+                if changes:
+                    self._write_ranges(context, pool, *changes)
+                break
+        self._save(context, pools)
+
+    def recycle_ip(self, context, subnet_id, ip_address):
+        ip = int(netaddr.IPAddress(ip_address))
+        pools = self._lock_pools(context, subnet_id)
+        for pool in pools:
+            if ip in pool:
+                LOG.debug(_("Recycle %s"), ip_address)
+                self._write_ranges(context, pool, *pool.free.release(ip))
+                self._save(context, pools)
+                return
+        self._save(context, pools)
+        error_message = _("No allocation pool found for "
+                          "ip address:%s") % ip_address
+        raise q_exc.InvalidInput(error_message=error_message)
+
+
+_driver = None
+
+
+def get_driver():
+    global _driver
+    driver_class = importutils.import_class(cfg.CONF.ipam_driver)
+    if not isinstance(_driver, driver_class):
+        _driver = driver_class()
+    return _driver
@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Niblick resources
+
+Revision ID: 3a1b9c5f0d2e
+Revises: 393bbde970ef
+Create Date: 2013-10-14 12:31:07.204817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a1b9c5f0d2e'
+down_revision = '393bbde970ef'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+from neutron.plugins.niblick.db import types as db_types
+
+
+def upgrade(active_plugin=None, options=None):
+    if not migration.should_run(active_plugin, migration_for_plugins):
+        return
+
+    op.create_table(
+        'niblick_resources',
+        sa.Column('resource_id', sa.String(length=36), primary_key=True),
+        sa.Column('resource_type', sa.String(length=255), nullable=False),
+        sa.Column('resource_metadata', db_types.JsonBlob(),
+                  nullable=True),
+        sa.Column('resource_descriptor', sa.String(length=255),
+                  nullable=False),
+        sa.Column('allocated', sa.Boolean, nullable=False),
+    )
+
+
+def downgrade(active_plugin=None, options=None):
+    if not migration.should_run(active_plugin, migration_for_plugins):
+        return
+
+    op.drop_table('niblick_resources')
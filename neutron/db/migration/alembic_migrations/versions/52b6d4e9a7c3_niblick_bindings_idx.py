@@ -0,0 +1,51 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Index niblick bindings by resource type
+
+Revision ID: 52b6d4e9a7c3
+Revises: 3a1b9c5f0d2e
+Create Date: 2013-10-16 10:12:44.530129
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52b6d4e9a7c3'
+down_revision = '3a1b9c5f0d2e'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+
+from neutron.db import migration
+
+
+def upgrade(active_plugin=None, options=None):
+    if not migration.should_run(active_plugin, migration_for_plugins):
+        return
+
+    op.create_index('niblick_bindings_type_idx', 'niblick_bindings',
+                    ['resource_type', 'deleted', 'resource_descriptor'])
+
+
+def downgrade(active_plugin=None, options=None):
+    if not migration.should_run(active_plugin, migration_for_plugins):
+        return
+
+    op.drop_index('niblick_bindings_type_idx', 'niblick_bindings')
@@ -69,6 +69,9 @@ class IPAllocationPool(model_base.BASEV2, HasId):
                           nullable=True)
     first_ip = sa.Column(sa.String(64), nullable=False)
     last_ip = sa.Column(sa.String(64), nullable=False)
+    # Changed together with available_ranges, lets IPAM drivers detect
+    # that a copy of the ranges they hold is stale
+    version = sa.Column(sa.String(36), nullable=True)
     available_ranges = orm.relationship(IPAvailabilityRange,
                                         backref='ipallocationpool',
                                         lazy="joined",
@@ -15,6 +15,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import hashlib
+
 import netaddr
 
 from neutron.common import constants as q_const
@@ -22,6 +25,7 @@ from neutron.common import utils
 from neutron.db import models_v2
 from neutron.db import securitygroups_db as sg_db
 from neutron.extensions import securitygroup as ext_sg
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
@@ -136,7 +140,104 @@ class SecurityGroupServerRpcCallbackMixin(object):
         :returns: port correspond to the devices with security group rules
         """
         devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        return self._security_group_rules_for_ports(context, ports)
+
+    def security_group_info_for_devices(self, context, **kwargs):
+        """Return security group rules and remote group members.
 
+        Unlike security_group_rules_for_devices, remote_group_id rules are
+        not expanded into one rule per member. The addresses of every
+        remote group are returned once in sg_member_ips.
+
+        :params devices: list of devices
+        :returns: dict with ports correspond to the devices with security
+                  group rules under 'devices', and the addresses of each
+                  remote group by ethertype under 'sg_member_ips'
+        """
+        devices = kwargs.get('devices')
+        ports = self._get_ports_for_devices(devices)
+        self._add_security_group_rules_to_ports(context, ports)
+        remote_group_ids = list(set(self._select_remote_group_ids(ports)))
+        for port in ports.values():
+            port['security_group_source_groups'].extend(
+                set(rule['remote_group_id']
+                    for rule in port['security_group_rules']
+                    if rule.get('remote_group_id')))
+        return {'devices': ports,
+                'sg_member_ips': self._select_member_ips_by_ethertype(
+                    context, remote_group_ids)}
+
+    def security_group_member_ips(self, context, **kwargs):
+        """Return the member addresses of security groups.
+
+        :params security_groups: list of security group ids
+        :returns: addresses of each group by ethertype
+        """
+        security_groups = kwargs.get('security_groups')
+        return self._select_member_ips_by_ethertype(context,
+                                                    security_groups)
+
+    def security_group_info_for_groups(self, context, **kwargs):
+        """Return the definition of security groups an agent does not have.
+
+        The definition of a group are its rules, with remote_group_id rules
+        not expanded, and the addresses of its members. The definitions of
+        the remote groups referenced by the rules are returned as well.
+        Every definition carries a version which changes with its content;
+        definitions whose version the agent already has are left out.
+
+        :params security_groups: list of security group ids
+        :params versions: dict of the versions the agent has by group id
+        :returns: dict of group definitions by group id, each with version,
+                  rules and members by ethertype
+        """
+        security_groups = kwargs.get('security_groups')
+        versions = kwargs.get('versions') or {}
+        if not security_groups:
+            return {}
+        rules = self._select_rules_for_groups(context, security_groups)
+        group_ids = set(security_groups)
+        for group_rules in rules.values():
+            group_ids.update(rule['remote_group_id'] for rule in group_rules
+                             if rule.get('remote_group_id'))
+        missing = group_ids - set(rules)
+        if missing:
+            rules.update(self._select_rules_for_groups(context,
+                                                       list(missing)))
+        members = self._select_member_ips_by_ethertype(context,
+                                                       list(group_ids))
+        groups = {}
+        for sg_id in group_ids:
+            group = {'rules': rules.get(sg_id, []),
+                     'members': members[sg_id]}
+            version = self._security_group_version(group)
+            if versions.get(sg_id) != version:
+                group['version'] = version
+                groups[sg_id] = group
+        return groups
+
+    def _select_rules_for_groups(self, context, security_groups):
+        rules = collections.OrderedDict()
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(
+            sg_db.SecurityGroupRule.security_group_id.in_(security_groups))
+        for rule_in_db in query:
+            rules.setdefault(rule_in_db['security_group_id'], []).append(
+                self._make_rule_dict(rule_in_db))
+        for sg_id in security_groups:
+            rules.setdefault(sg_id, [])
+        return rules
+
+    def _security_group_version(self, group):
+        rules = sorted(jsonutils.dumps(rule, sort_keys=True)
+                       for rule in group['rules'])
+        members = dict((ethertype, sorted(ips))
+                       for ethertype, ips in group['members'].iteritems())
+        return hashlib.md5(jsonutils.dumps([rules, members],
+                                           sort_keys=True)).hexdigest()
+
+    def _get_ports_for_devices(self, devices):
         ports = {}
         for device in devices:
             port = self.get_port_from_device(device)
@@ -145,22 +246,39 @@ class SecurityGroupServerRpcCallbackMixin(object):
             if port['device_owner'].startswith('network:'):
                 continue
             ports[port['id']] = port
-        return self._security_group_rules_for_ports(context, ports)
+        return ports
 
-    def _select_rules_for_ports(self, context, ports):
+    def _select_security_groups_for_ports(self, context, ports):
+        groups = dict((port_id, []) for port_id in ports)
         if not ports:
-            return []
+            return groups
         sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
         sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
 
-        sgr_sgid = sg_db.SecurityGroupRule.security_group_id
-
-        query = context.session.query(sg_db.SecurityGroupPortBinding,
-                                      sg_db.SecurityGroupRule)
-        query = query.join(sg_db.SecurityGroupRule,
-                           sgr_sgid == sg_binding_sgid)
+        query = context.session.query(sg_binding_port, sg_binding_sgid)
         query = query.filter(sg_binding_port.in_(ports.keys()))
-        return query.all()
+        for port_id, security_group_id in query:
+            groups[port_id].append(security_group_id)
+        return groups
+
+    def _select_rules_for_ports(self, context, ports):
+        """Return the security groups of each port and their rules.
+
+        Rules are selected once per security group rather than once per
+        port, and the rules of a group are shared by its ports.
+        """
+        groups = self._select_security_groups_for_ports(context, ports)
+        group_ids = set()
+        for security_groups in groups.values():
+            group_ids.update(security_groups)
+        rules = {}
+        if group_ids:
+            rules = self._select_rules_for_groups(context, list(group_ids))
+        # Keep the rules of a port in the order the groups were defined
+        position = dict((sg_id, i) for i, sg_id in enumerate(rules))
+        for security_groups in groups.values():
+            security_groups.sort(key=position.get)
+        return groups, rules
 
     def _select_ips_for_remote_group(self, context, remote_group_ids):
         ips_by_group = {}
@@ -182,6 +300,17 @@ class SecurityGroupServerRpcCallbackMixin(object):
             ips_by_group[security_group_id].append(ip_address)
         return ips_by_group
 
+    def _select_member_ips_by_ethertype(self, context, remote_group_ids):
+        ips_by_group = self._select_ips_for_remote_group(context,
+                                                         remote_group_ids)
+        members = {}
+        for remote_group_id, ips in ips_by_group.iteritems():
+            members[remote_group_id] = {q_const.IPv4: [], q_const.IPv6: []}
+            for ip in ips:
+                ethertype = 'IPv%s' % netaddr.IPAddress(ip).version
+                members[remote_group_id][ethertype].append(ip)
+        return members
+
     def _select_remote_group_ids(self, ports):
         remote_group_ids = []
         for port in ports.values():
@@ -212,34 +341,29 @@ class SecurityGroupServerRpcCallbackMixin(object):
             ips[port['network_id']].append(ip)
         return ips
 
-    def _convert_remote_group_id_to_ip_prefix(self, context, ports):
-        remote_group_ids = self._select_remote_group_ids(ports)
-        ips = self._select_ips_for_remote_group(context, remote_group_ids)
-        for port in ports.values():
-            updated_rule = []
-            for rule in port.get('security_group_rules'):
-                remote_group_id = rule.get('remote_group_id')
-                direction = rule.get('direction')
-                direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                if not remote_group_id:
-                    updated_rule.append(rule)
-                    continue
+    def _expand_remote_group_rules(self, rules, members):
+        """Convert the remote_group_id rules of a security group.
 
-                port['security_group_source_groups'].append(remote_group_id)
-                base_rule = rule
-                for ip in ips[remote_group_id]:
-                    if ip in port.get('fixed_ips', []):
-                        continue
-                    ip_rule = base_rule.copy()
-                    version = netaddr.IPAddress(ip).version
-                    ethertype = 'IPv%s' % version
-                    if base_rule['ethertype'] != ethertype:
-                        continue
-                    ip_rule[direction_ip_prefix] = "%s/%s" % (
-                        ip, IP_MASK[ethertype])
-                    updated_rule.append(ip_rule)
-            port['security_group_rules'] = updated_rule
-        return ports
+        Every remote_group_id rule becomes one rule per member address of
+        the remote group with the same ethertype. The result is a list of
+        (ip_address, rule) pairs, ip_address being None for rules which do
+        not come from a member, so that a port can leave out the rules
+        matching its own addresses.
+        """
+        expanded = []
+        for rule in rules:
+            remote_group_id = rule.get('remote_group_id')
+            if not remote_group_id:
+                expanded.append((None, rule))
+                continue
+            direction_ip_prefix = DIRECTION_IP_PREFIX[rule['direction']]
+            ethertype = rule['ethertype']
+            for ip in members[remote_group_id].get(ethertype, []):
+                ip_rule = rule.copy()
+                ip_rule[direction_ip_prefix] = "%s/%s" % (
+                    ip, IP_MASK[ethertype])
+                expanded.append((ip, ip_rule))
+        return expanded
 
     def _add_ingress_dhcp_rule(self, port, ips):
         dhcp_ips = ips.get(port['network_id'])
@@ -279,24 +403,49 @@ class SecurityGroupServerRpcCallbackMixin(object):
             self._add_ingress_dhcp_rule(port, ips)
 
     def _security_group_rules_for_ports(self, context, ports):
-        rules_in_db = self._select_rules_for_ports(context, ports)
-        for (binding, rule_in_db) in rules_in_db:
-            port_id = binding['port_id']
-            port = ports[port_id]
-            direction = rule_in_db['direction']
-            rule_dict = {
-                'security_group_id': rule_in_db['security_group_id'],
-                'direction': direction,
-                'ethertype': rule_in_db['ethertype'],
-            }
-            for key in ('protocol', 'port_range_min', 'port_range_max',
-                        'remote_ip_prefix', 'remote_group_id'):
-                if rule_in_db.get(key):
-                    if key == 'remote_ip_prefix':
-                        direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                        rule_dict[direction_ip_prefix] = rule_in_db[key]
-                        continue
-                    rule_dict[key] = rule_in_db[key]
-            port['security_group_rules'].append(rule_dict)
+        groups, rules = self._select_rules_for_ports(context, ports)
+        remote_group_ids = set()
+        for group_rules in rules.values():
+            remote_group_ids.update(rule['remote_group_id']
+                                    for rule in group_rules
+                                    if rule.get('remote_group_id'))
+        members = self._select_member_ips_by_ethertype(
+            context, list(remote_group_ids))
+        expanded = dict(
+            (sg_id, self._expand_remote_group_rules(group_rules, members))
+            for sg_id, group_rules in rules.iteritems())
+        for port_id, port in ports.iteritems():
+            fixed_ips = set(port.get('fixed_ips', []))
+            for sg_id in groups[port_id]:
+                port['security_group_rules'].extend(
+                    rule for ip, rule in expanded[sg_id]
+                    if ip not in fixed_ips)
+                port['security_group_source_groups'].extend(
+                    rule['remote_group_id'] for rule in rules[sg_id]
+                    if rule.get('remote_group_id'))
+        self._apply_provider_rule(context, ports)
+        return ports
+
+    def _make_rule_dict(self, rule_in_db):
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'security_group_id': rule_in_db['security_group_id'],
+            'direction': direction,
+            'ethertype': rule_in_db['ethertype'],
+        }
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key):
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        return rule_dict
+
+    def _add_security_group_rules_to_ports(self, context, ports):
+        groups, rules = self._select_rules_for_ports(context, ports)
+        for port_id, port in ports.iteritems():
+            for sg_id in groups[port_id]:
+                port['security_group_rules'].extend(rules[sg_id])
         self._apply_provider_rule(context, ports)
-        return self._convert_remote_group_id_to_ip_prefix(context, ports)
@@ -636,6 +636,8 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
 
         while True:
             start = time.time()
+            if self.firewall_apply_failed():
+                sync = True
             if sync:
                 LOG.info(_("Agent out of sync with plugin!"))
                 devices.clear()
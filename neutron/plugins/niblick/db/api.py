@@ -14,6 +14,8 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import datetime
+
 from neutron.openstack.common import timeutils
 from sqlalchemy.orm import exc as sa_exc
 
@@ -71,9 +73,74 @@ def binding_delete(context, object_id):
         session.add(obj)
 
 
+def binding_get_by_resource(context, resource_id):
+    """Return the active binding of a resource, None if it is not bound."""
+    session = context.session
+    return session.query(models.NiblickBinding).filter_by(
+        resource_id=resource_id,
+        deleted=0
+    ).first()
+
+
 def binding_get_descriptors(context, resource_type):
     session = context.session
     query = session.query(models.NiblickBinding.resource_descriptor).\
-        filter_by(resource_type=resource_type).\
+        filter_by(resource_type=resource_type, deleted=0).\
         group_by(models.NiblickBinding.resource_descriptor)
     return [d for d, in query.all()]
+
+
+def binding_purge_deleted(context, age):
+    """Remove bindings soft-deleted more than age seconds ago."""
+    session = context.session
+    deleted_before = timeutils.utcnow() - datetime.timedelta(seconds=age)
+    with session.begin(subtransactions=True):
+        return session.query(models.NiblickBinding).filter(
+            models.NiblickBinding.deleted != 0,
+            models.NiblickBinding.deleted_at < deleted_before
+        ).delete(synchronize_session=False)
+
+
+def resource_add(context, values):
+    session = context.session
+    with session.begin(subtransactions=True):
+        obj = models.NiblickResource()
+        obj.update(values)
+        session.add(obj)
+        return obj
+
+
+def resource_get_all(context):
+    session = context.session
+    return session.query(models.NiblickResource).all()
+
+
+def resource_get_free(context, resource_type):
+    session = context.session
+    return session.query(models.NiblickResource).filter_by(
+        resource_type=resource_type,
+        allocated=False
+    ).all()
+
+
+def resource_claim(context, resource_id):
+    """Allocate a resource unless it is allocated already.
+
+    Returns whether this call allocated it, which is not the case when
+    another server claimed it first.
+    """
+    session = context.session
+    with session.begin(subtransactions=True):
+        count = session.query(models.NiblickResource).filter_by(
+            resource_id=resource_id,
+            allocated=False
+        ).update({'allocated': True}, synchronize_session=False)
+    return count == 1
+
+
+def resource_set_allocated(context, resource_id, allocated):
+    session = context.session
+    with session.begin(subtransactions=True):
+        session.query(models.NiblickResource).filter_by(
+            resource_id=resource_id
+        ).update({'allocated': allocated})
@@ -15,7 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Boolean, Column, String, Integer
 from sqlalchemy import schema
 
 from neutron.db import model_base
@@ -30,7 +30,10 @@ class NiblickBinding(model_base.BASEV2,
 
     __tablename__ = 'niblick_bindings'
     __table_args__ = (schema.UniqueConstraint("object_id", "deleted",
-                                              name='niblick_bindings_uniq'),)
+                                              name='niblick_bindings_uniq'),
+                      schema.Index('niblick_bindings_type_idx',
+                                   'resource_type', 'deleted',
+                                   'resource_descriptor'))
 
     id = Column(Integer, primary_key=True)
     object_id = Column(String(36), nullable=False)
@@ -41,3 +44,19 @@ class NiblickBinding(model_base.BASEV2,
 
     def __repr__(self):
         return "<NiblickBinding(%s,%s)>" % (self.object_id, self.resource_id)
+
+
+class NiblickResource(model_base.BASEV2):
+    """Represents a resource managed by the simple policy driver."""
+
+    __tablename__ = 'niblick_resources'
+
+    resource_id = Column(String(36), primary_key=True)
+    resource_type = Column(String(255), nullable=False)
+    resource_metadata = Column(db_types.JsonBlob(), nullable=True)
+    resource_descriptor = Column(String(255), nullable=False)
+    allocated = Column(Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return "<NiblickResource(%s,%s)>" % (self.resource_id,
+                                             self.allocated)
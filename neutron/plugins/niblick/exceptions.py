@@ -31,3 +31,7 @@ class WrongResourceId(NiblickException):
 
 class WrongObjectId(NiblickException):
     message = _('Wrong object ID "%(object_id)s"')
+
+
+class ResourceConflict(NiblickException):
+    message = _('Conflicting update of supervisor resources at "%(url)s"')
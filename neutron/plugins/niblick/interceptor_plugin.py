@@ -15,17 +15,68 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import functools
+import heapq
+import itertools
+
+from oslo.config import cfg
+
+from neutron import context as n_context
 from neutron.db import l3_db
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import loopingcall
 from neutron.plugins.niblick import plugin_manager
 from neutron.plugins.niblick import resource
 
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
 ROUTER_OBJECT_TYPE = 'L3'
 
 
+def _sort_key(sorts):
+    def compare(a, b):
+        for key, direction in sorts:
+            res = cmp(a.get(key), b.get(key))
+            if res:
+                return res if direction else -res
+        return 0
+    return functools.cmp_to_key(compare)
+
+
+def _merge_sorted(results, sorts):
+    """Lazily merge per backend lists which are already sorted."""
+    key = _sort_key(sorts)
+    decorated = [((key(obj), i, j, obj) for j, obj in enumerate(objs))
+                 for i, objs in enumerate(results)]
+    return (obj for _key, _i, _j, obj in heapq.merge(*decorated))
+
+
+def _unique(objs):
+    seen = set()
+    for obj in objs:
+        if obj['id'] not in seen:
+            seen.add(obj['id'])
+            yield obj
+
+
 class Interceptor(l3_db.L3_NAT_db_mixin):
     def __init__(self):
         self._plugin_manager = plugin_manager.PluginManager()
         self._resource_manager = resource.ResourceManager()
+        if CONF.niblick.binding_purge_interval > 0:
+            self._purge_loop = loopingcall.FixedIntervalLoopingCall(
+                self._purge_bindings)
+            self._purge_loop.start(
+                interval=CONF.niblick.binding_purge_interval)
+
+    def _purge_bindings(self):
+        try:
+            self._resource_manager.purge_deleted_bindings(
+                n_context.get_admin_context())
+        except Exception:
+            LOG.exception(_('Failed to purge deleted bindings'))
 
     def _get_l2_plugin(self):
         l2_descriptor = self._plugin_manager.l2_descriptor
@@ -71,20 +122,50 @@ class Interceptor(l3_db.L3_NAT_db_mixin):
         with self._resource_manager.deallocate_resource(context, id):
             plugin.delete_router(context, id)
 
+    def _get_all_routers(self, context, *args):
+        # The backends share the session of the context, which must not
+        # be used by several green threads, so they are called in turn.
+        return [plugin.get_routers(context, *args)
+                for plugin in self._get_all_plugins(context,
+                                                    ROUTER_OBJECT_TYPE)]
+
     def get_routers(self, context, filters=None, fields=None,
                     sorts=None, limit=None, marker=None, page_reverse=False):
-        res = {}
-        for plugin in self._get_all_plugins(context, ROUTER_OBJECT_TYPE):
-            routers = plugin.get_routers(context, filters, fields, sorts,
-                                         limit, marker, page_reverse)
-            for router in routers:
-                router_id = router['id']
-                if router_id not in res:
-                    res[router_id] = router
-        return res.values()
+        # Routers are merged by id and sort keys, so these have to be
+        # fetched even if the caller did not ask for them.
+        extra_fields = []
+        if fields:
+            sort_keys = [sort_key for sort_key, _direction in sorts or []]
+            for key in ['id'] + sort_keys:
+                if key not in fields and key not in extra_fields:
+                    extra_fields.append(key)
+            fields = fields + extra_fields
+
+        results = self._get_all_routers(context, filters, fields, sorts,
+                                        limit, marker, page_reverse)
+        if sorts:
+            routers = _unique(_merge_sorted(results, sorts))
+        else:
+            routers = _unique(itertools.chain(*results))
+
+        if not limit:
+            routers = list(routers)
+        elif page_reverse:
+            # Every backend returned the last page before the marker, so
+            # the merged page is the tail of the merged list.
+            routers = list(collections.deque(routers, maxlen=limit))
+        else:
+            routers = list(itertools.islice(routers, limit))
+
+        for router in routers:
+            for key in extra_fields:
+                router.pop(key, None)
+        return routers
 
     def get_routers_count(self, context, filters=None):
-        return len(self.get_routers(context, filters))
+        results = self._get_all_routers(context, filters, ['id'])
+        ids = set(router['id'] for router in itertools.chain(*results))
+        return len(ids)
 
     def add_router_interface(self, context, router_id, interface_info):
         plugin = self._get_plugin(context, router_id)
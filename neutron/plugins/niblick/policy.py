@@ -15,14 +15,18 @@
 #    under the License.
 
 import abc
+import collections
 import copy
+import uuid
 
+from eventlet import semaphore
 from oslo.config import cfg
 
+from neutron.openstack.common.db import exception as db_exc
 from neutron.openstack.common import excutils
 from neutron.openstack.common.importutils import import_class
 from neutron.openstack.common import log
-from neutron.openstack.common.uuidutils import generate_uuid
+from neutron.plugins.niblick.db import api as db_api
 from neutron.plugins.niblick import exceptions
 
 policy_opts = [
@@ -39,6 +43,9 @@ CONF.register_opts(policy_opts, "niblick")
 
 LOG = log.getLogger(__name__)
 
+# namespace of the ids of the resources of the configured instances
+RESOURCE_NAMESPACE = uuid.UUID('61316b9c-3532-4e23-8c75-e4f0c092398c')
+
 
 class PolicyAPI(object):
     """Base abstract class for Policy driver"""
@@ -54,38 +61,109 @@ class PolicyAPI(object):
 
 
 class SimplePolicyDriver(PolicyAPI):
-    """Proof-of-concept Policy driver"""
+    """Proof-of-concept Policy driver
 
-    def _create_resource(self, resource_type, instance_id, instance_ip):
-        """Helper function for SupervisorLessPolicyDriver"""
-        uuid = generate_uuid()
-        return (uuid, {'resource_id': uuid,
-                       'resource_type': resource_type,
-                       'resource_metadata': {'instance_id': instance_id,
-                                             'instance_ip': instance_ip},
-                       'allocated': False,
-                       'resource_descriptor': 'linuxbridge'})
+    Free resources are kept in a list per resource type, so acquire and
+    release do not depend on the number of resources. Allocation state is
+    stored in the database and loaded on first use. A resource is claimed
+    in the database only if it is still free there, so servers sharing
+    the database never hand out the same resource.
+    """
 
     def __init__(self):
-        res = []
-        for inst_id, inst_ip in CONF.niblick.instances.iteritems():
-            res.append(self._create_resource('router', inst_id, inst_ip))
-        self._resources = dict(res)
+        self._resources = {}
+        self._free = collections.defaultdict(collections.deque)
+        self._lock = semaphore.Semaphore()
+        self._loaded = False
+
+    def _create_resource(self, resource_type, instance_id, instance_ip):
+        """Helper function for SupervisorLessPolicyDriver
+
+        The id is derived from the instance id, so that servers adding the
+        same instance at the same time add the same row.
+        """
+        return {'resource_id': str(uuid.uuid5(RESOURCE_NAMESPACE,
+                                              str(instance_id))),
+                'resource_type': resource_type,
+                'resource_metadata': {'instance_id': instance_id,
+                                      'instance_ip': instance_ip},
+                'allocated': False,
+                'resource_descriptor': 'linuxbridge'}
+
+    def _load(self, context):
+        try:
+            self._load_resources(context)
+        except db_exc.DBDuplicateEntry:
+            # another server added the same instances meanwhile
+            LOG.debug(_('Resources were added by another server, '
+                        'reloading them'))
+            self._resources.clear()
+            self._load_resources(context)
 
-    def acquire_resource(self, context, resource_type):
         for res in self._resources.itervalues():
-            if not res['allocated'] and res['resource_type'] == resource_type:
+            if not res['allocated']:
+                self._free[res['resource_type']].append(res['resource_id'])
+        self._loaded = True
+
+    def _load_resources(self, context):
+        known_instances = set()
+        for obj in db_api.resource_get_all(context):
+            res = dict(obj)
+            self._resources[res['resource_id']] = res
+            known_instances.add(res['resource_metadata']['instance_id'])
+
+        with context.session.begin(subtransactions=True):
+            for inst_id, inst_ip in CONF.niblick.instances.iteritems():
+                if inst_id not in known_instances:
+                    res = self._create_resource('router', inst_id, inst_ip)
+                    db_api.resource_add(context, res)
+                    self._resources[res['resource_id']] = res
+
+    def _reload_free(self, context, resource_type):
+        """Pick up the resources released by other servers."""
+        free = self._free[resource_type]
+        for obj in db_api.resource_get_free(context, resource_type):
+            res = self._resources.setdefault(obj['resource_id'], dict(obj))
+            res['allocated'] = False
+            free.append(res['resource_id'])
+
+    def acquire_resource(self, context, resource_type):
+        with self._lock:
+            if not self._loaded:
+                self._load(context)
+            free = self._free[resource_type]
+            if not free:
+                self._reload_free(context, resource_type)
+            while free:
+                res = self._resources[free.popleft()]
+                try:
+                    claimed = db_api.resource_claim(context,
+                                                    res['resource_id'])
+                except Exception:
+                    with excutils.save_and_reraise_exception():
+                        free.appendleft(res['resource_id'])
+                # Whether we or another server allocated it, it is not free
                 res['allocated'] = True
-                return copy.deepcopy(res)
-        raise exceptions.NoMoreResources(resource_type=resource_type)
+                if claimed:
+                    return copy.deepcopy(res)
+                LOG.debug(_('Resource %s was allocated by another server'),
+                          res['resource_id'])
+            raise exceptions.NoMoreResources(resource_type=resource_type)
 
     def release_resource(self, context, resource_id):
-        try:
-            self._resources[resource_id]['allocated'] = False
-        except KeyError:
-            with excutils.save_and_reraise_exception():
-                LOG.exception(_('Release resource'))
+        with self._lock:
+            if not self._loaded:
+                self._load(context)
+            res = self._resources.get(resource_id)
+            if res is None:
+                LOG.error(_('Release of unknown resource %s'), resource_id)
                 raise exceptions.WrongResourceId(resource_id=resource_id)
+            # It may have been allocated by another server, whose state
+            # this one does not know
+            db_api.resource_set_allocated(context, resource_id, False)
+            if res['allocated']:
+                res['allocated'] = False
+                self._free[res['resource_type']].append(resource_id)
 
 
 class PolicyManager(PolicyAPI):
@@ -14,7 +14,11 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
 import contextlib
+import time
+
+from oslo.config import cfg
 
 from neutron.openstack.common import excutils
 from neutron.openstack.common import log
@@ -22,12 +26,68 @@ from neutron.plugins.niblick.db import api as db_api
 from neutron.plugins.niblick import exceptions as exc
 from neutron.plugins.niblick import policy
 
+resource_opts = [
+    cfg.IntOpt('binding_cache_size', default=1024,
+               help=_("Maximum number of object bindings cached by the "
+                      "resource manager, 0 disables the cache")),
+    cfg.IntOpt('binding_cache_ttl', default=60,
+               help=_("Number of seconds a cached binding is trusted "
+                      "before it is read from the database again")),
+    cfg.IntOpt('binding_purge_interval', default=0,
+               help=_("Seconds between purges of deleted bindings, 0 "
+                      "disables purging")),
+    cfg.IntOpt('binding_purge_age', default=604800,
+               help=_("Number of seconds a deleted binding is kept before "
+                      "it is purged")),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(resource_opts, 'niblick')
+
 LOG = log.getLogger(__name__)
 
 
+class BindingCache(object):
+    """Size bounded LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            return None
+        if expires < time.time():
+            return None
+        self._data[key] = (expires, value)
+        return value
+
+    def put(self, key, value):
+        if self._size <= 0 or self._ttl <= 0:
+            return
+        self._data.pop(key, None)
+        self._data[key] = (time.time() + self._ttl, value)
+        while len(self._data) > self._size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+
 class ResourceManager(object):
     def __init__(self):
         self._pm = policy.PolicyManager()
+        size = CONF.niblick.binding_cache_size
+        ttl = CONF.niblick.binding_cache_ttl
+        # The binding of an object does not change until the object is
+        # deleted, so a cached binding can only be stale for an object
+        # another server deleted, whose backend then reports it missing.
+        # The descriptors of a resource type change whenever any server
+        # binds a new backend, so they are read for every request.
+        self._bindings = BindingCache(size, ttl)
 
     @contextlib.contextmanager
     def allocate_resource(self, context, resource_type):
@@ -49,17 +109,26 @@ class ResourceManager(object):
         try:
             self._pm.release_resource(context, res['resource_id'])
         finally:
+            self._bindings.invalidate(res['object_id'])
             db_api.binding_delete(context, res['object_id'])
 
     def bind_object(self, context, object_id, resource):
         resource['object_id'] = object_id
         resource.update(dict(db_api.binding_add(context, resource)))
+        self._bindings.put(object_id, dict(resource))
 
     def get_resource(self, context, object_id):
-        obj = db_api.binding_get(context, object_id)
-        return dict(obj)
+        res = self._bindings.get(object_id)
+        if res is None:
+            res = dict(db_api.binding_get(context, object_id))
+            self._bindings.put(object_id, res)
+        return dict(res)
+
+    def purge_deleted_bindings(self, context):
+        count = db_api.binding_purge_deleted(context,
+                                             CONF.niblick.binding_purge_age)
+        LOG.debug(_('Purged %d deleted bindings'), count)
+        return count
 
     def get_descriptors(self, context, resource_type):
-        descriptors = db_api.binding_get_descriptors(
-            context, resource_type)
-        return descriptors
+        return db_api.binding_get_descriptors(context, resource_type)
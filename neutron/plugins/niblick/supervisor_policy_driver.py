@@ -14,24 +14,80 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-import httplib2
+import atexit
+import collections
+import errno
+import httplib
+import os
+import socket
 import urllib
 
+import eventlet
+from eventlet import pools
+from eventlet import semaphore
+import httplib2
 from oslo.config import cfg
 
+from neutron import context as n_context
 from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+from neutron.plugins.niblick.db import api as db_api
 from neutron.plugins.niblick import exceptions
 from neutron.plugins.niblick import policy
 
 supervisor_opts = [
     cfg.StrOpt('supervisor_host', default='localhost'),
     cfg.IntOpt('supervisor_port', default=8080),
-    cfg.StrOpt('supervisor_version', default='v1')
+    cfg.StrOpt('supervisor_version', default='v1'),
+    cfg.IntOpt('supervisor_pool_size', default=4,
+               help=_("Maximum number of persistent connections to the "
+                      "supervisor")),
+    cfg.IntOpt('supervisor_timeout', default=30,
+               help=_("Timeout in seconds for supervisor requests")),
+    cfg.IntOpt('supervisor_retries', default=1,
+               help=_("Number of times a request is retried on a fresh "
+                      "connection if a pooled one turns out to be stale")),
+    cfg.IntOpt('supervisor_reserve_size', default=0,
+               help=_("Number of resources of each class claimed ahead of "
+                      "time and kept by this server. 0 disables the local "
+                      "reserve and resources are acquired one by one")),
+    cfg.IntOpt('supervisor_claim_retries', default=3,
+               help=_("Number of times a batch claim is retried when the "
+                      "supervisor reports a conflicting allocation")),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(supervisor_opts, 'niblick')
 
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(pools.Pool):
+    """Pool of keep-alive connections to the supervisor."""
+
+    def __init__(self, host, port, timeout, max_size):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        super(ConnectionPool, self).__init__(max_size=max_size,
+                                             order_as_stack=True)
+
+    def create(self):
+        self.misses += 1
+        LOG.debug(_('Pool creating new connection to %(host)s:%(port)s'),
+                  {'host': self.host, 'port': self.port})
+        return httplib2.HTTPConnectionWithTimeout(self.host, self.port,
+                                                  timeout=self.timeout)
+
+    def get(self):
+        misses = self.misses
+        conn = super(ConnectionPool, self).get()
+        if self.misses == misses:
+            self.hits += 1
+        return conn
+
 
 class SupervisorPolicyDriver(policy.PolicyAPI):
     def __init__(self):
@@ -39,48 +95,191 @@ class SupervisorPolicyDriver(policy.PolicyAPI):
         self.port = CONF.niblick.supervisor_port
         version = CONF.niblick.supervisor_version
         self.url = '/%(version)s/resources/' % {'version': version}
+        self.pool = ConnectionPool(self.host, self.port,
+                                   CONF.niblick.supervisor_timeout,
+                                   CONF.niblick.supervisor_pool_size)
+        self._reserve = collections.defaultdict(collections.deque)
+        self._refill_locks = collections.defaultdict(semaphore.Semaphore)
+        # pid of the process which reclaimed the reserves of dead owners
+        self._reclaimed_by = None
+        if CONF.niblick.supervisor_reserve_size > 0:
+            atexit.register(self._release_reserve_at_exit)
+
+    def _request(self, conn, method, url, body):
+        conn.request(method, url, body)
+        resp = conn.getresponse()
+        return resp.status, resp.read()
 
     def _get(self, url, method='GET', body=None):
         if body is not None:
             body = jsonutils.dumps(body)
-        conn = httplib2.HTTPConnectionWithTimeout(self.host, self.port)
-        conn.request(method, url, body)
-        resp = conn.getresponse()
-        content = resp.read()
+        with self.pool.item() as conn:
+            retries = CONF.niblick.supervisor_retries
+            while True:
+                try:
+                    status, content = self._request(conn, method, url, body)
+                    break
+                except (httplib.HTTPException, socket.error):
+                    # The supervisor may have dropped a kept-alive
+                    # connection; reconnect and try again. Only a GET is
+                    # safe to resend, a PUT may already have been applied.
+                    conn.close()
+                    if method != 'GET' or retries <= 0:
+                        raise
+                    retries -= 1
+                    LOG.debug(_('Retrying %(method)s %(url)s on a new '
+                                'connection'), {'method': method, 'url': url})
+        if status == httplib.CONFLICT:
+            raise exceptions.ResourceConflict(url=url)
         if content:
             content = jsonutils.loads(content)
         return content
 
-    def _list(self, resource_class):
-        search_opts = {'limit': 1, 'class': resource_class,
+    def get_pool_stats(self):
+        return {'hits': self.pool.hits, 'misses': self.pool.misses}
+
+    def _free_resources_url(self, resource_class, limit):
+        search_opts = {'limit': limit, 'class': resource_class,
                        'processing': False, 'unused': False,
                        'allocated': False}
         query = urllib.urlencode(search_opts)
-        url = '%(url)s?%(query)s' % {'url': self.url, 'query': query}
+        return '%(url)s?%(query)s' % {'url': self.url, 'query': query}
+
+    def _owner(self):
+        """Attributes recording the process a resource is allocated by."""
+        return {'reserved_host': CONF.host, 'reserved_pid': os.getpid()}
+
+    def _list(self, resource_class):
+        url = self._free_resources_url(resource_class, 1)
         resp = self._get(url)['resources']
         return resp
 
+    def _claim(self, resource_class, count):
+        """Allocate up to count free resources in a single request.
+
+        The update is applied by the supervisor only to resources that
+        still match the filter, so concurrent claims never hand out the
+        same resource twice; a conflicting claim is retried.
+        """
+        url = self._free_resources_url(resource_class, count)
+        body = {'resource': dict(self._owner(), allocated=True)}
+        retries = CONF.niblick.supervisor_claim_retries
+        while True:
+            try:
+                return self._get(url, 'PUT', body)['resources']
+            except exceptions.ResourceConflict:
+                if retries <= 0:
+                    raise
+                retries -= 1
+                LOG.debug(_('Claim of %s resources conflicted, retrying'),
+                          resource_class)
+
     def _update(self, resource_id, allocated):
         body = {'resource': {'allocated': allocated}}
+        if allocated:
+            body['resource'].update(self._owner())
         url = '%(url)s%(resource_id)s' % {'url': self.url,
                                           'resource_id': resource_id}
         resp = self._get(url, 'PUT', body)
         return resp.get('resource')
 
+    def _make_resource(self, resource, resource_class):
+        res = {'resource_id': resource.pop('id'),
+               'resource_type': resource_class,
+               'allocated': resource.pop('allocated'),
+               'resource_descriptor': resource.pop('type')}
+        resource.pop('reserved_host', None)
+        resource.pop('reserved_pid', None)
+        res['resource_metadata'] = resource
+        return res
+
+    def _refill(self, resource_class):
+        with self._refill_locks[resource_class]:
+            reserve = self._reserve[resource_class]
+            count = CONF.niblick.supervisor_reserve_size - len(reserve)
+            if count > 0:
+                for resource in self._claim(resource_class, count):
+                    reserve.append(self._make_resource(resource,
+                                                       resource_class))
+
+    def _refill_in_background(self, resource_class):
+        try:
+            self._refill(resource_class)
+        except Exception:
+            LOG.exception(_('Failed to refill reserve of %s resources'),
+                          resource_class)
+
+    def _acquire_reserved(self, resource_class):
+        reserve = self._reserve[resource_class]
+        if not reserve:
+            self._refill(resource_class)
+        try:
+            res = reserve.popleft()
+        except IndexError:
+            raise exceptions.NoMoreResources(resource_type=resource_class)
+        if len(reserve) <= CONF.niblick.supervisor_reserve_size / 2:
+            eventlet.spawn_n(self._refill_in_background, resource_class)
+        return res
+
+    def _is_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno != errno.ESRCH
+        return True
+
+    def _reclaim(self, context):
+        """Release the unbound resources of dead processes of this host.
+
+        The reserve of a process which did not exit cleanly stays
+        allocated on the supervisor. A resource is given back when the
+        process it is allocated by is gone and no object is bound to it.
+        """
+        query = urllib.urlencode({'allocated': True,
+                                  'reserved_host': CONF.host})
+        url = '%(url)s?%(query)s' % {'url': self.url, 'query': query}
+        reclaimed = 0
+        for resource in self._get(url)['resources']:
+            pid = resource.get('reserved_pid')
+            if (pid is None or self._is_alive(int(pid)) or
+                    db_api.binding_get_by_resource(context, resource['id'])):
+                continue
+            self._update(resource['id'], False)
+            reclaimed += 1
+        if reclaimed:
+            LOG.info(_('Released %d resources reserved by processes which '
+                       'are gone'), reclaimed)
+
     def acquire_resource(self, context, resource_class):
+        if CONF.niblick.supervisor_reserve_size > 0:
+            if self._reclaimed_by != os.getpid():
+                self._reclaimed_by = os.getpid()
+                try:
+                    self._reclaim(context)
+                except Exception:
+                    LOG.exception(_('Failed to reclaim reserved resources'))
+            return self._acquire_reserved(resource_class)
         resources = self._list(resource_class)
         if resources:
             resource = resources[0]
             resource = self._update(resource['id'], True)
-            res = {'resource_id': resource.pop('id'),
-                   'resource_type': resource_class,
-                   'allocated': resource.pop('allocated'),
-                   'resource_descriptor': resource.pop('type')}
-            res['resource_metadata'] = resource
-            return res
+            return self._make_resource(resource, resource_class)
         raise exceptions.NoMoreResources(resource_type=resource_class)
 
     def release_resource(self, context, resource_id):
         resp = self._update(resource_id, False)
         if not resp:
             raise exceptions.WrongResourceId(resource_id=resource_id)
+
+    def release_reserve(self, context):
+        """Give all locally reserved resources back to the supervisor."""
+        for reserve in self._reserve.itervalues():
+            while reserve:
+                res = reserve.popleft()
+                self.release_resource(context, res['resource_id'])
+
+    def _release_reserve_at_exit(self):
+        try:
+            self.release_reserve(n_context.get_admin_context())
+        except Exception:
+            LOG.exception(_('Failed to release reserved resources'))
@@ -22,6 +22,7 @@
 # @author: Seetharama Ayyadevara, Freescale Semiconductor, Inc.
 # @author: Kyle Mestery, Cisco Systems, Inc.
 
+import contextlib
 import distutils.version as dist_version
 import sys
 import time
@@ -31,6 +32,7 @@ from oslo.config import cfg
 
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_monitor
 from neutron.agent import rpc as agent_rpc
 from neutron.agent import securitygroups_rpc as sg_rpc
 from neutron.common import config as logging_config
@@ -150,7 +152,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
 
     def __init__(self, integ_br, tun_br, local_ip,
                  bridge_mappings, root_helper,
-                 polling_interval, tunnel_types=None):
+                 polling_interval, tunnel_types=None,
+                 minimize_polling=False,
+                 ovsdb_monitor_respawn_interval=30):
         '''Constructor.
 
         :param integ_br: name of the integration bridge.
@@ -162,6 +166,11 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
         :param tunnel_types: A list of tunnel types to enable support for in
                the agent. If set, will automatically set enable_tunneling to
                True.
+        :param minimize_polling: Optional, whether to minimize polling by
+               monitoring ovsdb for interface changes.
+        :param ovsdb_monitor_respawn_interval: Optional, when using polling
+               minimization, the number of seconds to wait before respawning
+               the ovsdb monitor.
         '''
         self.root_helper = root_helper
         self.available_local_vlans = set(xrange(q_const.MIN_VLAN_TAG,
@@ -171,6 +180,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
         self.local_vlan_map = {}
 
         self.polling_interval = polling_interval
+        self.minimize_polling = minimize_polling
+        # cleared when the server does not support the bulk device RPCs
+        self.use_bulk_rpc = True
+        self.ovsdb_monitor_respawn_interval = ovsdb_monitor_respawn_interval
 
         if tunnel_types:
             self.enable_tunneling = True
@@ -636,22 +649,40 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
         else:
             LOG.debug(_("No VIF port for port %s defined on agent."), port_id)
 
+    def _devices_rpc(self, bulk_method, method, devices):
+        """Call a bulk device RPC, or the per device one on old servers."""
+        if self.use_bulk_rpc:
+            try:
+                return getattr(self.plugin_rpc, bulk_method)(
+                    self.context, devices, self.agent_id)
+            except rpc_common.RemoteError as e:
+                if e.exc_type != 'UnsupportedRpcVersion':
+                    raise
+                LOG.warning(_("Server does not support %s, falling back to "
+                              "per device calls"), bulk_method)
+                self.use_bulk_rpc = False
+        rpc_method = getattr(self.plugin_rpc, method)
+        return [rpc_method(self.context, device, self.agent_id)
+                for device in devices]
+
     def treat_devices_added(self, devices):
-        resync = False
         self.sg_agent.prepare_devices_filter(devices)
-        for device in devices:
+        try:
+            devices_details_list = self._devices_rpc(
+                'get_devices_details_list', 'get_device_details',
+                list(devices))
+        except Exception as e:
+            LOG.debug(_("Unable to get port details for "
+                        "%(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            # resync is needed
+            return True
+        vif_ports = self.int_br.get_vif_ports_by_ids(
+            details['device'] for details in devices_details_list)
+        for details in devices_details_list:
+            device = details['device']
             LOG.info(_("Port %s added"), device)
-            try:
-                details = self.plugin_rpc.get_device_details(self.context,
-                                                             device,
-                                                             self.agent_id)
-            except Exception as e:
-                LOG.debug(_("Unable to get port details for "
-                            "%(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
-            port = self.int_br.get_vif_port_by_id(details['device'])
+            port = vif_ports.get(device)
             if 'port_id' in details:
                 LOG.info(_("Port %(device)s updated. Details: %(details)s"),
                          {'device': device, 'details': details})
@@ -665,29 +696,28 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
                 LOG.debug(_("Device %s not defined on plugin"), device)
                 if (port and int(port.ofport) != -1):
                     self.port_dead(port)
-        return resync
+        return False
 
     def treat_devices_removed(self, devices):
-        resync = False
         self.sg_agent.remove_devices_filter(devices)
-        for device in devices:
+        try:
+            devices_details_list = self._devices_rpc(
+                'update_devices_down', 'update_device_down', list(devices))
+        except Exception as e:
+            LOG.debug(_("port_removed failed for %(devices)s: %(e)s"),
+                      {'devices': devices, 'e': e})
+            # resync is needed
+            return True
+        for details in devices_details_list:
+            device = details['device']
             LOG.info(_("Attachment %s removed"), device)
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id)
-            except Exception as e:
-                LOG.debug(_("port_removed failed for %(device)s: %(e)s"),
-                          {'device': device, 'e': e})
-                resync = True
-                continue
             if details['exists']:
                 LOG.info(_("Port %s updated."), device)
                 # Nothing to do regarding local networking
             else:
                 LOG.debug(_("Device %s not defined on plugin"), device)
                 self.port_unbound(device)
-        return resync
+        return False
 
     def process_network_ports(self, port_info):
         resync_a = False
@@ -721,42 +751,109 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin):
             resync = True
         return resync
 
+    def _start_ovsdb_monitor(self):
+        """Start monitoring interface changes, return whether it started."""
+        self.ovsdb_monitor_started = time.time()
+        try:
+            self.ovsdb_monitor.start()
+            return True
+        except Exception:
+            LOG.exception(_("Unable to start the ovsdb monitor, polling "
+                            "for device changes"))
+            return False
+
+    def _monitor_ports(self):
+        """Whether port changes are known from the ovsdb monitor.
+
+        A monitor which died is respawned once the respawn interval
+        elapsed; in the meantime the agent polls for port changes.
+        """
+        if not self.minimize_polling:
+            return False
+        if self.ovsdb_monitor.is_active():
+            return True
+        if (time.time() - self.ovsdb_monitor_started <
+                self.ovsdb_monitor_respawn_interval):
+            return False
+        LOG.warning(_("The ovsdb monitor is not running, respawning it"))
+        return self._start_ovsdb_monitor()
+
+    @contextlib.contextmanager
+    def _defer_apply_flows(self):
+        """Program the flows changed within the block at its end.
+
+        Each bridge then runs one ovs-ofctl per run of flow additions or
+        deletions instead of one per flow.
+        """
+        bridges = [self.int_br] + self.phys_brs.values()
+        if self.enable_tunneling:
+            bridges.append(self.tun_br)
+        for br in bridges:
+            br.defer_apply_on()
+        try:
+            yield
+        finally:
+            for br in bridges:
+                br.defer_apply_off()
+
     def rpc_loop(self):
         sync = True
         ports = set()
         tunnel_sync = True
+        # whether the interfaces may have changed since the last scan
+        ports_changed = True
+        if self.minimize_polling:
+            self.ovsdb_monitor = ovsdb_monitor.OvsdbMonitor(
+                'Interface', columns=['name', 'external_ids'],
+                root_helper=self.root_helper)
+            self._start_ovsdb_monitor()
 
         while True:
             try:
                 start = time.time()
+                if self.sg_agent.firewall_apply_failed():
+                    sync = True
                 if sync:
                     LOG.info(_("Agent out of sync with plugin!"))
                     ports.clear()
                     sync = False
+                    ports_changed = True
 
                 # Notify the plugin of tunnel IP
                 if self.enable_tunneling and tunnel_sync:
                     LOG.info(_("Agent tunnel out of sync with plugin!"))
                     tunnel_sync = self.tunnel_sync()
 
-                port_info = self.update_ports(ports)
-
-                # notify plugin about port deltas
-                if port_info:
-                    LOG.debug(_("Agent loop has new devices!"))
-                    # If treat devices fails - must resync with plugin
-                    sync = self.process_network_ports(port_info)
-                    ports = port_info['current']
+                monitored = self._monitor_ports()
+                if monitored and self.ovsdb_monitor.get_updates():
+                    ports_changed = True
+                if ports_changed or not monitored:
+                    ports_changed = False
+                    port_info = self.update_ports(ports)
+
+                    # notify plugin about port deltas
+                    if port_info:
+                        LOG.debug(_("Agent loop has new devices!"))
+                        # If treat devices fails - must resync with plugin
+                        with self._defer_apply_flows():
+                            sync = self.process_network_ports(port_info)
+                        ports = port_info['current']
 
             except Exception:
                 LOG.exception(_("Error in agent event loop"))
                 sync = True
                 tunnel_sync = True
 
-            # sleep till end of polling interval
+            # sleep till end of polling interval, or until the monitor
+            # reports interface changes
             elapsed = (time.time() - start)
             if (elapsed < self.polling_interval):
-                time.sleep(self.polling_interval - elapsed)
+                if self._monitor_ports() and not sync:
+                    if self.ovsdb_monitor.get_updates(
+                            self.polling_interval - elapsed):
+                        ports_changed = True
+                else:
+                    time.sleep(self.polling_interval - elapsed)
             else:
                 LOG.debug(_("Loop iteration exceeded interval "
                             "(%(polling_interval)s vs. %(elapsed)s)!"),
@@ -824,6 +921,9 @@ def create_agent_config_map(config):
         root_helper=config.AGENT.root_helper,
         polling_interval=config.AGENT.polling_interval,
         tunnel_types=config.AGENT.tunnel_types,
+        minimize_polling=config.AGENT.minimize_polling,
+        ovsdb_monitor_respawn_interval=(
+            config.AGENT.ovsdb_monitor_respawn_interval),
     )
 
     # If enable_tunneling is TRUE, set tunnel_type to default to GRE
@@ -47,6 +47,16 @@ def get_network_binding(session, network_id):
         return
 
 
+def get_network_bindings(session, network_ids):
+    """Return the bindings of the given networks, keyed by network id."""
+    if not network_ids:
+        return {}
+    session = session or db.get_session()
+    query = session.query(ovs_models_v2.NetworkBinding).filter(
+        ovs_models_v2.NetworkBinding.network_id.in_(network_ids))
+    return dict((binding.network_id, binding) for binding in query)
+
+
 def add_network_binding(session, network_id, network_type,
                         physical_network, segmentation_id):
     with session.begin(subtransactions=True):
@@ -316,6 +326,16 @@ def get_port(port_id):
     return port
 
 
+def get_ports(port_ids):
+    """Return the ports of the given ids found in the db, keyed by id."""
+    if not port_ids:
+        return {}
+    session = db.get_session()
+    query = session.query(models_v2.Port).filter(
+        models_v2.Port.id.in_(port_ids))
+    return dict((port['id'], port) for port in query)
+
+
 def get_port_from_device(port_id):
     """Get port from database."""
     LOG.debug(_("get_port_with_securitygroups() called:port_id=%s"), port_id)
@@ -353,6 +373,17 @@ def set_port_status(port_id, status):
         raise q_exc.PortNotFound(port_id=port_id)
 
 
+def set_ports_status(port_ids, status):
+    """Set the status of several ports, ignoring the missing ones."""
+    if not port_ids:
+        return
+    session = db.get_session()
+    with session.begin(subtransactions=True):
+        (session.query(models_v2.Port).
+         filter(models_v2.Port.id.in_(port_ids)).
+         update({'status': status}, synchronize_session=False))
+
+
 def get_tunnel_endpoints():
     session = db.get_session()
 
@@ -21,6 +21,7 @@
 # @author: Bob Kukura, Red Hat, Inc.
 # @author: Seetharama Ayyadevara, Freescale Semiconductor, Inc.
 
+import collections
 import sys
 
 from oslo.config import cfg
@@ -66,8 +67,10 @@ class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
     # history
     #   1.0 Initial version
     #   1.1 Support Security Group RPC
+    #   1.2 Support security group info RPCs
+    #   1.3 Support bulk device RPCs
 
-    RPC_API_VERSION = '1.1'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self, notifier, tunnel_type):
         self.notifier = notifier
@@ -89,50 +92,81 @@ class OVSRpcCallbacks(dhcp_rpc_base.DhcpRpcCallbackMixin,
             port['device'] = device
         return port
 
+    def _get_devices_details(self, devices):
+        ports = ovs_db_v2.get_ports(devices)
+        bindings = ovs_db_v2.get_network_bindings(
+            None, set(port['network_id'] for port in ports.itervalues()))
+        entries = []
+        status_changes = collections.defaultdict(list)
+        for device in devices:
+            port = ports.get(device)
+            if not port:
+                entries.append({'device': device})
+                LOG.debug(_("%s can not be found in database"), device)
+                continue
+            binding = bindings[port['network_id']]
+            entries.append({'device': device,
+                            'network_id': port['network_id'],
+                            'port_id': port['id'],
+                            'admin_state_up': port['admin_state_up'],
+                            'network_type': binding.network_type,
+                            'segmentation_id': binding.segmentation_id,
+                            'physical_network': binding.physical_network})
+            new_status = (q_const.PORT_STATUS_ACTIVE if port['admin_state_up']
+                          else q_const.PORT_STATUS_DOWN)
+            if port['status'] != new_status:
+                status_changes[new_status].append(port['id'])
+        for status, port_ids in status_changes.iteritems():
+            ovs_db_v2.set_ports_status(port_ids, status)
+        return entries
+
     def get_device_details(self, rpc_context, **kwargs):
         """Agent requests device details."""
         agent_id = kwargs.get('agent_id')
         device = kwargs.get('device')
         LOG.debug(_("Device %(device)s details requested from %(agent_id)s"),
                   {'device': device, 'agent_id': agent_id})
-        port = ovs_db_v2.get_port(device)
-        if port:
-            binding = ovs_db_v2.get_network_binding(None, port['network_id'])
-            entry = {'device': device,
-                     'network_id': port['network_id'],
-                     'port_id': port['id'],
-                     'admin_state_up': port['admin_state_up'],
-                     'network_type': binding.network_type,
-                     'segmentation_id': binding.segmentation_id,
-                     'physical_network': binding.physical_network}
-            new_status = (q_const.PORT_STATUS_ACTIVE if port['admin_state_up']
-                          else q_const.PORT_STATUS_DOWN)
-            if port['status'] != new_status:
-                ovs_db_v2.set_port_status(port['id'], new_status)
-        else:
-            entry = {'device': device}
-            LOG.debug(_("%s can not be found in database"), device)
-        return entry
+        return self._get_devices_details([device])[0]
+
+    def get_devices_details_list(self, rpc_context, **kwargs):
+        """Agent requests the details of several devices."""
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices', [])
+        LOG.debug(_("Details of %(count)d devices requested from "
+                    "%(agent_id)s"),
+                  {'count': len(devices), 'agent_id': agent_id})
+        return self._get_devices_details(devices)
+
+    def _update_devices_down(self, devices):
+        # TODO(garyk) - live migration and port status
+        ports = ovs_db_v2.get_ports(devices)
+        ovs_db_v2.set_ports_status(
+            [port_id for port_id, port in ports.iteritems()
+             if port['status'] != q_const.PORT_STATUS_DOWN],
+            q_const.PORT_STATUS_DOWN)
+        entries = []
+        for device in devices:
+            entries.append({'device': device,
+                            'exists': device in ports})
+            if device not in ports:
+                LOG.debug(_("%s can not be found in database"), device)
+        return entries
 
     def update_device_down(self, rpc_context, **kwargs):
         """Device no longer exists on agent."""
-        # TODO(garyk) - live migration and port status
         agent_id = kwargs.get('agent_id')
         device = kwargs.get('device')
         LOG.debug(_("Device %(device)s no longer exists on %(agent_id)s"),
                   {'device': device, 'agent_id': agent_id})
-        port = ovs_db_v2.get_port(device)
-        if port:
-            entry = {'device': device,
-                     'exists': True}
-            if port['status'] != q_const.PORT_STATUS_DOWN:
-                # Set port status to DOWN
-                ovs_db_v2.set_port_status(port['id'], q_const.PORT_STATUS_DOWN)
-        else:
-            entry = {'device': device,
-                     'exists': False}
-            LOG.debug(_("%s can not be found in database"), device)
-        return entry
+        return self._update_devices_down([device])[0]
+
+    def update_devices_down(self, rpc_context, **kwargs):
+        """Several devices no longer exist on agent."""
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices', [])
+        LOG.debug(_("%(count)d devices no longer exist on %(agent_id)s"),
+                  {'count': len(devices), 'agent_id': agent_id})
+        return self._update_devices_down(devices)
 
     def update_device_up(self, rpc_context, **kwargs):
         """Device is up on agent."""
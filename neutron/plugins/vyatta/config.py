@@ -15,6 +15,15 @@ vrouter_plugin_opts = [
     cfg.StrOpt('tenant_admin_name', help=_('Name of tenant admin user.')),
     cfg.StrOpt('tenant_admin_password', help=_('Tenant admin password.')),
     cfg.StrOpt('keystone_url', help=_('Keystone URL.')),
+    cfg.IntOpt('api_timeout', default=30,
+               help=_('Timeout in seconds for requests to the API proxy.')),
+    cfg.IntOpt('api_pool_size', default=2,
+               help=_('Maximum number of kept-alive connections to each '
+                      'vRouter API proxy.')),
+    cfg.IntOpt('instance_resync_interval', default=600,
+               help=_('Seconds after which the list of vRouter instances '
+                      'is fetched from nova in full instead of only the '
+                      'changed instances.')),
 
 ]
 
@@ -13,6 +13,10 @@ class VRouterOperationError(exceptions.NeutronException):
     message = _("Internal vRouter failure [%(ip_address)s]: failed to "
                 "%(action)s router, HTTP error %(code)s: %(message)s.")
 
+    def __init__(self, **kwargs):
+        super(VRouterOperationError, self).__init__(**kwargs)
+        self.code = kwargs.get('code')
+
 
 class InvalidNumberIPsOnPort(exceptions.NeutronException):
     """
@@ -1,3 +1,4 @@
+import collections
 import hashlib
 import hmac
 import httplib
@@ -5,6 +6,10 @@ import json
 import logging
 import socket
 
+from eventlet import pools
+from eventlet import semaphore
+
+from neutron.openstack.common import timeutils
 from neutron.plugins.vyatta import exceptions
 from neutron.plugins.vyatta import vrouter_db_v2
 from oslo.config import cfg
@@ -16,10 +21,62 @@ LOG = logging.getLogger(__name__)
 
 class ApiProxyClient(object):
     """APIProxyClient class to construct REST API client requests."""
+
+    # Connection pools and HMAC keys are shared by all clients of a process
+    _pools = {}
+    _hmacs = {}
+    _no_bulk = set()
+
     def __init__(self, server):
         self.server = server
         self.port = cfg.CONF.VROUTER.api_port
 
+    @classmethod
+    def close(cls, server):
+        """Close kept-alive connections to a vRouter which is gone."""
+        cls._no_bulk.discard(server)
+        for key in cls._pools.keys():
+            if key[0] == server:
+                pool = cls._pools.pop(key)
+                while pool.free_items:
+                    pool.get().close()
+
+    @property
+    def pool(self):
+        key = (self.server, self.port)
+        pool = self._pools.get(key)
+        if pool is None:
+            server, port = key
+            pool = pools.Pool(
+                max_size=cfg.CONF.VROUTER.api_pool_size,
+                order_as_stack=True,
+                create=lambda: httplib.HTTPConnection(
+                    server, port, timeout=cfg.CONF.VROUTER.api_timeout))
+            self._pools[key] = pool
+        return pool
+
+    @property
+    def supports_bulk(self):
+        return self.server not in self._no_bulk
+
+    def _sign(self, content):
+        private_key = cfg.CONF.VROUTER.api_private_key
+        base = self._hmacs.get(private_key)
+        if base is None:
+            base = hmac.new(private_key, digestmod=hashlib.sha1)
+            self._hmacs[private_key] = base
+        digest = base.copy()
+        digest.update(content)
+        return digest.hexdigest()
+
+    def _request(self, conn, action, uri, content, headers):
+        if content is None:
+            conn.request(action, uri, headers=headers)
+        else:
+            conn.request(action, uri, content, headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+
     def rest_call(self, action, uri, data):
         headers = {}
 
@@ -27,73 +84,152 @@ class ApiProxyClient(object):
             headers['Content-type'] = 'application/json'
             headers['Accept'] = 'application/json'
 
-        private_key = cfg.CONF.VROUTER.api_private_key
         public_key = cfg.CONF.VROUTER.api_public_key
         content = json.dumps(data)
-        hmac_digest = hmac.new(private_key, content, hashlib.sha1).hexdigest()
 
         headers['PublicKey'] = public_key
-        headers['Hash'] = hmac_digest
-
-        conn = httplib.HTTPConnection(self.server, self.port)
-        if conn is None:
-            LOG.error('ProxyClient: Could not establish HTTP connection.')
-            raise exceptions.VRouterConnectFailure(ip_address=self.server)
-
-        try:
-            if (data is None):
-                conn.request(action, uri, headers=headers)
-            else:
-                conn.request(action, uri, content, headers)
-
-            response = conn.getresponse()
-            response_data = json.loads(response.read())
-            if response.status != 201:
-                action_name = {
-                    'GET': 'get',
-                    'POST': 'create',
-                    'PUT': 'update',
-                    'DELETE': 'delete',
-                }.get(action, 'do something with')
-                raise exceptions.VRouterOperationError(
-                    ip_address=self.server, action=action_name,
-                    code=response.status, message=response_data)
-
-            return_value = (response.status, response_data)
-        except (socket.timeout, socket.error, ValueError) as exc:
-            LOG.error(_('ProxyClient: Exception occurred while reading '
-                        'the response: %s') % exc)
-            raise exceptions.VRouterConnectFailure(ip_address=self.server)
-        finally:
-            conn.close()
-
-        return return_value
+        headers['Hash'] = self._sign(content)
+
+        if data is None:
+            content = None
+
+        with self.pool.item() as conn:
+            try:
+                try:
+                    status, body = self._request(conn, action, uri, content,
+                                                 headers)
+                except (httplib.BadStatusLine, socket.error) as exc:
+                    # A kept-alive connection may have been closed by the
+                    # vRouter, repeat the request on a new one. Only a GET
+                    # is safe to repeat: the vRouter may have carried out
+                    # any other request before the connection broke.
+                    if isinstance(exc, socket.timeout) or action != 'GET':
+                        raise
+                    conn.close()
+                    status, body = self._request(conn, action, uri, content,
+                                                 headers)
+                response_data = json.loads(body)
+            except (httplib.HTTPException, socket.error, ValueError) as exc:
+                conn.close()
+                LOG.error(_('ProxyClient: Exception occurred while reading '
+                            'the response: %s') % exc)
+                raise exceptions.VRouterConnectFailure(ip_address=self.server)
+
+        if status != 201:
+            action_name = {
+                'GET': 'get',
+                'POST': 'create',
+                'PUT': 'update',
+                'DELETE': 'delete',
+            }.get(action, 'do something with')
+            raise exceptions.VRouterOperationError(
+                ip_address=self.server, action=action_name,
+                code=status, message=response_data)
+
+        return status, response_data
+
+
+_nova_clients = {}
 
 
 def create_nova_client(context, tenant=None):
+    """Return a nova client, reusing the one (and its token) per tenant."""
     if tenant is None:
         tenant_id = context.project_id
     else:
         tenant_id = None
-    return client.Client(
-        cfg.CONF.VROUTER.tenant_admin_name,
-        cfg.CONF.VROUTER.tenant_admin_password,
-        tenant, cfg.CONF.VROUTER.keystone_url, service_type="compute",
-        tenant_id=tenant_id)
+    key = (tenant, tenant_id)
+    nova_client = _nova_clients.get(key)
+    if nova_client is None:
+        nova_client = client.Client(
+            cfg.CONF.VROUTER.tenant_admin_name,
+            cfg.CONF.VROUTER.tenant_admin_password,
+            tenant, cfg.CONF.VROUTER.keystone_url, service_type="compute",
+            tenant_id=tenant_id)
+        _nova_clients[key] = nova_client
+    return nova_client
+
+
+class InstanceIndex(object):
+    """Index of the vRouter instances of the service tenant.
+
+    Maps instance id to management address and keeps the ids of the
+    instances which are not allocated to a router. After the first full
+    listing only servers changed since the previous refresh are fetched
+    from nova, the allocations are only read from the database on a full
+    listing, and the interfaces of an instance are only listed until its
+    address is known.
+    """
+
+    def __init__(self):
+        self._instances = collections.OrderedDict()
+        # Ordered set of the free instance ids
+        self._free = collections.OrderedDict()
+        self._last_refresh = None
+        self._last_full_refresh = None
+
+    def refresh(self, nova_client, session):
+        now = timeutils.utcnow()
+        if (self._last_refresh is None or timeutils.is_older_than(
+                self._last_full_refresh,
+                cfg.CONF.VROUTER.instance_resync_interval)):
+            servers = nova_client.servers.list()
+            self._instances = collections.OrderedDict(
+                (server.id, self._instances.get(server.id))
+                for server in servers)
+            allocated = vrouter_db_v2.get_allocated_instances(session)
+            self._free = collections.OrderedDict(
+                (instance_id, None) for instance_id in self._instances
+                if instance_id not in allocated)
+            self._last_full_refresh = now
+        else:
+            changes_since = timeutils.isotime(self._last_refresh)
+            servers = nova_client.servers.list(
+                search_opts={'changes-since': changes_since})
+            for server in servers:
+                if server.status == 'DELETED':
+                    self._instances.pop(server.id, None)
+                    self._free.pop(server.id, None)
+                elif server.id not in self._instances:
+                    self._instances[server.id] = None
+                    self._free[server.id] = None
+        self._last_refresh = now
+
+    def allocate(self, nova_client):
+        """Return the address and id of a free instance."""
+        for instance_id in self._free.keys():
+            del self._free[instance_id]
+            address = self._instances[instance_id]
+            if address is None:
+                ifs = nova_client.servers.interface_list(instance_id)
+                # Allocated instances have router ports attached. They
+                # stay out of the free set until the next full refresh.
+                if len(ifs) != 1:
+                    continue
+                address = ifs[0].fixed_ips[0]['ip_address']
+                self._instances[instance_id] = address
+            return address, instance_id
+        return None, None
+
+    def release(self, instance_id):
+        if instance_id in self._instances:
+            self._free[instance_id] = None
+
+
+_instance_index = InstanceIndex()
+_instance_lock = semaphore.Semaphore()
 
 
 def allocate_instance(context, router):
     nova_client = create_nova_client(context, cfg.CONF.VROUTER.tenant_name)
-    instances = nova_client.servers.findall()
-    for instance in instances:
-        if vrouter_db_v2.is_allocated(context.session, instance.id):
-            continue
-        ifs = instance.interface_list()
-        if len(ifs) != 1:
-            continue
-        ip_address = ifs[0].fixed_ips[0]['ip_address']
-        return ip_address, instance.id
-    return None, None
+    with _instance_lock:
+        _instance_index.refresh(nova_client, context.session)
+        return _instance_index.allocate(nova_client)
+
+
+def release_instance(instance_id):
+    with _instance_lock:
+        _instance_index.release(instance_id)
 
 
 def initialize_router(context, address, router):
@@ -109,7 +245,10 @@ def initialize_router(context, address, router):
 
 def deinitialize_router(context, address):
     vrouter_client = ApiProxyClient(address)
-    vrouter_client.rest_call('DELETE', '/v2.0/router', None)
+    try:
+        vrouter_client.rest_call('DELETE', '/v2.0/router', None)
+    finally:
+        ApiProxyClient.close(address)
 
 
 def attach_interface(context, port_id, instance_id):
@@ -124,20 +263,32 @@ def detach_interface(context, port_id, instance_id):
     server.interface_detach(port_id)
 
 
-def configure_interface(context, address, interface_infos):
+def _update_interfaces(address, interface_infos, action):
     vrouter_client = ApiProxyClient(address)
+    if len(interface_infos) > 1 and vrouter_client.supports_bulk:
+        data = {'router': {'router_interface_infos': interface_infos}}
+        try:
+            vrouter_client.rest_call(
+                'PUT', '/v2.0/router/%ss' % action, data)
+            return
+        except exceptions.VRouterOperationError as exc:
+            if exc.code != httplib.NOT_FOUND:
+                raise
+            LOG.warning(_('vRouter %s does not support bulk interface '
+                          'configuration'), address)
+            ApiProxyClient._no_bulk.add(address)
     for interface_info in interface_infos:
         data = {'router': {'router_interface_info': interface_info}}
         vrouter_client.rest_call(
-            'PUT', '/v2.0/router/add_router_interface', data)
+            'PUT', '/v2.0/router/%s' % action, data)
+
+
+def configure_interface(context, address, interface_infos):
+    _update_interfaces(address, interface_infos, 'add_router_interface')
 
 
 def deconfigure_interface(context, address, interface_infos):
-    vrouter_client = ApiProxyClient(address)
-    for interface_info in interface_infos:
-        data = {'router': {'router_interface_info': interface_info}}
-        vrouter_client.rest_call(
-            'PUT', '/v2.0/router/remove_router_interface', data)
+    _update_interfaces(address, interface_infos, 'remove_router_interface')
 
 
 def configure_gateway(context, address, interface_infos):
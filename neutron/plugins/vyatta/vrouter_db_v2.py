@@ -16,6 +16,6 @@ def get_router_instance(session, router_id):
         return None, None
 
 
-def is_allocated(session, instance_id):
-    return session.query(vrouter_models_v2.RouterAddress)\
-        .filter_by(instance_id=instance_id).count() != 0
+def get_allocated_instances(session):
+    query = session.query(vrouter_models_v2.RouterAddress.instance_id)
+    return set(instance_id for instance_id, in query)
@@ -42,19 +42,23 @@ class VyattaVRouterL3Mixin(l3.RouterPluginBase):
             gw_info = r[l3.EXTERNAL_GW_INFO]
             del r[l3.EXTERNAL_GW_INFO]
         tenant_id = self._get_tenant_id_for_create(context, r)
-        with context.session.begin(subtransactions=True):
-            router_db = l3_db.Router(id=instance_id,
-                                     tenant_id=tenant_id,
-                                     name=r['name'],
-                                     admin_state_up=r['admin_state_up'],
-                                     status="ACTIVE")
-            context.session.add(router_db)
-
-            # Save association between router and instance
-            vrouter_db_v2.add_router_address_binding(
-                context.session, router_db, address, instance_id)
-            retval = self._make_router_dict(router_db)
-            control.initialize_router(context, address, retval)
+        try:
+            with context.session.begin(subtransactions=True):
+                router_db = l3_db.Router(id=instance_id,
+                                         tenant_id=tenant_id,
+                                         name=r['name'],
+                                         admin_state_up=r['admin_state_up'],
+                                         status="ACTIVE")
+                context.session.add(router_db)
+
+                # Save association between router and instance
+                vrouter_db_v2.add_router_address_binding(
+                    context.session, router_db, address, instance_id)
+                retval = self._make_router_dict(router_db)
+                control.initialize_router(context, address, retval)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                control.release_instance(instance_id)
 
         if has_gw_info:
             self._update_router_gw_info(context, router_db['id'], gw_info)
@@ -119,6 +123,7 @@ class VyattaVRouterL3Mixin(l3.RouterPluginBase):
             except Exception as ex:
                 LOG.error(_('Failed to deinitialize router: %s') % ex)
             context.session.delete(router)
+        control.release_instance(instance_id)
 
     def get_routers(self, context, filters=None, fields=None,
                     sorts=None, limit=None, marker=None, page_reverse=False):
@@ -25,6 +25,7 @@ from oslo.config import cfg
 from neutron.common import config
 from neutron.common import legacy
 from neutron import context
+from neutron import manager
 from neutron.openstack.common import importutils
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import loopingcall
@@ -41,6 +42,10 @@ service_opts = [
                help=_('range of seconds to randomly delay when starting the'
                       ' periodic task scheduler to reduce stampeding.'
                       ' (Disable by setting to 0)')),
+    cfg.IntOpt('api_workers',
+               default=0,
+               help=_('Number of separate API worker processes. When 0, '
+                      'the API is served by the main process')),
 ]
 CONF = cfg.CONF
 CONF.register_opts(service_opts)
@@ -87,6 +92,14 @@ class NeutronApiService(WsgiService):
         service = cls(app_name)
         return service
 
+    def start(self):
+        super(NeutronApiService, self).start()
+        if cfg.CONF.ip_recycle_interval > 0:
+            recycler = loopingcall.FixedIntervalLoopingCall(
+                _recycle_expired_ips)
+            recycler.start(interval=cfg.CONF.ip_recycle_interval,
+                           initial_delay=cfg.CONF.ip_recycle_interval)
+
 
 def serve_wsgi(cls):
 
@@ -105,13 +118,27 @@ def serve_wsgi(cls):
     return service
 
 
+def _recycle_expired_ips():
+    plugin = manager.NeutronManager.get_plugin()
+    if not hasattr(plugin, 'recycle_expired_ip_allocations'):
+        return
+    try:
+        count = plugin.recycle_expired_ip_allocations(
+            context.get_admin_context())
+        if count:
+            LOG.debug(_("Recycled %d expired IP allocations"), count)
+    except Exception:
+        LOG.exception(_("Failed to recycle expired IP allocations"))
+
+
 def _run_wsgi(app_name):
     app = config.load_paste_app(app_name)
     if not app:
         LOG.error(_('No known API applications configured.'))
         return
     server = wsgi.Server("Neutron")
-    server.start(app, cfg.CONF.bind_port, cfg.CONF.bind_host)
+    server.start(app, cfg.CONF.bind_port, cfg.CONF.bind_host,
+                 workers=cfg.CONF.api_workers)
     # Dump all option values here after all options are parsed
     cfg.CONF.log_opt_values(LOG, std_logging.DEBUG)
     LOG.info(_("Neutron service started, listening on %(host)s:%(port)s"),
@@ -0,0 +1,142 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Throughput of GET /v2.0/ports with a given number of API workers.
+
+neutron-server is started with the plain db plugin, no authentication and
+a sqlite database holding PORTS ports, first without workers and then
+with WORKERS api_workers. Each time CLIENTS processes list the ports for
+DURATION seconds.
+
+Usage: python -m neutron.tests.benchmarks.api_workers
+           [WORKERS [PORTS [CLIENTS [DURATION]]]]
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib2
+
+PORT = 19696
+URL = 'http://127.0.0.1:%d/v2.0/' % PORT
+HEADERS = {'Content-Type': 'application/json'}
+ETC_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'etc')
+
+CONFIG = """[DEFAULT]
+core_plugin = neutron.db.db_base_plugin_v2.NeutronDbPluginV2
+auth_strategy = noauth
+bind_host = 127.0.0.1
+bind_port = %(port)d
+api_paste_config = %(paste)s
+rpc_backend = neutron.openstack.common.rpc.impl_fake
+api_workers = %(workers)d
+log_file = %(log)s
+
+[database]
+connection = sqlite:///%(db)s
+
+[quotas]
+quota_port = -1
+"""
+
+
+def _request(path, body=None):
+    data = body and json.dumps(body)
+    request = urllib2.Request(URL + path, data, HEADERS)
+    return json.loads(urllib2.urlopen(request).read())
+
+
+def _start_server(tmp_dir, workers):
+    config_file = os.path.join(tmp_dir, 'neutron-%d.conf' % workers)
+    with open(config_file, 'w') as f:
+        f.write(CONFIG % {'port': PORT, 'workers': workers,
+                          'paste': os.path.abspath(
+                              os.path.join(ETC_DIR, 'api-paste.ini')),
+                          'db': os.path.join(tmp_dir, 'neutron.db'),
+                          'log': os.path.join(tmp_dir, 'server.log')})
+    server = subprocess.Popen([sys.executable, '-c',
+                               'from neutron.server import main; main()',
+                               '--config-file', config_file])
+    for i in xrange(300):
+        try:
+            _request('ports.json?fields=id')
+            return server
+        except Exception:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('neutron-server did not start')
+
+
+def _stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    server.wait()
+
+
+def _populate(ports):
+    network = _request('networks.json',
+                       {'network': {'name': 'bench', 'tenant_id': 'tenant'}})
+    network_id = network['network']['id']
+    _request('subnets.json', {'subnet': {'network_id': network_id,
+                                         'tenant_id': 'tenant',
+                                         'ip_version': 4,
+                                         'cidr': '10.0.0.0/16'}})
+    for start in xrange(0, ports, 100):
+        _request('ports.json', {'ports': [
+            {'network_id': network_id, 'tenant_id': 'tenant',
+             'name': 'port%d' % i}
+            for i in xrange(start, min(ports, start + 100))]})
+
+
+def _client(duration):
+    count = 0
+    end = time.time() + duration
+    while time.time() < end:
+        _request('ports.json')
+        count += 1
+    return count
+
+
+def main(argv):
+    workers, ports, clients, duration = ([int(arg) for arg in argv[1:5]] +
+                                         [4, 200, 8, 10][len(argv) - 1:])
+    print '%d ports, %d clients, %d cpus' % (
+        ports, clients, multiprocessing.cpu_count())
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for index, api_workers in enumerate((0, workers)):
+            server = _start_server(tmp_dir, api_workers)
+            try:
+                if not index:
+                    _populate(ports)
+                pool = multiprocessing.Pool(clients)
+                requests = sum(pool.map(_client, [duration] * clients))
+                pool.close()
+            finally:
+                _stop_server(server)
+            print '  api_workers = %2d: %7.1f requests/s, %6.1f ms each' % (
+                api_workers, float(requests) / duration,
+                1000.0 * duration * clients / requests)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,117 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Cost of the dnsmasq reloads of a boot storm on one network.
+
+BOOTS ports are created on a network which already has PORTS ports, as
+the DHCP agent handles port.create.end: the port is put in the network
+cache and the allocations of the network are reloaded, either at once or
+once per BATCH ports as a reload_allocations_window collecting BATCH
+notifications would. The uncached run renders the lines of every port on
+each reload. The host files are written to a temporary directory;
+kill and cat are not run, a fake executor sleeps LATENCY milliseconds per
+command.
+
+Usage: python -m neutron.tests.benchmarks.dhcp_allocations
+           [PORTS [BOOTS [BATCH [LATENCY]]]]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from oslo.config import cfg
+
+from neutron.agent import dhcp_agent
+from neutron.agent.linux import dhcp
+from neutron.agent.linux import utils
+
+
+class _FakeExecutor(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, cmd, root_helper=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        # the dnsmasq pid looks alive
+        return cmd[0] == 'cat' and 'dnsmasq --conf-file=net' or ''
+
+
+def _port(index):
+    return dhcp_agent.DictModel({
+        'id': 'port%d' % index, 'network_id': 'net',
+        'mac_address': 'fa:16:3e:%02x:%02x:%02x' % (
+            index >> 16, (index >> 8) & 0xff, index & 0xff),
+        'fixed_ips': [{'subnet_id': 'subnet',
+                       'ip_address': '10.%d.%d.%d' % (
+                           index >> 16, (index >> 8) & 0xff,
+                           index & 0xff)}]})
+
+
+def _boot(conf, ports, boots, batch, cached):
+    cache = dhcp_agent.NetworkCache()
+    network = dhcp_agent.DictModel({
+        'id': 'net', 'admin_state_up': True, 'ports': [],
+        'subnets': [{'id': 'subnet', 'cidr': '10.0.0.0/8', 'ip_version': 4,
+                     'enable_dhcp': True, 'gateway_ip': '10.0.0.1',
+                     'dns_nameservers': [], 'host_routes': []}]})
+    network.ports = [_port(i) for i in xrange(ports)]
+    cache.put(network)
+    for i in xrange(ports, ports + boots):
+        cache.put_port(_port(i))
+        if not (i - ports + 1) % batch or i == ports + boots - 1:
+            if not cached:
+                dhcp.Dnsmasq._hosts_lines.clear()
+            dhcp.Dnsmasq(conf, network, version=2.59).reload_allocations()
+
+
+def main(argv):
+    ports, boots, batch, latency = ([int(arg) for arg in argv[1:5]] +
+                                    [5000, 200, 50, 10][len(argv) - 1:])
+    print '%d ports, %d boots, %d ms per command' % (ports, boots, latency)
+    conf = cfg.ConfigOpts()
+    conf.register_opts(dhcp.OPTS)
+    conf.register_opt(cfg.BoolOpt('enable_isolated_metadata',
+                                  default=False))
+    tmp_dir = tempfile.mkdtemp()
+    conf.set_override('dhcp_confs', tmp_dir)
+    os.mkdir(os.path.join(tmp_dir, 'net'))
+    with open(os.path.join(tmp_dir, 'net', 'pid'), 'w') as f:
+        f.write('1')
+    execute = _FakeExecutor(latency / 1000.0)
+    real_execute, utils.execute = utils.execute, execute
+    try:
+        for name, size, cached in (('uncached', 1, False),
+                                   ('immediate', 1, True),
+                                   ('batched', batch, True)):
+            dhcp.Dnsmasq._hosts_lines.clear()
+            execute.calls = 0
+            start = time.time()
+            _boot(conf, ports, boots, size, cached)
+            elapsed = time.time() - start
+            print '  %-9s %5d reloads, %5d commands: %9.1f ms' % (
+                name, -(-boots // size), execute.calls, elapsed * 1000)
+    finally:
+        utils.execute = real_execute
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,94 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Time the server spends storing the lease updates of one network.
+
+A sqlite database holds a network with PORTS ports, whose leases are all
+renewed, once with an update_fixed_ip_lease_expiration per lease as the
+update_lease_expiration RPC does and once with one
+update_fixed_ip_lease_expirations as update_lease_expirations does.
+
+Usage: python -m neutron.tests.benchmarks.dhcp_leases [PORTS]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from oslo.config import cfg
+
+from neutron.api.v2 import attributes
+from neutron import context
+from neutron.db import api as db
+from neutron.db import db_base_plugin_v2
+
+
+def _populate(plugin, admin_context, ports):
+    network = plugin.create_network(admin_context, {'network': {
+        'name': 'bench', 'tenant_id': 'tenant', 'admin_state_up': True,
+        'shared': False}})
+    plugin.create_subnet(admin_context, {'subnet': {
+        'network_id': network['id'], 'tenant_id': 'tenant', 'name': '',
+        'ip_version': 4, 'cidr': '10.0.0.0/16', 'enable_dhcp': True,
+        'gateway_ip': attributes.ATTR_NOT_SPECIFIED,
+        'allocation_pools': attributes.ATTR_NOT_SPECIFIED,
+        'dns_nameservers': attributes.ATTR_NOT_SPECIFIED,
+        'host_routes': attributes.ATTR_NOT_SPECIFIED}})
+    ip_addresses = []
+    for i in xrange(ports):
+        port = plugin.create_port(admin_context, {'port': {
+            'network_id': network['id'], 'tenant_id': 'tenant',
+            'name': 'port%d' % i, 'admin_state_up': True,
+            'device_id': '', 'device_owner': '',
+            'mac_address': attributes.ATTR_NOT_SPECIFIED,
+            'fixed_ips': attributes.ATTR_NOT_SPECIFIED}})
+        ip_addresses.append(port['fixed_ips'][0]['ip_address'])
+    return network['id'], ip_addresses
+
+
+def main(argv):
+    ports = ([int(arg) for arg in argv[1:2]] + [1000][len(argv) - 1:])[0]
+    print '%d ports' % ports
+    tmp_dir = tempfile.mkdtemp()
+    cfg.CONF.set_override('connection', 'sqlite:///%s' % os.path.join(
+        tmp_dir, 'neutron.db'), 'database')
+    try:
+        db.configure_db()
+        plugin = db_base_plugin_v2.NeutronDbPluginV2()
+        admin_context = context.get_admin_context()
+        network_id, ip_addresses = _populate(plugin, admin_context, ports)
+
+        start = time.time()
+        for ip_address in ip_addresses:
+            plugin.update_fixed_ip_lease_expiration(
+                context.get_admin_context(), network_id, ip_address, 120)
+        elapsed = time.time() - start
+        print '  per lease: %9.1f ms' % (elapsed * 1000)
+
+        start = time.time()
+        plugin.update_fixed_ip_lease_expirations(
+            context.get_admin_context(), network_id,
+            dict((ip_address, 120) for ip_address in ip_addresses))
+        elapsed = time.time() - start
+        print '  bulk:      %9.1f ms' % (elapsed * 1000)
+    finally:
+        db.clear_db()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
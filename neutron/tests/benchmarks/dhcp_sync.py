@@ -0,0 +1,106 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Time the server spends grouping the networks a DHCP agent syncs.
+
+The plugin is a fake one returning NETWORKS networks with one subnet and
+PORTS ports each, so only the grouping of the subnets and ports by network
+is measured, for the whole sync in one get_active_networks_info call and
+for pages of 100 networks of get_networks_info, with and without the DHCP
+agent scheduler extension.
+
+Usage: python -m neutron.tests.benchmarks.dhcp_sync [NETWORKS [PORTS]]
+"""
+import sys
+import time
+
+import mock
+
+from neutron.common import constants
+from neutron.db import dhcp_rpc_base
+
+PAGE_SIZE = 100
+
+
+class _FakePlugin(object):
+
+    def __init__(self, networks, ports, scheduler=False):
+        if scheduler:
+            self.supported_extension_aliases = [
+                constants.DHCP_AGENT_SCHEDULER_EXT_ALIAS]
+        self.networks = ['net%d' % i for i in xrange(networks)]
+        self.subnets = [{'id': 'subnet-%s' % network_id,
+                         'network_id': network_id}
+                        for network_id in self.networks]
+        self.ports = [{'id': 'port%d-%s' % (i, network_id),
+                       'network_id': network_id}
+                      for network_id in self.networks for i in xrange(ports)]
+
+    def get_networks(self, context, filters=None):
+        network_ids = filters.get('id', self.networks)
+        return [{'id': network_id} for network_id in network_ids]
+
+    def list_active_networks_on_active_dhcp_agent(self, context, host,
+                                                  network_ids=None):
+        # all the networks are scheduled to the agent
+        if network_ids is None:
+            network_ids = self.networks
+        return self.get_networks(context, filters={'id': network_ids})
+
+    def get_ports(self, context, filters=None):
+        network_ids = set(filters['network_id'])
+        return [port for port in self.ports
+                if port['network_id'] in network_ids]
+
+    def get_subnets(self, context, filters=None):
+        network_ids = set(filters['network_id'])
+        return [subnet for subnet in self.subnets
+                if subnet['network_id'] in network_ids]
+
+
+def _run(plugin, networks):
+    callbacks = dhcp_rpc_base.DhcpRpcCallbackMixin()
+    with mock.patch('neutron.manager.NeutronManager.get_plugin',
+                    return_value=plugin):
+        with mock.patch.object(callbacks, '_get_active_networks',
+                               side_effect=lambda context, **kwargs:
+                               plugin.get_networks(context, filters={})):
+            start = time.time()
+            callbacks.get_active_networks_info(None, host='host')
+            elapsed = time.time() - start
+            print '  get_active_networks_info: %9.1f ms' % (elapsed * 1000)
+
+        start = time.time()
+        for i in xrange(0, networks, PAGE_SIZE):
+            callbacks.get_networks_info(
+                None, network_ids=plugin.networks[i:i + PAGE_SIZE],
+                host='host')
+        elapsed = time.time() - start
+        print '  get_networks_info:        %9.1f ms in %d pages' % (
+            elapsed * 1000, -(-networks // PAGE_SIZE))
+
+
+def main(argv):
+    networks, ports = ([int(arg) for arg in argv[1:3]] +
+                       [2000, 10][len(argv) - 1:])
+    print '%d networks, %d ports per network' % (networks, ports)
+    _run(_FakePlugin(networks, ports), networks)
+    print 'with the DHCP agent scheduler'
+    _run(_FakePlugin(networks, ports, scheduler=True), networks)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,95 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Allocate and recycle times of the IPAM drivers on a fragmented pool.
+
+Every other address of the pool is in use, so the pool has one free
+range per two addresses.
+
+Usage: python -m neutron.tests.benchmarks.ipam [ADDRESSES]
+"""
+import sys
+import time
+
+import netaddr
+
+from neutron import context
+from neutron.db import api as db_api
+from neutron.db import ipam
+from neutron.db import models_v2
+
+REPEAT = 200
+DRIVERS = (ipam.RangeTableIpamDriver, ipam.IntervalIpamDriver)
+
+
+def _populate(session, count):
+    cidr = netaddr.IPNetwork('10.0.0.0/%d' % (32 - len(bin(count + 1)) + 2))
+    first = int(cidr.network) + 2
+    with session.begin():
+        session.add(models_v2.Network(id='net', name='net',
+                                      admin_state_up=True, status='ACTIVE',
+                                      shared=False))
+        session.add(models_v2.Subnet(id='subnet', network_id='net',
+                                     ip_version=4, cidr=str(cidr),
+                                     gateway_ip=str(cidr.network + 1),
+                                     enable_dhcp=True, shared=False))
+        session.add(models_v2.IPAllocationPool(
+            id='pool', subnet_id='subnet',
+            first_ip=str(netaddr.IPAddress(first)),
+            last_ip=str(netaddr.IPAddress(first + count - 1))))
+    session.execute(models_v2.IPAvailabilityRange.__table__.insert(), [
+        {'allocation_pool_id': 'pool',
+         'first_ip': str(netaddr.IPAddress(ip)),
+         'last_ip': str(netaddr.IPAddress(ip))}
+        for ip in xrange(first, first + count, 2)])
+    return [{'id': 'subnet', 'cidr': str(cidr), 'network_id': 'net'}]
+
+
+def _measure(ctx, func):
+    start = time.time()
+    for i in xrange(REPEAT):
+        with ctx.session.begin():
+            func(i)
+    return (time.time() - start) / REPEAT * 1000
+
+
+def _report(ctx, driver, subnets):
+    allocated = []
+
+    def allocate(i):
+        allocated.append(driver.generate_ip(ctx, subnets)['ip_address'])
+
+    def recycle(i):
+        driver.recycle_ip(ctx, 'subnet', allocated[i])
+
+    print '  allocate: %8.3f ms' % _measure(ctx, allocate)
+    print '  recycle:  %8.3f ms' % _measure(ctx, recycle)
+
+
+def main(argv):
+    count = len(argv) > 1 and int(argv[1]) or 60000
+    print 'pool of %d addresses, %d operations each' % (count, REPEAT)
+    for driver_class in DRIVERS:
+        db_api.configure_db()
+        ctx = context.get_admin_context()
+        subnets = _populate(ctx.session, count)
+        print '%s:' % driver_class.__name__
+        _report(ctx, driver_class(), subnets)
+        db_api.clear_db()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,77 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Time of IptablesManager._modify_rules on synthetic filter tables.
+
+The table holds a pair of chains per port with RULES_PER_CHAIN rules
+each. The iptables-save output the rules are merged into already holds
+them all with counters, as it does on every apply but the first one.
+
+Usage: python -m neutron.tests.benchmarks.iptables_manager [RULES ...]
+"""
+import sys
+import time
+
+from neutron.agent.linux import iptables_manager
+
+RULES_PER_CHAIN = 25
+DEFAULT_SIZES = (6250, 12500, 25000, 50000)
+
+
+def _build_table(count):
+    table = iptables_manager.IptablesTable()
+    table.add_chain('sg-chain')
+    table.add_chain('FORWARD')
+    table.add_rule('FORWARD', '-j $sg-chain')
+    for port in xrange(count / RULES_PER_CHAIN / 2):
+        for direction in ('i', 'o'):
+            chain = '%s%d' % (direction, port)
+            table.add_chain(chain)
+            table.add_rule('sg-chain', '-m physdev --physdev-out tap%d '
+                           '-j $%s' % (port, chain))
+            for rule in xrange(RULES_PER_CHAIN - 1):
+                table.add_rule(chain, '-s 10.%d.%d.%d/32 -j RETURN' %
+                               (port / 256, port % 256, rule))
+    return table
+
+
+def _save_output(table):
+    lines = ['# Generated by iptables-save', '*filter',
+             ':INPUT ACCEPT [0:0]', ':FORWARD ACCEPT [0:0]',
+             ':OUTPUT ACCEPT [0:0]']
+    lines += [':%s-%s - [0:0]' % (iptables_manager.binary_name, chain)
+              for chain in table.chains]
+    lines += ['[1:100] %s' % rule for rule in table.rules]
+    lines += ['COMMIT', '# Completed on Thu Jan  1 00:00:00 1970']
+    return lines
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or DEFAULT_SIZES
+    manager = iptables_manager.IptablesManager(state_less=True)
+    for count in sizes:
+        table = _build_table(count)
+        current_lines = _save_output(table)
+        start = time.time()
+        manager._modify_rules(current_lines, table, 'filter')
+        elapsed = time.time() - start
+        print '%6d rules: %8.1f ms, %5.2f us per rule' % (
+            len(table.rules), elapsed * 1000,
+            elapsed * 1000000 / len(table.rules))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,85 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Lookup times of niblick bindings in a large table.
+
+Usage: python -m neutron.tests.benchmarks.niblick_bindings [BINDINGS]
+"""
+import sys
+import time
+
+from neutron import context
+from neutron.db import api as db_api
+from neutron.openstack.common import timeutils
+from neutron.plugins.niblick.db import api
+from neutron.plugins.niblick.db import models
+
+RESOURCE_TYPES = 10
+DESCRIPTORS = 20
+REPEAT = 200
+
+
+def _populate(session, count):
+    now = timeutils.utcnow()
+    rows = []
+    for i in xrange(count):
+        # Every other binding is soft-deleted, as left behind by
+        # deleted routers.
+        deleted = i % 2 and i or 0
+        rows.append({'id': i + 1,
+                     'created_at': now,
+                     'deleted': deleted,
+                     'deleted_at': deleted and now or None,
+                     'object_id': 'object-%d' % i,
+                     'resource_type': 'type-%d' % (i % RESOURCE_TYPES),
+                     'resource_id': 'resource-%d' % i,
+                     'resource_metadata': {},
+                     'resource_descriptor': 'desc-%d' % (i % DESCRIPTORS)})
+    session.execute(models.NiblickBinding.__table__.insert(), rows)
+
+
+def _measure(func):
+    start = time.time()
+    for i in xrange(REPEAT):
+        func(i)
+    return (time.time() - start) / REPEAT * 1000
+
+
+def _report(ctx, count):
+    get = _measure(lambda i: api.binding_get(
+        ctx, 'object-%d' % (i * 2 % count)))
+    descriptors = _measure(lambda i: api.binding_get_descriptors(
+        ctx, 'type-%d' % (i % RESOURCE_TYPES)))
+    print '  binding_get:             %8.3f ms' % get
+    print '  binding_get_descriptors: %8.3f ms' % descriptors
+
+
+def main(argv):
+    count = len(argv) > 1 and int(argv[1]) or 100000
+    db_api.configure_db()
+    ctx = context.get_admin_context()
+    _populate(ctx.session, count)
+    print 'niblick_bindings with %d rows, %d lookups each' % (count, REPEAT)
+    print 'with niblick_bindings_type_idx:'
+    _report(ctx, count)
+    ctx.session.execute('DROP INDEX niblick_bindings_type_idx')
+    print 'without niblick_bindings_type_idx:'
+    _report(ctx, count)
+    db_api.clear_db()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
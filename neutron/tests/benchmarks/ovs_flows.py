@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Flows per second OVSBridge programs with and without deferral.
+
+ovs-ofctl is not run: a fake executor sleeps LATENCY milliseconds per
+call, which is roughly what forking ovs-ofctl through rootwrap costs.
+The ports are bound the way the OVS agent binds ports on tunnel
+networks after a restart: the flows of each network are added to
+br-tun with those of its first port, and each port adds its inbound
+unicast flow to br-tun and deletes its in_port flows from br-int.
+
+Usage: python -m neutron.tests.benchmarks.ovs_flows [PORTS [LATENCY]]
+"""
+import sys
+import time
+
+from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import utils
+
+PORTS_PER_NETWORK = 10
+
+
+class _FakeExecutor(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, cmd, root_helper=None, process_input=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return ''
+
+
+def _bind_ports(int_br, tun_br, ports):
+    flows = 0
+    for port in xrange(ports):
+        vlan = port / PORTS_PER_NETWORK + 1
+        if not port % PORTS_PER_NETWORK:
+            # provision_local_vlan
+            tun_br.add_flow(priority=4, in_port=1, dl_vlan=vlan,
+                            actions='set_tunnel:%s,normal' % vlan)
+            tun_br.add_flow(priority=3, tun_id=vlan,
+                            dl_dst='01:00:00:00:00:00/01:00:00:00:00:00',
+                            actions='mod_vlan_vid:%s,output:1' % vlan)
+            flows += 2
+        # port_bound
+        tun_br.add_flow(priority=3, tun_id=vlan,
+                        dl_dst='fa:16:3e:%02x:%02x:%02x' %
+                        (port >> 16, (port >> 8) & 0xff, port & 0xff),
+                        actions='mod_vlan_vid:%s,normal' % vlan)
+        int_br.delete_flows(in_port=port + 2)
+        flows += 2
+    return flows
+
+
+def _report(name, execute, func):
+    execute.calls = 0
+    start = time.time()
+    flows = func()
+    elapsed = time.time() - start
+    print '  %-9s %6d flows, %5d ovs-ofctl calls: %8.1f ms, %8.0f flows/s' % (
+        name, flows, execute.calls, elapsed * 1000, flows / elapsed)
+
+
+def main(argv):
+    ports, latency = ([int(arg) for arg in argv[1:3]] +
+                      [100, 20][len(argv) - 1:])
+    print '%d ports, %d ms per ovs-ofctl call' % (ports, latency)
+    execute = _FakeExecutor(latency / 1000.0)
+    real_execute, utils.execute = utils.execute, execute
+    try:
+        int_br = ovs_lib.OVSBridge('br-int', 'sudo')
+        tun_br = ovs_lib.OVSBridge('br-tun', 'sudo')
+        _report('immediate', execute,
+                lambda: _bind_ports(int_br, tun_br, ports))
+
+        def deferred():
+            with int_br.defer_apply():
+                with tun_br.defer_apply():
+                    return _bind_ports(int_br, tun_br, ports)
+        _report('deferred', execute, deferred)
+    finally:
+        utils.execute = real_execute
+
+
+if __name__ == '__main__':
+    main(sys.argv)
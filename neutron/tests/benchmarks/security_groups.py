@@ -0,0 +1,153 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Time of the security group RPCs an agent calls for its ports.
+
+Every member port belongs to one security group. Besides the default
+egress rules each group allows ssh from anywhere, all traffic from its
+own members and http from the members of the next group, so the rules
+of a port expand into one rule per member of two groups.
+
+Usage: python -m neutron.tests.benchmarks.security_groups
+           [DEVICES [GROUPS [MEMBERS]]]
+"""
+import sys
+import time
+
+import netaddr
+
+from neutron.common import constants
+from neutron import context
+from neutron.db import api as db_api
+from neutron.db import models_v2
+from neutron.db import securitygroups_db as sg_db
+from neutron.db import securitygroups_rpc_base as sg_db_rpc
+from neutron.openstack.common import uuidutils
+
+REPEAT = 3
+
+
+class _SecurityGroupCallbacks(sg_db_rpc.SecurityGroupServerRpcCallbackMixin):
+
+    def __init__(self, ports):
+        self.ports = ports
+
+    def get_port_from_device(self, device):
+        port = self.ports.get(device)
+        if port:
+            port = dict(port, security_group_rules=[],
+                        security_group_source_groups=[])
+        return port
+
+
+def _rule(sg_id, direction, ethertype, **kwargs):
+    return sg_db.SecurityGroupRule(id=uuidutils.generate_uuid(),
+                                   tenant_id='tenant',
+                                   security_group_id=sg_id,
+                                   direction=direction, ethertype=ethertype,
+                                   **kwargs)
+
+
+def _populate(session, groups, members):
+    cidr = netaddr.IPNetwork('10.0.0.0/16')
+    sg_ids = ['sg%d' % i for i in xrange(groups)]
+    ports = {}
+    with session.begin():
+        session.add(models_v2.Network(id='net', name='net',
+                                      admin_state_up=True, status='ACTIVE',
+                                      shared=False))
+        session.add(models_v2.Subnet(id='subnet', network_id='net',
+                                     ip_version=4, cidr=str(cidr),
+                                     gateway_ip=str(cidr[1]),
+                                     enable_dhcp=True, shared=False))
+        for i, sg_id in enumerate(sg_ids):
+            session.add(sg_db.SecurityGroup(id=sg_id, tenant_id='tenant',
+                                            name=sg_id))
+            session.add(_rule(sg_id, 'egress', constants.IPv4))
+            session.add(_rule(sg_id, 'egress', constants.IPv6,
+                              protocol=None))
+            session.add(_rule(sg_id, 'ingress', constants.IPv4,
+                              protocol='tcp', port_range_min=22,
+                              port_range_max=22,
+                              remote_ip_prefix='0.0.0.0/0'))
+            session.add(_rule(sg_id, 'ingress', constants.IPv4,
+                              remote_group_id=sg_id, protocol=None,
+                              port_range_min=None, port_range_max=None,
+                              remote_ip_prefix=None))
+            session.add(_rule(sg_id, 'ingress', constants.IPv4,
+                              remote_group_id=sg_ids[(i + 1) % groups],
+                              protocol='tcp', port_range_min=80,
+                              port_range_max=80))
+        for i in xrange(members + 1):
+            port_id = 'port%d' % i
+            ip = str(cidr[i + 2])
+            owner = i and 'compute:nova' or constants.DEVICE_OWNER_DHCP
+            session.add(models_v2.Port(id=port_id, tenant_id='tenant',
+                                       network_id='net',
+                                       mac_address='fa:16:3e:00:00:00',
+                                       admin_state_up=True, status='ACTIVE',
+                                       device_id=port_id,
+                                       device_owner=owner))
+            session.add(models_v2.IPAllocation(port_id=port_id,
+                                               ip_address=ip,
+                                               subnet_id='subnet',
+                                               network_id='net'))
+            if i:
+                session.add(sg_db.SecurityGroupPortBinding(
+                    port_id=port_id, security_group_id=sg_ids[i % groups]))
+            ports[port_id] = {'id': port_id, 'network_id': 'net',
+                              'device_owner': owner, 'fixed_ips': [ip]}
+    return ports
+
+
+def _measure(func):
+    start = time.time()
+    for i in xrange(REPEAT):
+        result = func()
+    return (time.time() - start) / REPEAT * 1000, result
+
+
+def _report(ctx, callbacks, devices):
+    elapsed, ports = _measure(
+        lambda: callbacks.security_group_rules_for_devices(ctx,
+                                                           devices=devices))
+    rules = sum(len(port['security_group_rules']) for port in ports.values())
+    print '  security_group_rules_for_devices: %9.1f ms, %d rules' % (
+        elapsed, rules)
+    elapsed, info = _measure(
+        lambda: callbacks.security_group_info_for_devices(ctx,
+                                                          devices=devices))
+    rules = sum(len(port['security_group_rules'])
+                for port in info['devices'].values())
+    print '  security_group_info_for_devices:  %9.1f ms, %d rules' % (
+        elapsed, rules)
+
+
+def main(argv):
+    devices, groups, members = ([int(arg) for arg in argv[1:4]] +
+                                [1000, 50, 2000][len(argv) - 1:])
+    print '%d devices, %d security groups, %d members' % (devices, groups,
+                                                          members)
+    db_api.configure_db()
+    ctx = context.get_admin_context()
+    ports = _populate(ctx.session, groups, members)
+    _report(ctx, _SecurityGroupCallbacks(ports),
+            ['port%d' % i for i in xrange(1, devices + 1)])
+    db_api.clear_db()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
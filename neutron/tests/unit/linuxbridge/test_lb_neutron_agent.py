@@ -136,6 +136,32 @@ class TestLinuxBridgeAgent(base.BaseTestCase):
                 agent.daemon_loop()
             self.assertEqual(3, log.call_count)
 
+    def test_firewall_apply_failed(self):
+        lbmgr_instance = self.lbmgr_mock.return_value
+        lbmgr_instance.update_devices.return_value = {}
+        agent = linuxbridge_neutron_agent.LinuxBridgeNeutronAgentRPC({},
+                                                                     0,
+                                                                     None)
+        raise_exception = [0]
+
+        def info_mock(msg):
+            if raise_exception[0] < 2:
+                raise_exception[0] += 1
+            else:
+                raise RuntimeError()
+
+        with contextlib.nested(
+            mock.patch.object(linuxbridge_neutron_agent.LOG, 'info'),
+            mock.patch.object(agent, 'firewall_apply_failed')
+        ) as (log, firewall_apply_failed):
+            log.side_effect = info_mock
+            firewall_apply_failed.side_effect = [False, False, True]
+            with testtools.ExpectedException(RuntimeError):
+                agent.daemon_loop()
+            # The failed apply sends the agent out of sync again
+            self.assertEqual(3, log.call_count)
+            self.assertEqual(3, firewall_apply_failed.call_count)
+
 
 class TestLinuxBridgeManager(base.BaseTestCase):
     def setUp(self):
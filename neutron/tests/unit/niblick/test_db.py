@@ -14,9 +14,14 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import datetime
+
+import mock
+
 from neutron import context
 from neutron.db import api as db_api
 from neutron.openstack.common.db import exception as db_exc
+from neutron.openstack.common import timeutils
 from neutron.plugins.niblick.db import api
 from neutron.plugins.niblick import exceptions
 from neutron.tests import base
@@ -72,6 +77,13 @@ class BindingDBTestCase(base.BaseTestCase):
         obj = dict(api.binding_add(self.context, self.obj))
         self.assertEqual(self.obj['object_id'], obj['object_id'])
 
+    def test_get_by_resource(self):
+        obj = api.binding_get_by_resource(self.context, 'fake-resource-id')
+        self.assertEqual(self.obj['object_id'], obj['object_id'])
+        api.binding_delete(self.context, self.obj['object_id'])
+        self.assertIsNone(api.binding_get_by_resource(self.context,
+                                                      'fake-resource-id'))
+
     def test_get_all_descriptors(self):
         resource = {'object_id': 'fake-object-id-2',
                     'resource_type': 'fake-resource-type',
@@ -82,3 +94,22 @@ class BindingDBTestCase(base.BaseTestCase):
             self.context, 'fake-resource-type')
         descriptors = ['com.vyatta.vm', 'com.vyatta.vm.2']
         self.assertListEqual(descriptors, descriptors_in_db)
+
+    def test_get_descriptors_skips_deleted(self):
+        api.binding_delete(self.context, self.obj['object_id'])
+        descriptors = api.binding_get_descriptors(self.context,
+                                                  'fake-resource-type')
+        self.assertListEqual([], descriptors)
+
+    def test_purge_deleted(self):
+        api.binding_delete(self.context, self.obj['object_id'])
+        self.assertEqual(0, api.binding_purge_deleted(self.context, 60))
+        later = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            self.assertEqual(1, api.binding_purge_deleted(self.context, 60))
+
+    def test_purge_deleted_keeps_active(self):
+        later = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        with mock.patch.object(timeutils, 'utcnow', return_value=later):
+            self.assertEqual(0, api.binding_purge_deleted(self.context, 60))
+        api.binding_get(self.context, self.obj['object_id'])
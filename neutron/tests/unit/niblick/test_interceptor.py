@@ -22,6 +22,7 @@ from oslo.config import cfg
 from neutron import context
 from neutron.db import api as db_api
 from neutron.openstack.common import uuidutils
+from neutron.plugins.niblick.db import api as niblick_db_api
 from neutron.plugins.niblick import exceptions
 from neutron.plugins.niblick import interceptor_plugin
 from neutron.plugins.niblick import policy
@@ -40,7 +41,9 @@ class FakeL3Plugin(mock.Mock):
 
 class FakePolicyDriver(policy.SimplePolicyDriver):
     def __init__(self):
-        self._resources = {}
+        super(FakePolicyDriver, self).__init__()
+        self._loaded = True
+        ctx = context.get_admin_context()
         for descriptor in ('fake-l3-1', 'fake-l3-2'):
             uuid = uuidutils.generate_uuid()
             resource = {'resource_id': uuid,
@@ -48,7 +51,9 @@ class FakePolicyDriver(policy.SimplePolicyDriver):
                         'resource_metadata': {},
                         'allocated': False,
                         'resource_descriptor': descriptor}
+            niblick_db_api.resource_add(ctx, resource)
             self._resources[uuid] = resource
+            self._free['L3'].append(uuid)
 
 
 class FakePluginManager(dict):
@@ -87,6 +92,14 @@ class InterceptorTestCase(base.BaseTestCase):
         pd = self.interceptor._resource_manager._pm.policy_driver
         self.assertIsInstance(pd, FakePolicyDriver)
 
+    def test_init_purge_loop(self):
+        CONF.set_override('binding_purge_interval', 600, 'niblick')
+        with mock.patch('neutron.openstack.common.loopingcall.'
+                        'FixedIntervalLoopingCall') as loop:
+            interceptor = interceptor_plugin.Interceptor()
+            loop.assert_called_once_with(interceptor._purge_bindings)
+            loop.return_value.start.assert_called_once_with(interval=600)
+
     def test_init_plugin_manager(self):
         pm = self.interceptor._plugin_manager
         self.assertIsInstance(pm, FakePluginManager)
@@ -154,10 +167,79 @@ class InterceptorTestCase(base.BaseTestCase):
         count = self.interceptor.get_routers_count(self.context)
         self.assertEqual(2, count)
         self.assertEqual(2, self.l3.get_routers.call_count)
-        self.l3.get_routers.assert_called_with(self.context, None, None, None,
-                                               None, None, False)
+        self.l3.get_routers.assert_called_with(self.context, None, ['id'])
         self.assertEqual(0, self.l3.get_routers_count.call_count)
 
+    def _fake_backends(self, routers1, routers2):
+        l3_1 = FakeL3Plugin()
+        l3_1.get_routers.return_value = routers1
+        l3_2 = FakeL3Plugin()
+        l3_2.get_routers.return_value = routers2
+        self.interceptor._plugin_manager['fake-l3-1'] = l3_1
+        self.interceptor._plugin_manager['fake-l3-2'] = l3_2
+        m = mock.patch.object(self.interceptor._resource_manager,
+                              'get_descriptors',
+                              return_value=['fake-l3-1', 'fake-l3-2'])
+        m.start()
+        self.addCleanup(m.stop)
+        return l3_1, l3_2
+
+    def test_l3_get_routers_sorted(self):
+        self._fake_backends(
+            [{'id': '1', 'name': 'a'}, {'id': '3', 'name': 'c'}],
+            [{'id': '2', 'name': 'b'}, {'id': '4', 'name': 'd'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               sorts=[('name', True)])
+        self.assertEqual(['a', 'b', 'c', 'd'], [r['name'] for r in routers])
+
+    def test_l3_get_routers_sorted_desc(self):
+        self._fake_backends(
+            [{'id': '3', 'name': 'c'}, {'id': '1', 'name': 'a'}],
+            [{'id': '4', 'name': 'd'}, {'id': '2', 'name': 'b'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               sorts=[('name', False)])
+        self.assertEqual(['d', 'c', 'b', 'a'], [r['name'] for r in routers])
+
+    def test_l3_get_routers_limit(self):
+        l3_1, l3_2 = self._fake_backends(
+            [{'id': '1', 'name': 'a'}, {'id': '3', 'name': 'c'}],
+            [{'id': '2', 'name': 'b'}, {'id': '4', 'name': 'd'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               sorts=[('name', True)],
+                                               limit=2, marker='0')
+        self.assertEqual(['a', 'b'], [r['name'] for r in routers])
+        l3_1.get_routers.assert_called_once_with(
+            self.context, None, None, [('name', True)], 2, '0', False)
+
+    def test_l3_get_routers_limit_page_reverse(self):
+        self._fake_backends(
+            [{'id': '1', 'name': 'a'}, {'id': '3', 'name': 'c'}],
+            [{'id': '2', 'name': 'b'}, {'id': '4', 'name': 'd'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               sorts=[('name', True)],
+                                               limit=2, page_reverse=True)
+        self.assertEqual(['c', 'd'], [r['name'] for r in routers])
+
+    def test_l3_get_routers_duplicates(self):
+        self._fake_backends(
+            [{'id': '1', 'name': 'a'}, {'id': '2', 'name': 'b'}],
+            [{'id': '1', 'name': 'a'}, {'id': '3', 'name': 'c'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               sorts=[('name', True)])
+        self.assertEqual(['1', '2', '3'], [r['id'] for r in routers])
+
+    def test_l3_get_routers_fields(self):
+        l3_1, l3_2 = self._fake_backends(
+            [{'id': '1', 'name': 'a', 'status': 'ACTIVE'}],
+            [{'id': '2', 'name': 'b', 'status': 'ACTIVE'}])
+        routers = self.interceptor.get_routers(self.context,
+                                               fields=['status'],
+                                               sorts=[('name', True)])
+        self.assertEqual([{'status': 'ACTIVE'}] * 2, routers)
+        l3_1.get_routers.assert_called_once_with(
+            self.context, None, ['status', 'id', 'name'], [('name', True)],
+            None, None, False)
+
     def test_l3_get_router(self):
         router = self.interceptor.create_router(self.context, {'router': {}})
         self.l3.get_router.return_value = router
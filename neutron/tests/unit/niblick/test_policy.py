@@ -17,6 +17,10 @@
 import mock
 from oslo.config import cfg
 
+from neutron import context
+from neutron.db import api as db_api
+from neutron.openstack.common.db import exception as db_exc
+from neutron.plugins.niblick.db import api as db_api_niblick
 from neutron.plugins.niblick import exceptions
 from neutron.plugins.niblick import policy
 from neutron.tests import base
@@ -27,37 +31,129 @@ CONF = cfg.CONF
 class SimplePolicyDriverTestCase(base.BaseTestCase):
     def setUp(self):
         super(SimplePolicyDriverTestCase, self).setUp()
+        db_api.configure_db()
+        self.addCleanup(db_api.clear_db)
+        self.context = context.get_admin_context()
         CONF.set_override('instances',
                           {str(i): '127.0.0.{}'.format(i) for i in range(10)},
                           'niblick')
         self.policy = policy.SimplePolicyDriver()
 
     def test_acquire_resource(self):
-        res = self.policy.acquire_resource('fake-context', 'router')
+        res = self.policy.acquire_resource(self.context, 'router')
         self.assertTrue(res['allocated'])
 
     def test_acquire_resource_error_no_more_resource(self):
         self.assertRaises(exceptions.NoMoreResources,
                           self.policy.acquire_resource,
-                          context='fake-context',
+                          context=self.context,
                           resource_type='fake-resource-type')
 
+    def test_acquire_all_resources(self):
+        ids = set(self.policy.acquire_resource(self.context,
+                                               'router')['resource_id']
+                  for i in range(10))
+        self.assertEqual(10, len(ids))
+        self.assertRaises(exceptions.NoMoreResources,
+                          self.policy.acquire_resource,
+                          context=self.context,
+                          resource_type='router')
+
     def test_release_resource(self):
-        res = self.policy.acquire_resource('fake-context', 'router')
-        self.assertIsNone(self.policy.release_resource('fake-context',
+        res = self.policy.acquire_resource(self.context, 'router')
+        self.assertIsNone(self.policy.release_resource(self.context,
                                                        res['resource_id']))
 
+    def test_release_resource_twice(self):
+        res = self.policy.acquire_resource(self.context, 'router')
+        self.policy.release_resource(self.context, res['resource_id'])
+        self.policy.release_resource(self.context, res['resource_id'])
+        self.assertEqual(10, len(self.policy._free['router']))
+
     def test_release_resource_error_wrong_resource_id(self):
         self.assertRaises(exceptions.WrongResourceId,
                           self.policy.release_resource,
-                          context='fake-context',
+                          context=self.context,
                           resource_id='fake-resource-id')
 
     def test_aquire_resource_copy(self):
-        res = self.policy.acquire_resource('fake-context', 'router')
+        res = self.policy.acquire_resource(self.context, 'router')
         for val in self.policy._resources.itervalues():
             self.assertNotEqual(id(res), id(val))
 
+    def test_allocation_state_persisted(self):
+        res = self.policy.acquire_resource(self.context, 'router')
+        new_policy = policy.SimplePolicyDriver()
+        for i in range(9):
+            new_res = new_policy.acquire_resource(self.context, 'router')
+            self.assertNotEqual(res['resource_id'], new_res['resource_id'])
+        self.assertRaises(exceptions.NoMoreResources,
+                          new_policy.acquire_resource,
+                          context=self.context,
+                          resource_type='router')
+        self.assertEqual(10, len(new_policy._resources))
+
+    def test_acquire_resource_db_error(self):
+        with mock.patch('neutron.plugins.niblick.db.api.resource_claim',
+                        side_effect=ValueError):
+            self.assertRaises(ValueError, self.policy.acquire_resource,
+                              self.context, 'router')
+        self.assertEqual(10, len(self.policy._free['router']))
+
+    def test_acquire_resource_allocated_by_other_server(self):
+        other_policy = policy.SimplePolicyDriver()
+        other_policy.acquire_resource(self.context, 'router')
+        res = self.policy.acquire_resource(self.context, 'router')
+        other_res = other_policy.acquire_resource(self.context, 'router')
+        self.assertNotEqual(res['resource_id'], other_res['resource_id'])
+        ids = set(self.policy.acquire_resource(self.context,
+                                               'router')['resource_id']
+                  for i in range(7))
+        self.assertEqual(7, len(ids))
+        self.assertNotIn(res['resource_id'], ids)
+        self.assertNotIn(other_res['resource_id'], ids)
+        self.assertRaises(exceptions.NoMoreResources,
+                          self.policy.acquire_resource,
+                          context=self.context,
+                          resource_type='router')
+
+    def test_acquire_resource_released_by_other_server(self):
+        other_policy = policy.SimplePolicyDriver()
+        for i in range(10):
+            res = self.policy.acquire_resource(self.context, 'router')
+        other_policy.release_resource(self.context, res['resource_id'])
+        new_res = self.policy.acquire_resource(self.context, 'router')
+        self.assertEqual(res['resource_id'], new_res['resource_id'])
+
+    def test_resource_id_derived_from_instance(self):
+        res = self.policy._create_resource('router', 'fake-instance',
+                                           '127.0.0.1')
+        other = policy.SimplePolicyDriver()._create_resource(
+            'router', 'fake-instance', '127.0.0.2')
+        self.assertEqual(res['resource_id'], other['resource_id'])
+        self.assertNotEqual(res['resource_id'], self.policy._create_resource(
+            'router', 'fake-instance-2', '127.0.0.1')['resource_id'])
+
+    def test_load_resources_added_by_other_server(self):
+        other_policy = policy.SimplePolicyDriver()
+        other_res = other_policy.acquire_resource(self.context, 'router')
+        resource_get_all = db_api_niblick.resource_get_all
+        # the other server adds the instances after they were listed
+        with mock.patch.object(db_api_niblick, 'resource_get_all',
+                               side_effect=[[], resource_get_all(
+                                   self.context)]), \
+                mock.patch.object(db_api_niblick, 'resource_add',
+                                  side_effect=db_exc.DBDuplicateEntry):
+            ids = set(self.policy.acquire_resource(self.context,
+                                                   'router')['resource_id']
+                      for i in range(9))
+        self.assertEqual(10, len(self.policy._resources))
+        self.assertNotIn(other_res['resource_id'], ids)
+        self.assertRaises(exceptions.NoMoreResources,
+                          self.policy.acquire_resource,
+                          context=self.context,
+                          resource_type='router')
+
 
 class PolicyManagerTestCase(base.BaseTestCase):
     def setUp(self):
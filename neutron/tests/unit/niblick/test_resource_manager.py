@@ -15,11 +15,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 import mock
+from oslo.config import cfg
 
 from neutron import context
 from neutron.plugins.niblick import resource
 from neutron.tests import base
 
+CONF = cfg.CONF
+
 
 class ResourceManagerrTestCase(base.BaseTestCase):
     def setUp(self):
@@ -37,7 +40,7 @@ class ResourceManagerrTestCase(base.BaseTestCase):
 
         m = mock.patch('neutron.plugins.niblick.db.api.binding_get',
                        return_value=self.obj)
-        m.start()
+        self.binding_get = m.start()
         self.addCleanup(m.stop)
 
         m = mock.patch('neutron.plugins.niblick.db.api.binding_update',
@@ -54,7 +57,7 @@ class ResourceManagerrTestCase(base.BaseTestCase):
         m = mock.patch('neutron.plugins.niblick.db.api.'
                        'binding_get_descriptors',
                        return_value=self.fake_descriptors)
-        m.start()
+        self.binding_get_descriptors = m.start()
         self.addCleanup(m.stop)
 
         m = mock.patch(
@@ -106,3 +109,75 @@ class ResourceManagerrTestCase(base.BaseTestCase):
         descriptors = self.rm.get_descriptors(self.context,
                                               'fake-resource-type')
         self.assertListEqual(self.fake_descriptors, descriptors)
+
+    def test_get_resource_cached(self):
+        self.rm.get_resource(self.context, 'fake-object-id')
+        res = self.rm.get_resource(self.context, 'fake-object-id')
+        self.assertEqual('fake-resource-id', res['resource_id'])
+        self.assertEqual(1, self.binding_get.call_count)
+
+    def test_get_resource_cached_after_bind(self):
+        self._allocate()
+        self.rm.get_resource(self.context, 'fake-object-id')
+        self.assertEqual(0, self.binding_get.call_count)
+
+    def test_get_resource_cache_invalidated_on_deallocate(self):
+        self._allocate()
+        self._deallocate()
+        self.assertEqual(0, self.binding_get.call_count)
+        self.rm.get_resource(self.context, 'fake-object-id')
+        self.assertEqual(1, self.binding_get.call_count)
+
+    def test_get_resource_cache_disabled(self):
+        CONF.set_override('binding_cache_size', 0, 'niblick')
+        rm = resource.ResourceManager()
+        rm.get_resource(self.context, 'fake-object-id')
+        rm.get_resource(self.context, 'fake-object-id')
+        self.assertEqual(2, self.binding_get.call_count)
+
+    def test_get_descriptors_not_cached(self):
+        self.rm.get_descriptors(self.context, 'fake-resource-type')
+        self.rm.get_descriptors(self.context, 'fake-resource-type')
+        self.assertEqual(2, self.binding_get_descriptors.call_count)
+
+    def test_purge_deleted_bindings(self):
+        CONF.set_override('binding_purge_age', 3600, 'niblick')
+        with mock.patch('neutron.plugins.niblick.db.api.'
+                        'binding_purge_deleted',
+                        return_value=5) as purge:
+            self.assertEqual(5, self.rm.purge_deleted_bindings(self.context))
+            purge.assert_called_once_with(self.context, 3600)
+
+
+class BindingCacheTestCase(base.BaseTestCase):
+    def test_get_missing(self):
+        cache = resource.BindingCache(2, 60)
+        self.assertIsNone(cache.get('fake-key'))
+
+    def test_put_get(self):
+        cache = resource.BindingCache(2, 60)
+        cache.put('fake-key', 'fake-value')
+        self.assertEqual('fake-value', cache.get('fake-key'))
+
+    def test_expired(self):
+        cache = resource.BindingCache(2, 60)
+        with mock.patch('time.time', return_value=100):
+            cache.put('fake-key', 'fake-value')
+        with mock.patch('time.time', return_value=161):
+            self.assertIsNone(cache.get('fake-key'))
+
+    def test_evict_least_recently_used(self):
+        cache = resource.BindingCache(2, 60)
+        cache.put('key-1', 1)
+        cache.put('key-2', 2)
+        cache.get('key-1')
+        cache.put('key-3', 3)
+        self.assertIsNone(cache.get('key-2'))
+        self.assertEqual(1, cache.get('key-1'))
+        self.assertEqual(3, cache.get('key-3'))
+
+    def test_invalidate(self):
+        cache = resource.BindingCache(2, 60)
+        cache.put('fake-key', 'fake-value')
+        cache.invalidate('fake-key')
+        self.assertIsNone(cache.get('fake-key'))
@@ -14,6 +14,10 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import errno
+import httplib
+import os
+
 import mock
 from oslo.config import cfg
 
@@ -49,6 +53,51 @@ class SupervisorPolicyDriverTestCase(base.BaseTestCase):
             self.assertEqual(1, conn.getresponse.call_count)
             self.assertDictEqual({}, content)
 
+    def test_get_reuses_connection(self):
+        conn = mock.Mock()
+        conn.getresponse.return_value.read.return_value = ''
+        with mock.patch('httplib2.HTTPConnectionWithTimeout',
+                        return_value=conn) as conn_cls:
+            self.policy._get('fake-url')
+            self.policy._get('fake-url')
+            self.assertEqual(1, conn_cls.call_count)
+            self.assertEqual(2, conn.request.call_count)
+            self.assertDictEqual({'hits': 1, 'misses': 1},
+                                 self.policy.get_pool_stats())
+
+    def test_get_retry_on_stale_connection(self):
+        conn = mock.Mock()
+        resp = mock.Mock()
+        resp.read.return_value = '{"resources": []}'
+        conn.getresponse.side_effect = [httplib.BadStatusLine(''), resp]
+        with mock.patch('httplib2.HTTPConnectionWithTimeout',
+                        return_value=conn):
+            content = self.policy._get('fake-url')
+            self.assertEqual(2, conn.request.call_count)
+            self.assertEqual(1, conn.close.call_count)
+            self.assertDictEqual({'resources': []}, content)
+
+    def test_get_retries_exhausted(self):
+        CONF.set_override('supervisor_retries', 0, 'niblick')
+        conn = mock.Mock()
+        conn.getresponse.side_effect = httplib.BadStatusLine('')
+        with mock.patch('httplib2.HTTPConnectionWithTimeout',
+                        return_value=conn):
+            self.assertRaises(httplib.BadStatusLine,
+                              self.policy._get, 'fake-url')
+            self.assertEqual(1, conn.request.call_count)
+            self.assertEqual(1, len(self.policy.pool.free_items))
+
+    def test_get_no_retry_of_put(self):
+        conn = mock.Mock()
+        conn.getresponse.side_effect = httplib.BadStatusLine('')
+        with mock.patch('httplib2.HTTPConnectionWithTimeout',
+                        return_value=conn):
+            self.assertRaises(httplib.BadStatusLine,
+                              self.policy._get, 'fake-url', 'PUT', {})
+            self.assertEqual(1, conn.request.call_count)
+            self.assertEqual(1, conn.close.call_count)
+
     def test_list(self):
         with self._mock('_get') as get:
             resources = [{'id': 1}, {'id': 2}]
@@ -69,7 +118,15 @@ class SupervisorPolicyDriverTestCase(base.BaseTestCase):
             self.assertDictEqual(resource['resource'], resp)
             get.assert_called_once_with(
                 '%s%s' % (self.policy.url, resources_id), 'PUT',
-                {'resource': {'allocated': True}})
+                {'resource': {'allocated': True,
+                              'reserved_host': CONF.host,
+                              'reserved_pid': os.getpid()}})
+
+    def test_update_release(self):
+        with self._mock('_get', {'resource': {'id': 1}}) as get:
+            self.policy._update(1, False)
+            get.assert_called_once_with('%s1' % self.policy.url, 'PUT',
+                                        {'resource': {'allocated': False}})
 
     def test_acquire_resource(self):
         with self._mock('_list', [{'id': 'fake-resource-id'}]) as lst, \
@@ -104,3 +161,144 @@ class SupervisorPolicyDriverTestCase(base.BaseTestCase):
                               self.policy.release_resource,
                               context='fake-context',
                               resource_id='fake-resource-id')
+
+    def test_get_conflict(self):
+        conn = mock.Mock()
+        conn.getresponse.return_value.status = httplib.CONFLICT
+        conn.getresponse.return_value.read.return_value = ''
+        with mock.patch('httplib2.HTTPConnectionWithTimeout',
+                        return_value=conn):
+            self.assertRaises(exceptions.ResourceConflict,
+                              self.policy._get, 'fake-url', 'PUT', {})
+
+    def test_claim(self):
+        with self._mock('_get') as get:
+            resources = [{'id': 1}, {'id': 2}]
+            get.return_value = {'resources': resources}
+            resp = self.policy._claim('fake-resource-type', 2)
+            self.assertListEqual(resources, resp)
+            get.assert_called_once_with(self.policy.url +
+                                        '?unused=False&allocated=False&'
+                                        'processing=False&limit=2&'
+                                        'class=fake-resource-type',
+                                        'PUT',
+                                        {'resource': {
+                                            'allocated': True,
+                                            'reserved_host': CONF.host,
+                                            'reserved_pid': os.getpid()}})
+
+    def test_claim_retry_on_conflict(self):
+        with self._mock('_get') as get:
+            get.side_effect = [exceptions.ResourceConflict(url='fake-url'),
+                               {'resources': [{'id': 1}]}]
+            resp = self.policy._claim('fake-resource-type', 1)
+            self.assertListEqual([{'id': 1}], resp)
+            self.assertEqual(2, get.call_count)
+
+    def test_claim_conflict_retries_exhausted(self):
+        CONF.set_override('supervisor_claim_retries', 1, 'niblick')
+        with self._mock('_get') as get:
+            get.side_effect = exceptions.ResourceConflict(url='fake-url')
+            self.assertRaises(exceptions.ResourceConflict,
+                              self.policy._claim, 'fake-resource-type', 1)
+            self.assertEqual(2, get.call_count)
+
+    def test_acquire_resource_from_reserve(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        resources = [{'id': i, 'allocated': True, 'type': 'fake-type'}
+                     for i in range(4)]
+        with self._mock('_claim', resources) as claim, \
+                self._mock('_reclaim'), \
+                mock.patch('eventlet.spawn_n') as spawn_n:
+            first = self.policy.acquire_resource('fake-context', 'L3')
+            second = self.policy.acquire_resource('fake-context', 'L3')
+            claim.assert_called_once_with('L3', 4)
+            self.assertEqual(0, first['resource_id'])
+            self.assertEqual(1, second['resource_id'])
+            self.assertEqual('fake-type', second['resource_descriptor'])
+            spawn_n.assert_called_once_with(
+                self.policy._refill_in_background, 'L3')
+
+    def test_acquire_resource_from_reserve_no_more_resource(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        with self._mock('_claim', []), self._mock('_reclaim'):
+            self.assertRaises(exceptions.NoMoreResources,
+                              self.policy.acquire_resource,
+                              context='fake-context',
+                              resource_class='L3')
+
+    def test_refill_tops_up_reserve(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        self.policy._reserve['L3'].extend([{'resource_id': 0}] * 3)
+        with self._mock('_claim', []) as claim:
+            self.policy._refill('L3')
+            claim.assert_called_once_with('L3', 1)
+
+    def test_release_reserve(self):
+        self.policy._reserve['L3'].extend([{'resource_id': 1},
+                                           {'resource_id': 2}])
+        with self._mock('_update', {'id': 1}) as upd:
+            self.policy.release_reserve('fake-context')
+            self.assertEqual([mock.call(1, False), mock.call(2, False)],
+                             upd.call_args_list)
+            self.assertEqual(0, len(self.policy._reserve['L3']))
+
+    def test_release_reserve_at_exit(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        with mock.patch('atexit.register') as register:
+            driver = policy.SupervisorPolicyDriver()
+            register.assert_called_once_with(driver._release_reserve_at_exit)
+        with mock.patch.object(driver, 'release_reserve') as release:
+            driver._release_reserve_at_exit()
+            self.assertEqual(1, release.call_count)
+
+    def test_make_resource_drops_owner(self):
+        res = self.policy._make_resource(
+            {'id': 1, 'allocated': True, 'type': 'fake-type',
+             'reserved_host': 'fake-host', 'reserved_pid': 1,
+             'instance_id': 'fake-instance'}, 'L3')
+        self.assertDictEqual({'instance_id': 'fake-instance'},
+                             res['resource_metadata'])
+
+    def test_reclaim(self):
+        resources = [{'id': 'dead-unbound', 'reserved_pid': 11},
+                     {'id': 'dead-bound', 'reserved_pid': 12},
+                     {'id': 'alive', 'reserved_pid': 13},
+                     {'id': 'no-owner'}]
+
+        def kill(pid, sig):
+            if pid != 13:
+                raise OSError(errno.ESRCH, 'No such process')
+
+        with self._mock('_get', {'resources': resources}) as get, \
+                self._mock('_update') as upd, \
+                mock.patch('os.kill', side_effect=kill), \
+                mock.patch.object(policy.db_api, 'binding_get_by_resource',
+                                  side_effect=lambda ctx, rid:
+                                  rid == 'dead-bound'):
+            self.policy._reclaim('fake-context')
+            get.assert_called_once_with(
+                self.policy.url + '?allocated=True&reserved_host=%s' %
+                CONF.host)
+            upd.assert_called_once_with('dead-unbound', False)
+
+    def test_reclaim_once_per_process(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        resource = {'resource_id': 1}
+        with self._mock('_reclaim') as reclaim, \
+                self._mock('_acquire_reserved', resource):
+            self.policy.acquire_resource('fake-context', 'L3')
+            self.policy.acquire_resource('fake-context', 'L3')
+            reclaim.assert_called_once_with('fake-context')
+            self.policy._reclaimed_by = None
+            self.policy.acquire_resource('fake-context', 'L3')
+            self.assertEqual(2, reclaim.call_count)
+
+    def test_reclaim_failure_does_not_fail_acquire(self):
+        CONF.set_override('supervisor_reserve_size', 4, 'niblick')
+        with self._mock('_reclaim') as reclaim, \
+                self._mock('_acquire_reserved', {'resource_id': 1}):
+            reclaim.side_effect = Exception
+            self.assertEqual({'resource_id': 1},
+                             self.policy.acquire_resource('fake-context',
+                                                          'L3'))
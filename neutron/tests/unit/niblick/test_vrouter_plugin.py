@@ -15,6 +15,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import hmac
+import httplib
+import json
+import socket
+
 from mock import patch, ANY, MagicMock
 
 from neutron.common import constants as l3_constants
@@ -29,6 +35,7 @@ from neutron.openstack.common import log as logging
 from neutron.tests import base
 from oslo.config import cfg
 
+from neutron.plugins.vyatta import exceptions
 from neutron.plugins.vyatta import vrouter_control
 from neutron.plugins.vyatta.vrouter_neutron_plugin import VyattaVRouterL3Mixin
 
@@ -41,6 +48,7 @@ CONFIGURE_INTERFACE_FQN = VROUTER_CONTROL_FQN + '.configure_interface'
 DECONFIGURE_INTERFACE_FQN = VROUTER_CONTROL_FQN + '.deconfigure_interface'
 CONFIGURE_GATEWAY_FQN = VROUTER_CONTROL_FQN + '.configure_gateway'
 CLEAR_GATEWAY_FQN = VROUTER_CONTROL_FQN + '.clear_gateway'
+RELEASE_INSTANCE_FQN = VROUTER_CONTROL_FQN + '.release_instance'
 
 VROUTER_DB_FQN = 'neutron.plugins.vyatta.vrouter_db_v2'
 ADD_ROUTER_ADDRESS_BINDING_FQN = VROUTER_DB_FQN + '.add_router_address_binding'
@@ -71,6 +79,7 @@ class VyattaVRouterDbTestCase(base.BaseTestCase):
         self.deconfigure_interface_mock = self._mock(DECONFIGURE_INTERFACE_FQN)
         self.configure_gateway_mock = self._mock(CONFIGURE_GATEWAY_FQN)
         self.clear_gateway_mock = self._mock(CLEAR_GATEWAY_FQN)
+        self.release_instance_mock = self._mock(RELEASE_INSTANCE_FQN)
 
         self.get_router_instance_mock = self._mock(GET_ROUTER_INSTANCE_FQN)
         self.add_router_address_binding_mock = \
@@ -203,6 +212,14 @@ class VyattaVRouterDbTestCase(base.BaseTestCase):
         self.assertEqual('test_router1', result.get('name'))
         self.assertEqual('fake-tenant-id', result.get('tenant_id'))
 
+    def test_create_router_initialization_failure(self):
+        router = {'router': {'name': 'test_router1', 'admin_state_up': True}}
+        self.initialize_router_mock.side_effect = \
+            exceptions.VRouterConnectFailure(ip_address='8.8.8.8')
+        self.assertRaises(exceptions.VRouterConnectFailure,
+                          self.plugin.create_router, self.context, router)
+        self.release_instance_mock.assert_called_once_with('fake-instance-id')
+
     def test_create_router_with_gw(self):
         router = {'router': {
             'name': 'test_router1',
@@ -257,6 +274,7 @@ class VyattaVRouterDbTestCase(base.BaseTestCase):
         self.plugin.delete_router(self.context, 'fake-router-id-1')
         self.assertRaises(l3.RouterNotFound, self.plugin.get_router,
                           self.context, 'fake-router-id-1')
+        self.release_instance_mock.assert_called_once_with('fake-instance-id')
 
     def test_add_router_interface_port_id_with_subnet_fail(self):
         interface_info = {'port_id': 'foo', 'subnet_id': 'bar'}
@@ -381,53 +399,145 @@ class VyattaVRouterControlTestCase(base.BaseTestCase):
         cfg.CONF.set_override('api_private_key', 'foo', 'VROUTER')
         cfg.CONF.set_override('api_public_key', 'bar', 'VROUTER')
         super(VyattaVRouterControlTestCase, self).setUp()
+        vrouter_control.ApiProxyClient._pools.clear()
+        vrouter_control.ApiProxyClient._no_bulk.clear()
+        self.addCleanup(vrouter_control.ApiProxyClient._pools.clear)
 
     def tearDown(self):
         super(VyattaVRouterControlTestCase, self).tearDown()
 
     def test_initialize_router(self):
         vrouter_control.initialize_router(self.context, '8.8.8.8', {})
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with('POST', '/v2.0', ANY, ANY)
 
     def test_deinitialize_router(self):
         vrouter_control.deinitialize_router(self.context, '8.8.8.8')
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with(
             'DELETE', '/v2.0/router', headers=ANY)
 
     def test_configure_interface(self):
         vrouter_control.configure_interface(self.context, '8.8.8.8', [{}])
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with(
             'PUT', '/v2.0/router/add_router_interface', ANY, ANY)
 
     def test_deconfigure_interface(self):
         vrouter_control.deconfigure_interface(self.context, '8.8.8.8', [{}])
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with(
             'PUT', '/v2.0/router/remove_router_interface', ANY, ANY)
 
+    def test_configure_interface_bulk(self):
+        vrouter_control.configure_interface(self.context, '8.8.8.8',
+                                            [{'ip_address': '10.0.0.1/24'},
+                                             {'ip_address': '10.0.1.1/24'}])
+        conn = self.httplib_mock.return_value
+        conn.request.assert_called_once_with(
+            'PUT', '/v2.0/router/add_router_interfaces', ANY, ANY)
+        body = json.loads(conn.request.call_args[0][2])
+        self.assertEqual(2, len(body['router']['router_interface_infos']))
+
+    def test_configure_interface_bulk_not_supported(self):
+        conn = self.httplib_mock.return_value
+        not_found = MagicMock()
+        not_found.read.return_value = '{}'
+        not_found.status = 404
+        ok = conn.getresponse.return_value
+        conn.getresponse.side_effect = [not_found, ok, ok, ok, ok]
+        infos = [{'ip_address': '10.0.0.1/24'}, {'ip_address': '10.0.1.1/24'}]
+        vrouter_control.configure_interface(self.context, '8.8.8.8', infos)
+        self.assertEqual(3, conn.request.call_count)
+        conn.request.assert_called_with(
+            'PUT', '/v2.0/router/add_router_interface', ANY, ANY)
+        # Bulk requests are not tried again for this vRouter
+        vrouter_control.configure_interface(self.context, '8.8.8.8', infos)
+        self.assertEqual(5, conn.request.call_count)
+
+    def test_deconfigure_interface_bulk(self):
+        vrouter_control.deconfigure_interface(self.context, '8.8.8.8',
+                                              [{}, {}])
+        conn = self.httplib_mock.return_value
+        conn.request.assert_called_once_with(
+            'PUT', '/v2.0/router/remove_router_interfaces', ANY, ANY)
+
+    def test_connection_reused(self):
+        vrouter_control.configure_gateway(self.context, '8.8.8.8', [{}])
+        vrouter_control.clear_gateway(self.context, '8.8.8.8', [{}])
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
+        conn = self.httplib_mock.return_value
+        self.assertEqual(2, conn.request.call_count)
+
+    def test_connection_closed_on_deinitialize(self):
+        vrouter_control.deinitialize_router(self.context, '8.8.8.8')
+        vrouter_control.deinitialize_router(self.context, '8.8.8.8')
+        self.assertEqual(2, self.httplib_mock.call_count)
+        conn = self.httplib_mock.return_value
+        self.assertEqual(2, conn.close.call_count)
+
+    def test_stale_connection_retried(self):
+        conn = self.httplib_mock.return_value
+        response = conn.getresponse.return_value
+        conn.getresponse.side_effect = [httplib.BadStatusLine(''), response]
+        client = vrouter_control.ApiProxyClient('8.8.8.8')
+        client.rest_call('GET', '/v2.0/router', None)
+        self.assertEqual(2, conn.request.call_count)
+        self.assertEqual(1, conn.close.call_count)
+
+    def test_stale_connection_not_retried_for_post(self):
+        conn = self.httplib_mock.return_value
+        response = conn.getresponse.return_value
+        conn.getresponse.side_effect = [httplib.BadStatusLine(''), response]
+        client = vrouter_control.ApiProxyClient('8.8.8.8')
+        self.assertRaises(exceptions.VRouterConnectFailure,
+                          client.rest_call, 'POST', '/v2.0', {})
+        self.assertEqual(1, conn.request.call_count)
+        self.assertEqual(1, conn.close.call_count)
+
+    def test_connect_failure(self):
+        conn = self.httplib_mock.return_value
+        conn.getresponse.side_effect = socket.timeout()
+        self.assertRaises(exceptions.VRouterConnectFailure,
+                          vrouter_control.clear_gateway,
+                          self.context, '8.8.8.8', [{}])
+        self.assertEqual(1, conn.request.call_count)
+
+    def test_sign(self):
+        client = vrouter_control.ApiProxyClient('8.8.8.8')
+        for content in ('{}', 'null', '{"router": {}}'):
+            self.assertEqual(
+                hmac.new('foo', content, hashlib.sha1).hexdigest(),
+                client._sign(content))
+
     def test_configure_gateway(self):
         vrouter_control.configure_gateway(self.context, '8.8.8.8', [{}])
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with('PUT', '/v2.0/router', ANY, ANY)
 
     def test_clear_gateway(self):
         vrouter_control.clear_gateway(self.context, '8.8.8.8', [{}])
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with('PUT', '/v2.0/router', ANY, ANY)
 
     def test_assign_floating_ip(self):
         vrouter_control.assign_floating_ip(
             self.context, '8.8.8.8', '10.0.0.3', '8.8.8.10')
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with(
             'PUT', '/v2.0/router/assign_floating_ip', ANY, ANY)
@@ -435,7 +545,8 @@ class VyattaVRouterControlTestCase(base.BaseTestCase):
     def test_unassign_floating_ip(self):
         vrouter_control.unassign_floating_ip(
             self.context, '8.8.8.8', '10.0.0.3', '8.8.8.10')
-        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000)
+        self.httplib_mock.assert_called_once_with('8.8.8.8', 5000,
+                                                  timeout=30)
         conn = self.httplib_mock.return_value
         conn.request.assert_called_once_with(
             'PUT', '/v2.0/router/unassign_floating_ip', ANY, ANY)
@@ -447,16 +558,18 @@ class VyattaVRouterControlNovaTestCase(base.BaseTestCase):
 
         self.create_nova_client_mock = \
             self._mock(VROUTER_CONTROL_FQN + '.create_nova_client')
-        self.is_allocated_mock = \
-            self._mock(VROUTER_DB_FQN + '.is_allocated')
+        self.get_allocated_instances_mock = \
+            self._mock(VROUTER_DB_FQN + '.get_allocated_instances')
+        self._mock(VROUTER_CONTROL_FQN + '._instance_index',
+                   vrouter_control.InstanceIndex())
 
         super(VyattaVRouterControlNovaTestCase, self).setUp()
 
     def tearDown(self):
         super(VyattaVRouterControlNovaTestCase, self).tearDown()
 
-    def _mock(self, function):
-        patcher = patch(function)
+    def _mock(self, function, *args):
+        patcher = patch(function, *args)
         self.addCleanup(patcher.stop)
         return patcher.start()
 
@@ -476,21 +589,129 @@ class VyattaVRouterControlNovaTestCase(base.BaseTestCase):
         server = client.servers.get.return_value
         server.interface_detach.assert_called_once_with('port-id')
 
-    def test_allocate_instance(self):
-        iface = MagicMock()
-        iface.fixed_ips = [{'ip_address': '8.8.8.8'}]
+    def _instance(self, instance_id, status='ACTIVE'):
         instance = MagicMock()
-        instance.id = 'instance-id'
-        instance.interface_list.return_value = [iface]
+        instance.id = instance_id
+        instance.status = status
+        return instance
+
+    def _iface(self, ip_address):
+        iface = MagicMock()
+        iface.fixed_ips = [{'ip_address': ip_address}]
+        return iface
 
+    def test_allocate_instance(self):
         client = self.create_nova_client_mock.return_value
-        client.servers.findall.return_value = [instance]
+        client.servers.list.return_value = [self._instance('instance-id')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8')]
 
-        self.is_allocated_mock.return_value = False
+        self.get_allocated_instances_mock.return_value = set()
 
         ip_addr, vm_id = vrouter_control.allocate_instance(
             self.context, 'router-id')
-        self.is_allocated_mock.assert_called_once_with(
-            self.context.session, 'instance-id')
+        self.get_allocated_instances_mock.assert_called_once_with(
+            self.context.session)
+        client.servers.interface_list.assert_called_once_with('instance-id')
         self.assertEqual('8.8.8.8', ip_addr)
         self.assertEqual('instance-id', vm_id)
+
+    def test_allocate_instance_skips_allocated(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = [self._instance('instance-1'),
+                                            self._instance('instance-2')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8')]
+        self.get_allocated_instances_mock.return_value = set(['instance-1'])
+
+        ip_addr, vm_id = vrouter_control.allocate_instance(
+            self.context, 'router-id')
+        self.assertEqual('instance-2', vm_id)
+        client.servers.interface_list.assert_called_once_with('instance-2')
+
+    def test_allocate_instance_skips_attached(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = [self._instance('instance-id')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8'),
+                                                      self._iface('8.8.8.9')]
+        self.get_allocated_instances_mock.return_value = set()
+
+        self.assertEqual((None, None), vrouter_control.allocate_instance(
+            self.context, 'router-id'))
+
+    def test_allocate_instance_incremental(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = [self._instance('instance-1')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8')]
+        self.get_allocated_instances_mock.return_value = set()
+        vrouter_control.allocate_instance(self.context, 'router-1')
+        client.servers.list.assert_called_once_with()
+
+        client.servers.list.return_value = [
+            self._instance('instance-1', 'DELETED'),
+            self._instance('instance-2')]
+        ip_addr, vm_id = vrouter_control.allocate_instance(
+            self.context, 'router-2')
+        client.servers.list.assert_called_with(
+            search_opts={'changes-since': ANY})
+        self.assertEqual('instance-2', vm_id)
+
+        # Address of an indexed instance is not fetched again
+        vrouter_control.allocate_instance(self.context, 'router-3')
+        self.assertEqual(2, client.servers.interface_list.call_count)
+
+    def test_allocate_instance_rotates(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = [self._instance('instance-1'),
+                                            self._instance('instance-2')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8')]
+        self.get_allocated_instances_mock.return_value = set()
+        _ip, vm_id1 = vrouter_control.allocate_instance(self.context, 'r1')
+        _ip, vm_id2 = vrouter_control.allocate_instance(self.context, 'r2')
+        self.assertNotEqual(vm_id1, vm_id2)
+        # Allocations are only read from the database on a full refresh
+        self.assertEqual(1, self.get_allocated_instances_mock.call_count)
+
+    def test_release_instance(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = [self._instance('instance-id')]
+        client.servers.interface_list.return_value = [self._iface('8.8.8.8')]
+        self.get_allocated_instances_mock.return_value = set()
+        vrouter_control.allocate_instance(self.context, 'router-1')
+        self.assertEqual((None, None), vrouter_control.allocate_instance(
+            self.context, 'router-2'))
+
+        vrouter_control.release_instance('instance-id')
+        self.assertEqual(('8.8.8.8', 'instance-id'),
+                         vrouter_control.allocate_instance(
+                             self.context, 'router-3'))
+        client.servers.interface_list.assert_called_once_with('instance-id')
+
+    def test_release_unknown_instance(self):
+        client = self.create_nova_client_mock.return_value
+        client.servers.list.return_value = []
+        self.get_allocated_instances_mock.return_value = set()
+        vrouter_control.release_instance('instance-id')
+        self.assertEqual((None, None), vrouter_control.allocate_instance(
+            self.context, 'router-id'))
+
+
+class VyattaVRouterNovaClientTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(VyattaVRouterNovaClientTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        patcher = patch('novaclient.v1_1.client.Client')
+        self.addCleanup(patcher.stop)
+        self.client_mock = patcher.start()
+        patcher = patch.dict(vrouter_control._nova_clients, clear=True)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_create_nova_client_cached(self):
+        client1 = vrouter_control.create_nova_client(self.context, 'tenant')
+        client2 = vrouter_control.create_nova_client(self.context, 'tenant')
+        self.assertIs(client1, client2)
+        self.assertEqual(1, self.client_mock.call_count)
+
+    def test_create_nova_client_per_tenant(self):
+        vrouter_control.create_nova_client(self.context, 'tenant')
+        vrouter_control.create_nova_client(self.context)
+        self.assertEqual(2, self.client_mock.call_count)
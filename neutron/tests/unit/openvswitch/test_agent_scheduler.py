@@ -329,6 +329,32 @@ class OvsAgentSchedulerTestCase(test_l3_plugin.L3NatTestCaseMixin,
         self.assertEqual(1, len(dhcp_agents['agents']))
         self.assertEqual(DHCP_HOSTA, dhcp_agents['agents'][0]['host'])
 
+    def test_get_networks_info_of_hosted(self):
+        cfg.CONF.set_override('allow_overlapping_ips', True)
+        with contextlib.nested(self.subnet(),
+                               self.subnet()) as (sub1, sub2):
+            dhcp_rpc = dhcp_rpc_base.DhcpRpcCallbackMixin()
+            self._register_agent_states()
+            dhcp_rpc.get_active_networks(self.adminContext, host=DHCP_HOSTA)
+            net1_id = sub1['subnet']['network_id']
+            net2_id = sub2['subnet']['network_id']
+            hosta_nets = dhcp_rpc.get_networks_info(
+                self.adminContext, network_ids=[net1_id], host=DHCP_HOSTA)
+            hostc_nets = dhcp_rpc.get_networks_info(
+                self.adminContext, network_ids=[net1_id, net2_id],
+                host=DHCP_HOSTC)
+            hostc_id = self._get_agent_id(constants.AGENT_TYPE_DHCP,
+                                          DHCP_HOSTC)
+            num_hostc_nets = len(self._list_networks_hosted_by_dhcp_agent(
+                hostc_id)['networks'])
+
+        self.assertEqual([net1_id], [net['id'] for net in hosta_nets])
+        self.assertEqual([sub1['subnet']['id']],
+                         [subnet['id'] for subnet in hosta_nets[0]['subnets']])
+        self.assertEqual([], hostc_nets)
+        # get_networks_info does not schedule networks
+        self.assertEqual(0, num_hostc_nets)
+
     def test_network_auto_schedule_with_hosted_2(self):
         # one agent hosts one network
         dhcp_rpc = dhcp_rpc_base.DhcpRpcCallbackMixin()
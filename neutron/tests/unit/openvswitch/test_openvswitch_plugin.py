@@ -13,7 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+
+from neutron.common import constants
+from neutron import context
 from neutron.extensions import portbindings
+from neutron.plugins.openvswitch import ovs_db_v2
+from neutron.plugins.openvswitch import ovs_neutron_plugin
 from neutron.tests.unit import _test_extension_portbindings as test_bindings
 from neutron.tests.unit import test_db_plugin as test_plugin
 from neutron.tests.unit import test_security_groups_rpc as test_sg_rpc
@@ -53,6 +59,56 @@ class TestOpenvswitchNetworksV2(test_plugin.TestNetworksV2,
     pass
 
 
+class TestOpenvswitchRpcCallbacks(OpenvswitchPluginV2TestCase):
+
+    def setUp(self):
+        super(TestOpenvswitchRpcCallbacks, self).setUp()
+        self.callbacks = ovs_neutron_plugin.OVSRpcCallbacks(None, None)
+        self.ctx = context.get_admin_context()
+
+    def _test_get_devices_details_list(self, port1, port2):
+        port1_id = port1['port']['id']
+        port2_id = port2['port']['id']
+        details = self.callbacks.get_devices_details_list(
+            self.ctx, devices=[port1_id, 'unknown', port2_id],
+            agent_id='agent')
+        self.assertEqual([port1_id, 'unknown', port2_id],
+                         [entry['device'] for entry in details])
+        self.assertEqual(port1_id, details[0]['port_id'])
+        self.assertEqual(port1['port']['network_id'],
+                         details[0]['network_id'])
+        self.assertTrue(details[0]['admin_state_up'])
+        self.assertIn('network_type', details[0])
+        self.assertNotIn('port_id', details[1])
+        self.assertFalse(details[2]['admin_state_up'])
+        ports = ovs_db_v2.get_ports([port1_id, port2_id])
+        self.assertEqual(constants.PORT_STATUS_ACTIVE,
+                         ports[port1_id]['status'])
+        self.assertEqual(constants.PORT_STATUS_DOWN,
+                         ports[port2_id]['status'])
+
+    def test_get_devices_details_list(self):
+        with self.subnet() as subnet:
+            with contextlib.nested(
+                self.port(subnet=subnet),
+                self.port(subnet=subnet, admin_state_up=False)
+            ) as (port1, port2):
+                self._test_get_devices_details_list(port1, port2)
+
+    def test_update_devices_down(self):
+        with self.port() as port:
+            port_id = port['port']['id']
+            self.callbacks.get_device_details(self.ctx, device=port_id,
+                                              agent_id='agent')
+            details = self.callbacks.update_devices_down(
+                self.ctx, devices=[port_id, 'unknown'], agent_id='agent')
+            self.assertEqual([{'device': port_id, 'exists': True},
+                              {'device': 'unknown', 'exists': False}],
+                             details)
+            self.assertEqual(constants.PORT_STATUS_DOWN,
+                             ovs_db_v2.get_port(port_id)['status'])
+
+
 class TestOpenvswitchPortBinding(OpenvswitchPluginV2TestCase,
                                  test_bindings.PortBindingsTestCase):
     VIF_TYPE = portbindings.VIF_TYPE_OVS
@@ -95,30 +95,36 @@ class OVS_Lib_Test(base.BaseTestCase):
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=2,dl_src=ca:fe:de:ad:be:ef"
                        ",actions=strip_vlan,output:0"],
-                      root_helper=self.root_helper)
+                      root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "add-flow", self.BR_NAME,
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=1,actions=normal"],
-                      root_helper=self.root_helper)
+                      root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "add-flow", self.BR_NAME,
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=2,actions=drop"],
-                      root_helper=self.root_helper)
+                      root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "add-flow", self.BR_NAME,
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=2,in_port=%s,actions=drop" % ofport],
-                      root_helper=self.root_helper)
+                      root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "add-flow", self.BR_NAME,
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=4,in_port=%s,dl_vlan=%s,"
                        "actions=strip_vlan,set_tunnel:%s,normal"
                        % (ofport, vid, lsw_id)],
-                      root_helper=self.root_helper)
+                      root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "add-flow", self.BR_NAME,
                        "hard_timeout=0,idle_timeout=0,"
                        "priority=3,tun_id=%s,actions="
                        "mod_vlan_vid:%s,output:%s"
-                       % (lsw_id, vid, ofport)], root_helper=self.root_helper)
+                       % (lsw_id, vid, ofport)], root_helper=self.root_helper,
+                      process_input=None)
         self.mox.ReplayAll()
 
         self.br.add_flow(priority=2, dl_src="ca:fe:de:ad:be:ef",
@@ -135,6 +141,57 @@ class OVS_Lib_Test(base.BaseTestCase):
                          (vid, ofport))
         self.mox.VerifyAll()
 
+    def test_mod_flow(self):
+        utils.execute(["ovs-ofctl", "mod-flows", self.BR_NAME,
+                       "in_port=1,actions=drop"],
+                      root_helper=self.root_helper,
+                      process_input=None)
+        self.mox.ReplayAll()
+
+        self.br.mod_flow(in_port=1, actions="drop")
+        self.mox.VerifyAll()
+
+    def test_defer_apply_flows(self):
+        utils.execute(["ovs-ofctl", "add-flows", self.BR_NAME, "-"],
+                      root_helper=self.root_helper,
+                      process_input="hard_timeout=0,idle_timeout=0,"
+                                    "priority=2,in_port=1,actions=drop\n"
+                                    "hard_timeout=0,idle_timeout=0,"
+                                    "priority=1,actions=normal\n")
+        utils.execute(["ovs-ofctl", "del-flows", self.BR_NAME, "-"],
+                      root_helper=self.root_helper,
+                      process_input="in_port=1\n")
+        utils.execute(["ovs-ofctl", "add-flows", self.BR_NAME, "-"],
+                      root_helper=self.root_helper,
+                      process_input="hard_timeout=0,idle_timeout=0,"
+                                    "priority=3,in_port=1,actions=normal\n")
+        self.mox.ReplayAll()
+
+        with self.br.defer_apply():
+            self.br.add_flow(priority=2, in_port=1, actions="drop")
+            with self.br.defer_apply():
+                self.br.add_flow(priority=1, actions="normal")
+            self.br.delete_flows(in_port=1)
+            self.br.add_flow(priority=3, in_port=1, actions="normal")
+        self.assertFalse(self.br.defer_apply_flows)
+        self.assertEqual([], self.br.deferred_flows)
+        self.mox.VerifyAll()
+
+    def test_defer_apply_flows_on_exception(self):
+        utils.execute(["ovs-ofctl", "del-flows", self.BR_NAME, "-"],
+                      root_helper=self.root_helper,
+                      process_input="in_port=1\n")
+        self.mox.ReplayAll()
+
+        try:
+            with self.br.defer_apply():
+                self.br.delete_flows(in_port=1)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertFalse(self.br.defer_apply_flows)
+        self.mox.VerifyAll()
+
     def test_get_port_ofport(self):
         pname = "tap99"
         ofport = "6"
@@ -158,8 +215,8 @@ class OVS_Lib_Test(base.BaseTestCase):
 
     def test_count_flows(self):
         utils.execute(["ovs-ofctl", "dump-flows", self.BR_NAME],
-                      root_helper=self.root_helper).AndReturn('ignore'
-                                                              '\nflow-1\n')
+                      root_helper=self.root_helper,
+                      process_input=None).AndReturn('ignore\nflow-1\n')
         self.mox.ReplayAll()
 
         # counts the number of flows as total lines of output - 2
@@ -171,11 +228,14 @@ class OVS_Lib_Test(base.BaseTestCase):
         lsw_id = 40
         vid = 39
         utils.execute(["ovs-ofctl", "del-flows", self.BR_NAME,
-                       "in_port=" + ofport], root_helper=self.root_helper)
+                       "in_port=" + ofport], root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "del-flows", self.BR_NAME,
-                       "tun_id=%s" % lsw_id], root_helper=self.root_helper)
+                       "tun_id=%s" % lsw_id], root_helper=self.root_helper,
+                      process_input=None)
         utils.execute(["ovs-ofctl", "del-flows", self.BR_NAME,
-                       "dl_vlan=%s" % vid], root_helper=self.root_helper)
+                       "dl_vlan=%s" % vid], root_helper=self.root_helper,
+                      process_input=None)
         self.mox.ReplayAll()
 
         self.br.delete_flows(in_port=ofport)
@@ -231,7 +291,7 @@ class OVS_Lib_Test(base.BaseTestCase):
 
     def _test_get_vif_ports(self, is_xen=False):
         pname = "tap99"
-        ofport = "6"
+        ofport = 6
         vif_id = uuidutils.generate_uuid()
         mac = "ca:fe:de:ad:be:ef"
 
@@ -239,18 +299,18 @@ class OVS_Lib_Test(base.BaseTestCase):
                       root_helper=self.root_helper).AndReturn("%s\n" % pname)
 
         if is_xen:
-            external_ids = ('{xs-vif-uuid="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {'xs-vif-uuid': vif_id, 'attached-mac': mac}
         else:
-            external_ids = ('{iface-id="%s", attached-mac="%s"}'
-                            % (vif_id, mac))
+            external_ids = {'iface-id': vif_id, 'attached-mac': mac}
 
-        utils.execute(["ovs-vsctl", self.TO, "get",
-                       "Interface", pname, "external_ids"],
-                      root_helper=self.root_helper).AndReturn(external_ids)
-        utils.execute(["ovs-vsctl", self.TO, "get",
-                       "Interface", pname, "ofport"],
-                      root_helper=self.root_helper).AndReturn(ofport)
+        headings = ['name', 'external_ids', 'ofport']
+        data = [[pname, external_ids, ofport],
+                ['tap88', {'iface-id': 'tap88id', 'attached-mac': mac}, 7]]
+        utils.execute(["ovs-vsctl", self.TO, "--format=json",
+                       "--", "--columns=name,external_ids,ofport",
+                       "list", "Interface"],
+                      root_helper=self.root_helper).AndReturn(
+                          self._encode_ovs_json(headings, data))
         if is_xen:
             utils.execute(["xe", "vif-param-get", "param-name=other-config",
                            "param-key=nicira-iface-id", "uuid=" + vif_id],
@@ -266,6 +326,43 @@ class OVS_Lib_Test(base.BaseTestCase):
         self.assertEqual(ports[0].switch.br_name, self.BR_NAME)
         self.mox.VerifyAll()
 
+    def test_get_xapi_iface_id_cached(self):
+        utils.execute(["xe", "vif-param-get", "param-name=other-config",
+                       "param-key=nicira-iface-id", "uuid=vif1"],
+                      root_helper=self.root_helper).AndReturn('iface1\n')
+        utils.execute(["xe", "vif-param-get", "param-name=other-config",
+                       "param-key=nicira-iface-id", "uuid=vif2"],
+                      root_helper=self.root_helper).AndRaise(RuntimeError())
+        utils.execute(["xe", "vif-param-get", "param-name=other-config",
+                       "param-key=nicira-iface-id", "uuid=vif2"],
+                      root_helper=self.root_helper).AndReturn('iface2\n')
+        self.mox.ReplayAll()
+
+        self.assertEqual('iface1', self.br.get_xapi_iface_id('vif1'))
+        self.assertEqual('iface1', self.br.get_xapi_iface_id('vif1'))
+        # failures are not cached
+        self.assertIsNone(self.br.get_xapi_iface_id('vif2'))
+        self.assertEqual('iface2', self.br.get_xapi_iface_id('vif2'))
+        self.mox.VerifyAll()
+
+    def test_get_vif_ports_drops_stale_xapi_iface_ids(self):
+        self.br.xapi_iface_ids = {'vif1': 'iface1', 'vif2': 'iface2'}
+        utils.execute(["ovs-vsctl", self.TO, "list-ports", self.BR_NAME],
+                      root_helper=self.root_helper).AndReturn("tap1\n")
+        data = [['tap1', {'xs-vif-uuid': 'vif1', 'attached-mac': 'mac1'}, 1]]
+        utils.execute(["ovs-vsctl", self.TO, "--format=json",
+                       "--", "--columns=name,external_ids,ofport",
+                       "list", "Interface"],
+                      root_helper=self.root_helper).AndReturn(
+                          self._encode_ovs_json(
+                              ['name', 'external_ids', 'ofport'], data))
+        self.mox.ReplayAll()
+
+        ports = self.br.get_vif_ports()
+        self.assertEqual(['iface1'], [port.vif_id for port in ports])
+        self.assertEqual({'vif1': 'iface1'}, self.br.xapi_iface_ids)
+        self.mox.VerifyAll()
+
     def _encode_ovs_json(self, headings, data):
         # See man ovs-vsctl(8) for the encoding details.
         r = {"data": [],
@@ -278,8 +375,11 @@ class OVS_Lib_Test(base.BaseTestCase):
                     ovs_row.append(cell)
                 elif isinstance(cell, dict):
                     ovs_row.append(["map", cell.items()])
+                elif isinstance(cell, (int, list)):
+                    ovs_row.append(cell)
                 else:
-                    raise TypeError('%r not str or dict' % type(cell))
+                    raise TypeError('%r not str, dict, int or list' %
+                                    type(cell))
         return jsonutils.dumps(r)
 
     def _test_get_vif_port_set(self, is_xen):
@@ -352,6 +452,39 @@ class OVS_Lib_Test(base.BaseTestCase):
         self.assertEqual(set(), self.br.get_vif_port_set())
         self.mox.VerifyAll()
 
+    def test_get_vif_ports_by_ids(self):
+        headings = ['name', 'external_ids', 'ofport']
+        data = [
+            ['tap99', {'iface-id': 'tap99id', 'attached-mac': 'tap99mac'}, 1],
+            ['tap88', {'iface-id': 'tap88id', 'attached-mac': 'tap88mac'},
+             ['set', []]],
+            ['tap77', {'iface-id': 'tap77id', 'attached-mac': 'tap77mac'}, 3],
+            ['tun22', {}, 4],
+        ]
+        utils.execute(["ovs-vsctl", self.TO, "--format=json",
+                       "--", "--columns=name,external_ids,ofport",
+                       "list", "Interface"],
+                      root_helper=self.root_helper).AndReturn(
+                          self._encode_ovs_json(headings, data))
+        self.mox.ReplayAll()
+
+        ports = self.br.get_vif_ports_by_ids(['tap99id', 'tap88id', 'tap66id'])
+        self.assertEqual(['tap88id', 'tap99id'], sorted(ports))
+        self.assertEqual('tap99', ports['tap99id'].port_name)
+        self.assertEqual(1, ports['tap99id'].ofport)
+        self.assertEqual('tap99mac', ports['tap99id'].vif_mac)
+        self.assertEqual(-1, ports['tap88id'].ofport)
+        self.mox.VerifyAll()
+
+    def test_get_vif_ports_by_ids_list_interface_error(self):
+        utils.execute(["ovs-vsctl", self.TO, "--format=json",
+                       "--", "--columns=name,external_ids,ofport",
+                       "list", "Interface"],
+                      root_helper=self.root_helper).AndRaise(RuntimeError())
+        self.mox.ReplayAll()
+        self.assertEqual({}, self.br.get_vif_ports_by_ids(['tap99id']))
+        self.mox.VerifyAll()
+
     def test_clear_db_attribute(self):
         pname = "tap77"
         utils.execute(["ovs-vsctl", self.TO, "clear", "Port",
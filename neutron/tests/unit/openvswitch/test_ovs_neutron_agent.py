@@ -130,6 +130,27 @@ class TestOvsNeutronAgent(base.BaseTestCase):
             self.agent.port_dead(mock.Mock())
         self.assertTrue(add_flow_func.called)
 
+    def test_defer_apply_flows(self):
+        self.agent.int_br = ovs_lib.OVSBridge('br-int', 'sudo')
+        self.agent.tun_br = ovs_lib.OVSBridge('br-tun', 'sudo')
+        self.agent.enable_tunneling = True
+        with mock.patch.object(ovs_lib.OVSBridge,
+                               'run_ofctl') as run_ofctl:
+            with self.agent._defer_apply_flows():
+                self.agent.int_br.add_flow(priority=2, in_port=1,
+                                           actions='drop')
+                self.agent.tun_br.delete_flows(tun_id=1)
+                self.agent.tun_br.delete_flows(tun_id=2)
+                self.assertFalse(run_ofctl.called)
+        run_ofctl.assert_has_calls([
+            mock.call('add-flows', ['-'],
+                      process_input='hard_timeout=0,idle_timeout=0,'
+                                    'priority=2,in_port=1,actions=drop\n'),
+            mock.call('del-flows', ['-'],
+                      process_input='tun_id=1\ntun_id=2\n')],
+            any_order=True)
+        self.assertEqual(2, run_ofctl.call_count)
+
     def mock_update_ports(self, vif_port_set=None, registered_ports=None):
         with mock.patch.object(self.agent.int_br, 'get_vif_port_set',
                                return_value=vif_port_set):
@@ -145,59 +166,113 @@ class TestOvsNeutronAgent(base.BaseTestCase):
         actual = self.mock_update_ports(vif_port_set, registered_ports)
         self.assertEqual(expected, actual)
 
+    def test_monitor_ports_without_minimize_polling(self):
+        self.assertFalse(self.agent._monitor_ports())
+
+    def test_monitor_ports(self):
+        self.agent.minimize_polling = True
+        self.agent.ovsdb_monitor = mock.Mock()
+        self.agent.ovsdb_monitor.is_active.return_value = True
+        self.assertTrue(self.agent._monitor_ports())
+
+    def test_monitor_ports_respawns_monitor(self):
+        self.agent.minimize_polling = True
+        self.agent.ovsdb_monitor = mock.Mock()
+        self.agent.ovsdb_monitor.is_active.return_value = False
+        with mock.patch('time.time', return_value=100):
+            self.agent.ovsdb_monitor_started = 90
+            self.assertFalse(self.agent._monitor_ports())
+            self.assertFalse(self.agent.ovsdb_monitor.start.called)
+            self.agent.ovsdb_monitor_started = 70
+            self.assertTrue(self.agent._monitor_ports())
+            self.agent.ovsdb_monitor.start.assert_called_once_with()
+            self.assertEqual(100, self.agent.ovsdb_monitor_started)
+
+    def test_monitor_ports_respawn_failure(self):
+        self.agent.minimize_polling = True
+        self.agent.ovsdb_monitor = mock.Mock()
+        self.agent.ovsdb_monitor.is_active.return_value = False
+        self.agent.ovsdb_monitor.start.side_effect = OSError()
+        self.agent.ovsdb_monitor_started = 0
+        self.assertFalse(self.agent._monitor_ports())
+
     def test_treat_devices_added_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
+        with mock.patch.object(self.agent.plugin_rpc,
+                               'get_devices_details_list',
                                side_effect=Exception()):
-            self.assertTrue(self.agent.treat_devices_added([{}]))
+            self.assertTrue(self.agent.treat_devices_added(['123']))
 
     def _mock_treat_devices_added(self, details, port, func_name):
         """Mock treat devices added.
 
         :param details: the details to return for the device
-        :param port: the port that get_vif_port_by_id should return
+        :param port: the port that get_vif_ports_by_ids should return
         :param func_name: the function that should be called
         :returns: whether the named function was called
         """
+        details['device'] = '123'
         with contextlib.nested(
-            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
-                              return_value=details),
-            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
-                              return_value=port),
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[details]),
+            mock.patch.object(self.agent.int_br, 'get_vif_ports_by_ids',
+                              return_value={'123': port}),
             mock.patch.object(self.agent, func_name)
         ) as (get_dev_fn, get_vif_func, func):
-            self.assertFalse(self.agent.treat_devices_added([{}]))
+            self.assertFalse(self.agent.treat_devices_added(['123']))
+        get_dev_fn.assert_called_once_with(self.agent.context, ['123'],
+                                           self.agent.agent_id)
         return func.called
 
     def test_treat_devices_added_ignores_invalid_ofport(self):
         port = mock.Mock()
         port.ofport = -1
-        self.assertFalse(self._mock_treat_devices_added(mock.MagicMock(), port,
+        self.assertFalse(self._mock_treat_devices_added({}, port,
                                                         'port_dead'))
 
     def test_treat_devices_added_marks_unknown_port_as_dead(self):
         port = mock.Mock()
         port.ofport = 1
-        self.assertTrue(self._mock_treat_devices_added(mock.MagicMock(), port,
+        self.assertTrue(self._mock_treat_devices_added({}, port,
                                                        'port_dead'))
 
     def test_treat_devices_added_updates_known_port(self):
-        details = mock.MagicMock()
-        details.__contains__.side_effect = lambda x: True
+        details = {'port_id': '123', 'network_id': 'net',
+                   'network_type': 'vlan', 'physical_network': 'physnet',
+                   'segmentation_id': 1, 'admin_state_up': True}
         self.assertTrue(self._mock_treat_devices_added(details,
                                                        mock.Mock(),
                                                        'treat_vif_port'))
 
+    def test_treat_devices_added_old_server(self):
+        error = rpc_common.RemoteError('UnsupportedRpcVersion')
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              side_effect=error),
+            mock.patch.object(self.agent.plugin_rpc, 'get_device_details',
+                              side_effect=lambda ctx, device, agent_id:
+                              {'device': device}),
+            mock.patch.object(self.agent.int_br, 'get_vif_ports_by_ids',
+                              return_value={}),
+        ) as (get_devs_fn, get_dev_fn, get_vif_func):
+            self.assertFalse(self.agent.treat_devices_added(['1', '2']))
+            self.assertFalse(self.agent.treat_devices_added(['3']))
+        self.assertEqual(1, get_devs_fn.call_count)
+        self.assertEqual(3, get_dev_fn.call_count)
+        self.assertFalse(self.agent.use_bulk_rpc)
+
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_devices_down',
                                side_effect=Exception()):
-            self.assertTrue(self.agent.treat_devices_removed([{}]))
+            self.assertTrue(self.agent.treat_devices_removed(['123']))
 
     def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        details = dict(device='123', exists=port_exists)
+        with mock.patch.object(self.agent.plugin_rpc, 'update_devices_down',
+                               return_value=[details]):
             with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
+                self.assertFalse(self.agent.treat_devices_removed(['123']))
         self.assertEqual(port_unbound.called, not port_exists)
 
     def test_treat_devices_removed_unbinds_port(self):
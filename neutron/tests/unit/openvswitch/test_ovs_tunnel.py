@@ -397,6 +397,13 @@ class TunnelTest(base.BaseTestCase):
              'removed': set([]),
              'added': set([])}).AndRaise(
                  Exception('Fake exception to get out of the loop'))
+        for i in range(2):
+            for bridge in (self.mock_int_bridge, self.mock_map_tun_bridge,
+                           self.mock_tun_bridge):
+                bridge.defer_apply_on()
+            for bridge in (self.mock_int_bridge, self.mock_map_tun_bridge,
+                           self.mock_tun_bridge):
+                bridge.defer_apply_off()
         self.mox.ReplayAll()
         q_agent = ovs_neutron_agent.OVSNeutronAgent(self.INT_BRIDGE,
                                                     self.TUN_BRIDGE,
@@ -0,0 +1,76 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import StringIO
+
+import mock
+
+from neutron.agent.linux import ovsdb_monitor
+from neutron.tests import base
+
+
+class OvsdbMonitorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OvsdbMonitorTestCase, self).setUp()
+        self.monitor = ovsdb_monitor.OvsdbMonitor(
+            'Interface', columns=['name', 'external_ids'],
+            root_helper='sudo')
+        self.popen = mock.patch('neutron.common.utils.subprocess_popen'
+                                ).start()
+        self.spawn = mock.patch('eventlet.spawn').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_start(self):
+        self.monitor.start()
+        self.popen.assert_called_once_with(
+            ['sudo', 'ovsdb-client', 'monitor', 'Interface',
+             'name,external_ids', '--format=json'],
+            stdout=mock.ANY, stderr=mock.ANY)
+        self.spawn.assert_called_once_with(self.monitor._read_updates,
+                                           self.popen.return_value)
+
+    def test_is_active(self):
+        self.assertFalse(self.monitor.is_active())
+        self.monitor.start()
+        process = self.popen.return_value
+        process.poll.return_value = None
+        self.assertTrue(self.monitor.is_active())
+        process.poll.return_value = 1
+        self.assertFalse(self.monitor.is_active())
+
+    def test_stop(self):
+        self.monitor.start()
+        process = self.popen.return_value
+        process.poll.return_value = None
+        self.monitor.stop()
+        process.kill.assert_called_once_with()
+        self.spawn.return_value.kill.assert_called_once_with()
+        self.assertFalse(self.monitor.is_active())
+
+    def test_get_updates(self):
+        process = mock.Mock()
+        process.stdout = StringIO.StringIO('{"data": 1}\n\n{"data": 2}\n')
+        process.stderr = StringIO.StringIO('connection closed')
+        process.returncode = 1
+        self.monitor._read_updates(process)
+        self.assertEqual(['{"data": 1}', '{"data": 2}'],
+                         self.monitor.get_updates())
+        self.assertEqual([], self.monitor.get_updates())
+
+    def test_get_updates_timeout(self):
+        self.assertEqual([], self.monitor.get_updates(0.01))
@@ -39,9 +39,15 @@ class AgentRPCPluginApi(base.BaseTestCase):
     def test_get_device_details(self):
         self._test_rpc_call('get_device_details')
 
+    def test_get_devices_details_list(self):
+        self._test_rpc_call('get_devices_details_list')
+
     def test_update_device_down(self):
         self._test_rpc_call('update_device_down')
 
+    def test_update_devices_down(self):
+        self._test_rpc_call('update_devices_down')
+
     def test_tunnel_sync(self):
         self._test_rpc_call('tunnel_sync')
 
@@ -0,0 +1,210 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo.config import cfg
+
+from neutron.common import exceptions as q_exc
+from neutron import context
+from neutron.db import api as db_api
+from neutron.db import ipam
+from neutron.db import models_v2
+from neutron.tests import base
+
+
+class IPIntervalSetTestCase(base.BaseTestCase):
+
+    def test_init_merges_adjacent_ranges(self):
+        free = ipam.IPIntervalSet([(10, 20), (1, 5), (6, 8), (15, 25)])
+        self.assertEqual([(1, 8), (10, 25)], free.ranges())
+
+    def test_contains(self):
+        free = ipam.IPIntervalSet([(1, 5), (10, 20)])
+        self.assertIn(1, free)
+        self.assertIn(20, free)
+        self.assertNotIn(0, free)
+        self.assertNotIn(7, free)
+        self.assertNotIn(21, free)
+
+    def test_first(self):
+        self.assertEqual(3, ipam.IPIntervalSet([(7, 9), (3, 4)]).first())
+        self.assertIsNone(ipam.IPIntervalSet().first())
+
+    def test_take_splits_range(self):
+        free = ipam.IPIntervalSet([(1, 10)])
+        self.assertEqual(([(1, 10)], [(1, 4), (6, 10)]), free.take(5))
+        self.assertEqual([(1, 4), (6, 10)], free.ranges())
+
+    def test_take_range_bounds(self):
+        free = ipam.IPIntervalSet([(1, 3), (5, 5)])
+        self.assertEqual(([(1, 3)], [(2, 3)]), free.take(1))
+        self.assertEqual(([(2, 3)], [(2, 2)]), free.take(3))
+        self.assertEqual(([(5, 5)], []), free.take(5))
+        self.assertEqual([(2, 2)], free.ranges())
+
+    def test_take_used_address(self):
+        free = ipam.IPIntervalSet([(1, 3)])
+        self.assertIsNone(free.take(4))
+        self.assertEqual([(1, 3)], free.ranges())
+
+    def test_release_merges_neighbours(self):
+        free = ipam.IPIntervalSet([(1, 4), (6, 10)])
+        self.assertEqual(([(1, 4), (6, 10)], [(1, 10)]), free.release(5))
+        self.assertEqual([(1, 10)], free.ranges())
+
+    def test_release_extends_range(self):
+        free = ipam.IPIntervalSet([(1, 4), (10, 12)])
+        self.assertEqual(([(1, 4)], [(1, 5)]), free.release(5))
+        self.assertEqual(([(10, 12)], [(9, 12)]), free.release(9))
+        self.assertEqual(([], [(7, 7)]), free.release(7))
+        self.assertEqual([(1, 5), (7, 7), (9, 12)], free.ranges())
+
+    def test_release_free_address(self):
+        free = ipam.IPIntervalSet([(1, 4)])
+        self.assertEqual(([], []), free.release(2))
+        self.assertEqual([(1, 4)], free.ranges())
+
+
+class IpamDriverTestMixin(object):
+
+    def setUp(self):
+        super(IpamDriverTestMixin, self).setUp()
+        db_api.configure_db()
+        self.addCleanup(db_api.clear_db)
+        self.context = context.get_admin_context()
+        self.driver = self.driver_class()
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.add(models_v2.Network(id='net', name='net',
+                                          admin_state_up=True,
+                                          status='ACTIVE', shared=False))
+            session.add(models_v2.Subnet(id='subnet', network_id='net',
+                                         ip_version=4, cidr='10.0.0.0/24',
+                                         gateway_ip='10.0.0.1',
+                                         enable_dhcp=True, shared=False))
+            for pool_id, first_ip, last_ip in (('pool1', '10.0.0.2',
+                                                '10.0.0.9'),
+                                               ('pool2', '10.0.0.20',
+                                                '10.0.0.29')):
+                session.add(models_v2.IPAllocationPool(
+                    id=pool_id, subnet_id='subnet',
+                    first_ip=first_ip, last_ip=last_ip))
+                session.add(models_v2.IPAvailabilityRange(
+                    allocation_pool_id=pool_id,
+                    first_ip=first_ip, last_ip=last_ip))
+        self.subnets = [{'id': 'subnet', 'cidr': '10.0.0.0/24',
+                         'network_id': 'net'}]
+
+    def _ranges(self):
+        query = self.context.session.query(models_v2.IPAvailabilityRange)
+        return sorted((r['allocation_pool_id'], r['first_ip'], r['last_ip'])
+                      for r in query)
+
+    def _generate(self):
+        with self.context.session.begin(subtransactions=True):
+            return self.driver.generate_ip(self.context,
+                                           self.subnets)['ip_address']
+
+    def test_generate_ip(self):
+        self.assertEqual('10.0.0.2', self._generate())
+        self.assertEqual('10.0.0.3', self._generate())
+        self.assertEqual([('pool1', '10.0.0.4', '10.0.0.9'),
+                          ('pool2', '10.0.0.20', '10.0.0.29')],
+                         self._ranges())
+
+    def test_generate_ip_exhausted(self):
+        ips = [self._generate() for i in range(18)]
+        self.assertEqual(18, len(set(ips)))
+        self.assertEqual([], self._ranges())
+        self.assertRaises(q_exc.IpAddressGenerationFailure, self._generate)
+
+    def test_allocate_specific_ip(self):
+        with self.context.session.begin(subtransactions=True):
+            self.driver.allocate_specific_ip(self.context, 'subnet',
+                                             '10.0.0.5')
+        self.assertEqual([('pool1', '10.0.0.2', '10.0.0.4'),
+                          ('pool1', '10.0.0.6', '10.0.0.9'),
+                          ('pool2', '10.0.0.20', '10.0.0.29')],
+                         self._ranges())
+
+    def test_recycle_ip(self):
+        for i in range(3):
+            self._generate()
+        with self.context.session.begin(subtransactions=True):
+            self.driver.recycle_ip(self.context, 'subnet', '10.0.0.3')
+        self.assertEqual([('pool1', '10.0.0.3', '10.0.0.3'),
+                          ('pool1', '10.0.0.5', '10.0.0.9'),
+                          ('pool2', '10.0.0.20', '10.0.0.29')],
+                         self._ranges())
+        with self.context.session.begin(subtransactions=True):
+            self.driver.recycle_ip(self.context, 'subnet', '10.0.0.4')
+            self.driver.recycle_ip(self.context, 'subnet', '10.0.0.2')
+        self.assertEqual([('pool1', '10.0.0.2', '10.0.0.9'),
+                          ('pool2', '10.0.0.20', '10.0.0.29')],
+                         self._ranges())
+
+    def test_recycle_ips(self):
+        for i in range(6):
+            self._generate()
+        with self.context.session.begin(subtransactions=True):
+            self.driver.recycle_ips(self.context, 'subnet',
+                                    ['10.0.0.5', '10.0.0.3', '10.0.0.4',
+                                     '10.0.0.7', '10.0.0.15'])
+        self.assertEqual([('pool1', '10.0.0.3', '10.0.0.5'),
+                          ('pool1', '10.0.0.7', '10.0.0.9'),
+                          ('pool2', '10.0.0.20', '10.0.0.29')],
+                         self._ranges())
+        self.assertEqual('10.0.0.3', self._generate())
+
+    def test_recycle_ip_outside_pools(self):
+        self.assertRaises(q_exc.InvalidInput, self.driver.recycle_ip,
+                          self.context, 'subnet', '10.0.0.15')
+
+
+class RangeTableIpamDriverTestCase(IpamDriverTestMixin, base.BaseTestCase):
+    driver_class = ipam.RangeTableIpamDriver
+
+
+class IntervalIpamDriverTestCase(IpamDriverTestMixin, base.BaseTestCase):
+    driver_class = ipam.IntervalIpamDriver
+
+    def test_ranges_changed_by_another_server(self):
+        self.assertEqual('10.0.0.2', self._generate())
+        other = ipam.IntervalIpamDriver()
+        with self.context.session.begin(subtransactions=True):
+            other.allocate_specific_ip(self.context, 'subnet', '10.0.0.3')
+        self.assertEqual('10.0.0.4', self._generate())
+
+    def test_failed_transaction_drops_cache(self):
+        session = self.context.session
+        try:
+            with session.begin(subtransactions=True):
+                self.driver.generate_ip(self.context, self.subnets)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual('10.0.0.2', self._generate())
+
+
+class GetDriverTestCase(base.BaseTestCase):
+
+    def test_get_driver(self):
+        self.assertIsInstance(ipam.get_driver(), ipam.IntervalIpamDriver)
+        self.assertIs(ipam.get_driver(), ipam.get_driver())
+        cfg.CONF.set_override('ipam_driver',
+                              'neutron.db.ipam.RangeTableIpamDriver')
+        self.addCleanup(cfg.CONF.clear_override, 'ipam_driver')
+        self.assertIsInstance(ipam.get_driver(), ipam.RangeTableIpamDriver)
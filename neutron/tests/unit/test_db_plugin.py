@@ -38,6 +38,7 @@ from neutron.common.test_lib import test_config
 from neutron import context
 from neutron.db import api as db
 from neutron.db import db_base_plugin_v2
+from neutron.db import ipam
 from neutron.db import models_v2
 from neutron.manager import NeutronManager
 from neutron.openstack.common import timeutils
@@ -1656,6 +1657,35 @@ fixed_ips=ip_address%%3D%s&fixed_ips=ip_address%%3D%s&fixed_ips=subnet_id%%3D%s
                     ip_allocation.expiration - timeutils.utcnow(),
                     matchers.GreaterThan(datetime.timedelta(seconds=10)))
 
+    def test_update_fixed_ip_lease_expirations(self):
+        plugin = NeutronManager.get_plugin()
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as ports:
+                update_context = context.Context('',
+                                                 subnet['subnet']['tenant_id'])
+                ip_addresses = [port['port']['fixed_ips'][0]['ip_address']
+                                for port in ports]
+                with mock.patch.object(db_base_plugin_v2, 'LOG') as log:
+                    plugin.update_fixed_ip_lease_expirations(
+                        update_context, subnet['subnet']['network_id'],
+                        {ip_addresses[0]: 500, ip_addresses[1]: 0,
+                         '255.255.255.0': 120})
+                    self.assertTrue(log.debug.called)
+
+                q = update_context.session.query(models_v2.IPAllocation)
+                expirations = dict(
+                    (ip_allocation.ip_address, ip_allocation.expiration)
+                    for ip_allocation in q.filter(
+                        models_v2.IPAllocation.ip_address.in_(ip_addresses)))
+                now = timeutils.utcnow()
+                self.assertThat(
+                    expirations[ip_addresses[0]] - now,
+                    matchers.GreaterThan(datetime.timedelta(seconds=400)))
+                self.assertThat(
+                    expirations[ip_addresses[1]] - now,
+                    matchers.LessThan(datetime.timedelta(seconds=10)))
+
     def test_port_delete_holds_ip(self):
         base_class = db_base_plugin_v2.NeutronDbPluginV2
         with mock.patch.object(base_class, '_hold_ip') as hold_ip:
@@ -1717,15 +1747,40 @@ fixed_ips=ip_address%%3D%s&fixed_ips=ip_address%%3D%s&fixed_ips=subnet_id%%3D%s
 
                 for fixed_ip in port_obj.fixed_ips:
                     fixed_ip.active = False
+                    fixed_ip.port_id = None
                     fixed_ip.expiration = datetime.datetime.utcnow()
 
-                with mock.patch.object(plugin, '_recycle_ip') as rc:
+                with mock.patch.object(ipam.get_driver(),
+                                       'recycle_ips') as rc:
                     plugin._recycle_expired_ip_allocations(
                         update_context, subnet['subnet']['network_id'])
-                    rc.assertEqual(len(rc.mock_calls), 1)
+                    rc.assert_called_once_with(
+                        update_context, subnet['subnet']['id'],
+                        [port['port']['fixed_ips'][0]['ip_address']])
                     self.assertEqual(update_context._recycled_networks,
                                      set([subnet['subnet']['network_id']]))
 
+    def test_recycle_expired_ip_allocations(self):
+        plugin = NeutronManager.get_plugin()
+        with self.subnet() as subnet:
+            ip_addresses = []
+            for i in range(3):
+                with self.port(subnet=subnet) as port:
+                    ip_addresses.append(
+                        port['port']['fixed_ips'][0]['ip_address'])
+            ctx = context.get_admin_context()
+            q = ctx.session.query(models_v2.IPAllocation)
+            q = q.filter(models_v2.IPAllocation.ip_address.in_(ip_addresses))
+            self.assertEqual(0, plugin.recycle_expired_ip_allocations(ctx))
+            self.assertEqual(3, q.count())
+            q.update({'expiration': timeutils.utcnow()},
+                     synchronize_session=False)
+            self.assertEqual(3, plugin.recycle_expired_ip_allocations(ctx))
+            self.assertEqual(0, q.count())
+            with self.port(subnet=subnet) as port:
+                self.assertEqual(ip_addresses[0],
+                                 port['port']['fixed_ips'][0]['ip_address'])
+
     def test_recycle_expired_previously_run_within_context(self):
         plugin = NeutronManager.get_plugin()
         with self.subnet() as subnet:
@@ -1741,10 +1796,11 @@ fixed_ips=ip_address%%3D%s&fixed_ips=ip_address%%3D%s&fixed_ips=subnet_id%%3D%s
                     fixed_ip.active = False
                     fixed_ip.expiration = datetime.datetime.utcnow()
 
-                with mock.patch.object(plugin, '_recycle_ip') as rc:
+                with mock.patch.object(ipam.get_driver(),
+                                       'recycle_ips') as rc:
                     plugin._recycle_expired_ip_allocations(
                         update_context, subnet['subnet']['network_id'])
-                    rc.assertFalse(rc.called)
+                    self.assertFalse(rc.called)
                     self.assertEqual(update_context._recycled_networks,
                                      set([subnet['subnet']['network_id']]))
 
@@ -15,6 +15,7 @@
 
 import mock
 
+from neutron.common import constants
 from neutron.db import dhcp_rpc_base
 from neutron.tests import base
 
@@ -49,6 +50,71 @@ class TestDhcpRpcCallackMixin(base.BaseTestCase):
 
         self.assertEqual(len(self.log.mock_calls), 1)
 
+    def test_get_active_networks_info(self):
+        self.plugin.get_networks.return_value = [dict(id='a'), dict(id='b')]
+        self.plugin.get_ports.return_value = [
+            dict(id='p1', network_id='b'), dict(id='p2', network_id='a'),
+            dict(id='p3', network_id='b')]
+        self.plugin.get_subnets.return_value = [
+            dict(id='s1', network_id='a')]
+
+        networks = self.callbacks.get_active_networks_info(mock.Mock(),
+                                                           host='host')
+
+        self.assertEqual(networks, [
+            dict(id='a', subnets=[dict(id='s1', network_id='a')],
+                 ports=[dict(id='p2', network_id='a')]),
+            dict(id='b', subnets=[],
+                 ports=[dict(id='p1', network_id='b'),
+                        dict(id='p3', network_id='b')])])
+        self.plugin.assert_has_calls(
+            [mock.call.get_ports(mock.ANY,
+                                 filters=dict(network_id=['a', 'b'])),
+             mock.call.get_subnets(mock.ANY,
+                                   filters=dict(network_id=['a', 'b'],
+                                                enable_dhcp=[True]))],
+            any_order=True)
+
+    def test_get_networks_info(self):
+        self.plugin.get_networks.return_value = [dict(id='a')]
+        self.plugin.get_ports.return_value = []
+        self.plugin.get_subnets.return_value = []
+
+        networks = self.callbacks.get_networks_info(
+            mock.Mock(), network_ids=['a', 'b'], host='host')
+
+        self.assertEqual(networks, [dict(id='a', subnets=[], ports=[])])
+        self.plugin.assert_has_calls(
+            [mock.call.get_networks(mock.ANY,
+                                    filters=dict(id=['a', 'b'],
+                                                 admin_state_up=[True]))])
+
+    def test_get_networks_info_scheduled(self):
+        self.plugin.supported_extension_aliases = [
+            constants.DHCP_AGENT_SCHEDULER_EXT_ALIAS]
+        self.plugin.list_active_networks_on_active_dhcp_agent.return_value = [
+            dict(id='a')]
+        self.plugin.get_ports.return_value = []
+        self.plugin.get_subnets.return_value = []
+
+        networks = self.callbacks.get_networks_info(
+            mock.Mock(), network_ids=['a', 'b'], host='host')
+
+        self.assertEqual(networks, [dict(id='a', subnets=[], ports=[])])
+        self.plugin.list_active_networks_on_active_dhcp_agent.\
+            assert_called_once_with(mock.ANY, 'host', network_ids=['a', 'b'])
+        self.assertFalse(self.plugin.auto_schedule_networks.called)
+        self.assertFalse(self.plugin.get_networks.called)
+
+    def test_get_networks_info_none_active(self):
+        self.plugin.get_networks.return_value = []
+
+        networks = self.callbacks.get_networks_info(
+            mock.Mock(), network_ids=['a'], host='host')
+
+        self.assertEqual(networks, [])
+        self.assertFalse(self.plugin.get_ports.called)
+
     def test_get_network_info(self):
         network_retval = dict(id='a')
 
@@ -64,6 +130,18 @@ class TestDhcpRpcCallackMixin(base.BaseTestCase):
         self.assertEqual(retval['subnets'], subnet_retval)
         self.assertEqual(retval['ports'], port_retval)
 
+    def test_update_lease_expirations(self):
+        leases = {'a': {'10.0.0.2': 120, '10.0.0.3': 0},
+                  'b': {'10.0.1.2': 120}}
+        self.callbacks.update_lease_expirations(mock.Mock(), leases=leases,
+                                                host='host')
+        self.plugin.assert_has_calls(
+            [mock.call.update_fixed_ip_lease_expirations(
+                mock.ANY, 'a', {'10.0.0.2': 120, '10.0.0.3': 0}),
+             mock.call.update_fixed_ip_lease_expirations(
+                 mock.ANY, 'b', {'10.0.1.2': 120})],
+            any_order=True)
+
     def _test_get_dhcp_port_helper(self, port_retval, other_expectations=[],
                                    update_port=None, create_port=None):
         subnets_retval = [dict(id='a', enable_dhcp=True),
@@ -19,6 +19,7 @@ import copy
 import os
 import socket
 import sys
+import time
 import uuid
 
 import eventlet
@@ -34,6 +35,7 @@ from neutron.agent.linux import interface
 from neutron.common import constants
 from neutron.common import exceptions
 from neutron.openstack.common import jsonutils
+from neutron.openstack.common.rpc import common as rpc_common
 from neutron.tests import base
 
 
@@ -253,7 +255,8 @@ class TestDhcpAgent(base.BaseTestCase):
                                                     'qdhcp-1',
                                                     mock.ANY)
                 self.assertEqual(log.call_count, 1)
-                self.assertTrue(dhcp.needs_resync)
+                self.assertFalse(dhcp.needs_resync)
+                self.assertEqual(dhcp.resync_networks, set(['1']))
 
     def test_update_lease(self):
         with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
@@ -275,33 +278,95 @@ class TestDhcpAgent(base.BaseTestCase):
                         'net_id', '192.168.1.1', 120)])
 
                 self.assertTrue(log.called)
-                self.assertTrue(dhcp.needs_resync)
+                self.assertEqual(dhcp.resync_networks, set(['net_id']))
 
-    def _test_sync_state_helper(self, known_networks, active_networks):
+    def test_update_lease_window(self):
+        cfg.CONF.set_override('lease_update_window', 1)
+        with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            with mock.patch.object(dhcp_agent.eventlet,
+                                   'spawn_after') as spawn_after:
+                dhcp.update_lease('net_id', '192.168.1.1', 120)
+                dhcp.update_lease('net_id', '192.168.1.2', 0)
+                dhcp.update_lease('net_id2', '192.168.1.1', 120)
+                spawn_after.assert_called_once_with(1, dhcp.flush_leases)
+            self.assertFalse(plug.return_value.update_lease_expiration.called)
+
+            with mock.patch.object(dhcp_agent.time, 'time',
+                                   return_value=time.time() + 10):
+                dhcp.flush_leases()
+            plug.return_value.update_lease_expirations.assert_called_once_with(
+                {'net_id': {'192.168.1.1': 110, '192.168.1.2': 0},
+                 'net_id2': {'192.168.1.1': 110}})
+            self.assertFalse(dhcp.pending_leases)
+
+    def test_flush_leases_failure(self):
+        with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
+            plug.return_value.update_lease_expirations.side_effect = Exception
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp.pending_leases = {'net_id': {'192.168.1.1': (120, 0)}}
+            with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
+                dhcp.flush_leases()
+            self.assertTrue(log.called)
+            self.assertTrue(dhcp.use_bulk_leases)
+            self.assertEqual(dhcp.resync_networks, set(['net_id']))
+
+    def test_flush_leases_old_server(self):
+        with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
+            plug.return_value.update_lease_expirations.side_effect = (
+                rpc_common.RemoteError('AttributeError'))
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp.pending_leases = {
+                'net_id': {'192.168.1.1': (120, time.time())}}
+            dhcp.flush_leases()
+            dhcp.pending_leases = {
+                'net_id': {'192.168.1.2': (120, time.time())}}
+            dhcp.flush_leases()
+            self.assertFalse(dhcp.use_bulk_leases)
+            self.assertEqual(
+                plug.return_value.update_lease_expirations.call_count, 1)
+            plug.return_value.update_lease_expiration.assert_has_calls(
+                [mock.call('net_id', '192.168.1.1', 120),
+                 mock.call('net_id', '192.168.1.2', 120)])
+
+    def _test_sync_state_helper(self, known_networks, active_networks,
+                                network_ids=None):
         with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.return_value = active_networks
+            mock_plugin.get_active_networks.return_value = active_networks
+            mock_plugin.get_networks_info.side_effect = lambda ids: [
+                dhcp_agent.DictModel(dict(id=net_id)) for net_id in ids
+                if net_id in active_networks]
             plug.return_value = mock_plugin
 
             dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
 
             attrs_to_mock = dict(
                 [(a, mock.DEFAULT) for a in
-                 ['refresh_dhcp_helper', 'disable_dhcp_helper', 'cache']])
+                 ['configure_dhcp_for_network', 'disable_dhcp_helper',
+                  'cache']])
 
             with mock.patch.multiple(dhcp, **attrs_to_mock) as mocks:
                 mocks['cache'].get_network_ids.return_value = known_networks
-                dhcp.sync_state()
-
-                exp_refresh = [
-                    mock.call(net_id) for net_id in active_networks]
-
-                diff = set(known_networks) - set(active_networks)
-                exp_disable = [mock.call(net_id) for net_id in diff]
-
-                mocks['cache'].assert_has_calls([mock.call.get_network_ids()])
-                mocks['refresh_dhcp_helper'].assert_has_called(exp_refresh)
-                mocks['disable_dhcp_helper'].assert_has_called(exp_disable)
+                dhcp.sync_state(network_ids)
+                dhcp.queue.wait()
+
+                if network_ids is None:
+                    mocks['cache'].assert_has_calls(
+                        [mock.call.get_network_ids()])
+                    network_ids = set(known_networks) | set(active_networks)
+                configured = [
+                    call[0][0].id for call in
+                    mocks['configure_dhcp_for_network'].call_args_list]
+                disabled = [call[0][0] for call in
+                            mocks['disable_dhcp_helper'].call_args_list]
+                self.assertEqual(
+                    sorted(configured),
+                    sorted(set(active_networks) & set(network_ids)))
+                self.assertEqual(
+                    sorted(disabled),
+                    sorted(set(network_ids) - set(active_networks)))
+            return mock_plugin
 
     def test_sync_state_initial(self):
         self._test_sync_state_helper([], ['a'])
@@ -312,10 +377,64 @@ class TestDhcpAgent(base.BaseTestCase):
     def test_sync_state_disabled_net(self):
         self._test_sync_state_helper(['b'], ['a'])
 
+    def test_sync_state_networks(self):
+        plugin = self._test_sync_state_helper(['a', 'b'], ['a', 'c'],
+                                              set(['b', 'c']))
+        self.assertFalse(plugin.get_active_networks.called)
+        plugin.get_networks_info.assert_called_once_with(['b', 'c'])
+
+    def test_sync_state_pages(self):
+        cfg.CONF.set_override('sync_page_size', 2)
+        plugin = self._test_sync_state_helper([], ['a', 'b', 'c'])
+        self.assertEqual(plugin.get_networks_info.call_args_list,
+                         [mock.call(['a', 'b']), mock.call(['c'])])
+
+    def test_sync_state_page_error(self):
+        cfg.CONF.set_override('sync_page_size', 2)
+        with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks.return_value = ['a', 'b', 'c']
+            mock_plugin.get_networks_info.side_effect = [
+                Exception, [dhcp_agent.DictModel(dict(id='c'))]]
+            plug.return_value = mock_plugin
+
+            with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
+                dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+                with mock.patch.object(dhcp.queue, 'put') as put:
+                    dhcp.sync_state()
+                put.assert_called_once_with(
+                    'c', dhcp.configure_dhcp_for_network, mock.ANY)
+                self.assertTrue(log.called)
+                self.assertFalse(dhcp.needs_resync)
+                self.assertEqual(dhcp.resync_networks, set(['a', 'b']))
+
+    def test_sync_state_old_server(self):
+        cfg.CONF.set_override('sync_page_size', 1)
+        with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
+            mock_plugin = mock.Mock()
+            mock_plugin.get_active_networks.return_value = ['a', 'b', 'c']
+            mock_plugin.get_networks_info.side_effect = (
+                rpc_common.RemoteError('AttributeError'))
+            mock_plugin.get_active_networks_info.return_value = [
+                dhcp_agent.DictModel(dict(id=net_id))
+                for net_id in ('a', 'b', 'c')]
+            plug.return_value = mock_plugin
+
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            with mock.patch.object(dhcp.queue, 'put') as put:
+                dhcp.sync_state()
+            self.assertFalse(dhcp.use_networks_info)
+            self.assertEqual(mock_plugin.get_networks_info.call_count, 1)
+            # the first page, then the remaining networks at once
+            self.assertEqual(
+                mock_plugin.get_active_networks_info.call_count, 2)
+            self.assertEqual(
+                [call[0][0] for call in put.call_args_list], ['a', 'b', 'c'])
+
     def test_sync_state_plugin_error(self):
         with mock.patch('neutron.agent.dhcp_agent.DhcpPluginApi') as plug:
             mock_plugin = mock.Mock()
-            mock_plugin.get_active_networks_info.side_effect = Exception
+            mock_plugin.get_active_networks.side_effect = Exception
             plug.return_value = mock_plugin
 
             with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
@@ -343,6 +462,17 @@ class TestDhcpAgent(base.BaseTestCase):
                 sleep.assert_called_once_with(dhcp.conf.resync_interval)
                 self.assertFalse(dhcp.needs_resync)
 
+    def test_periodic_resync_helper_networks(self):
+        with mock.patch.object(dhcp_agent.eventlet, 'sleep'):
+            dhcp = dhcp_agent.DhcpAgent(HOSTNAME)
+            dhcp.resync_networks = set(['a'])
+            with mock.patch.object(dhcp, 'sync_state') as sync_state:
+                sync_state.side_effect = RuntimeError
+                with testtools.ExpectedException(RuntimeError):
+                    dhcp._periodic_resync_helper()
+                sync_state.assert_called_once_with(set(['a']))
+                self.assertFalse(dhcp.resync_networks)
+
     def test_populate_cache_on_start_without_active_networks_support(self):
         # emul dhcp driver that doesn't support retrieving of active networks
         self.driver.existing_dhcp_networks.side_effect = NotImplementedError
@@ -506,7 +636,8 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
                 [mock.call.get_network_info(fake_network.id)])
             self.assertFalse(self.call_driver.called)
             self.assertTrue(log.called)
-            self.assertTrue(self.dhcp.needs_resync)
+            self.assertEqual(self.dhcp.resync_networks,
+                             set([fake_network.id]))
             self.assertFalse(self.cache.called)
             self.assertFalse(self.external_process.called)
 
@@ -640,26 +771,30 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
 
         with mock.patch.object(self.dhcp, 'enable_dhcp_helper') as enable:
             self.dhcp.network_create_end(None, payload)
-            enable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.queue.wait()
+            enable.assert_called_once_with(fake_network.id)
 
     def test_network_update_end_admin_state_up(self):
         payload = dict(network=dict(id=fake_network.id, admin_state_up=True))
         with mock.patch.object(self.dhcp, 'enable_dhcp_helper') as enable:
             self.dhcp.network_update_end(None, payload)
-            enable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.queue.wait()
+            enable.assert_called_once_with(fake_network.id)
 
     def test_network_update_end_admin_state_down(self):
         payload = dict(network=dict(id=fake_network.id, admin_state_up=False))
         with mock.patch.object(self.dhcp, 'disable_dhcp_helper') as disable:
             self.dhcp.network_update_end(None, payload)
-            disable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.queue.wait()
+            disable.assert_called_once_with(fake_network.id)
 
     def test_network_delete_end(self):
         payload = dict(network_id=fake_network.id)
 
         with mock.patch.object(self.dhcp, 'disable_dhcp_helper') as disable:
             self.dhcp.network_delete_end(None, payload)
-            disable.assertCalledOnceWith(fake_network.id)
+            self.dhcp.queue.wait()
+            disable.assert_called_once_with(fake_network.id)
 
     def test_refresh_dhcp_helper_no_dhcp_enabled_networks(self):
         network = FakeModel('net-id',
@@ -693,7 +828,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
             self.cache.assert_has_calls(
                 [mock.call.get_network_by_id('net-id')])
             self.assertTrue(log.called)
-            self.assertTrue(self.dhcp.needs_resync)
+            self.assertEqual(self.dhcp.resync_networks, set(['net-id']))
 
     def test_subnet_update_end(self):
         payload = dict(subnet=dict(network_id=fake_network.id))
@@ -702,6 +837,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.dhcp.device_manager.update = mock.Mock()
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.queue.wait()
 
         self.cache.assert_has_calls([mock.call.put(fake_network)])
         self.call_driver.assert_called_once_with('reload_allocations',
@@ -721,6 +857,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.dhcp.device_manager.update = mock.Mock()
 
         self.dhcp.subnet_update_end(None, payload)
+        self.dhcp.queue.wait()
 
         self.cache.assert_has_calls([mock.call.put(new_state)])
         self.call_driver.assert_called_once_with('restart',
@@ -741,6 +878,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         self.dhcp.device_manager.update = mock.Mock()
 
         self.dhcp.subnet_delete_end(None, payload)
+        self.dhcp.queue.wait()
 
         self.cache.assert_has_calls([
             mock.call.get_network_by_subnet_id(
@@ -755,6 +893,7 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
         payload = dict(port=vars(fake_port2))
         self.cache.get_network_by_id.return_value = fake_network
         self.dhcp.port_update_end(None, payload)
+        self.dhcp.queue.wait()
         self.cache.assert_has_calls(
             [mock.call.get_network_by_id(fake_port2.network_id),
              mock.call.put_port(mock.ANY)])
@@ -763,25 +902,85 @@ class TestDhcpAgentEventHandler(base.BaseTestCase):
 
     def test_port_delete_end(self):
         payload = dict(port_id=fake_port2.id)
+        self.cache.get_network_by_port_id.return_value = fake_network
         self.cache.get_network_by_id.return_value = fake_network
         self.cache.get_port_by_id.return_value = fake_port2
 
         self.dhcp.port_delete_end(None, payload)
+        self.dhcp.queue.wait()
 
         self.cache.assert_has_calls(
-            [mock.call.get_port_by_id(fake_port2.id),
+            [mock.call.get_network_by_port_id(fake_port2.id),
+             mock.call.get_port_by_id(fake_port2.id),
              mock.call.get_network_by_id(fake_network.id),
              mock.call.remove_port(fake_port2)])
         self.call_driver.assert_called_once_with('reload_allocations',
                                                  fake_network)
 
+    def test_port_update_end_reload_allocations_window(self):
+        cfg.CONF.set_override('reload_allocations_window', 1)
+        payload = dict(port=vars(fake_port2))
+        self.cache.get_network_by_id.return_value = fake_network
+        with mock.patch.object(dhcp_agent.eventlet,
+                               'spawn_after') as spawn_after:
+            self.dhcp.port_update_end(None, payload)
+            self.dhcp.queue.wait()
+            self.dhcp.port_update_end(None, payload)
+            self.dhcp.queue.wait()
+            spawn_after.assert_called_once_with(1,
+                                                self.dhcp.flush_allocations)
+        self.assertFalse(self.call_driver.called)
+        self.assertEqual(self.dhcp.dirty_networks, set([fake_network.id]))
+
+        self.dhcp.flush_allocations()
+        self.dhcp.queue.wait()
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.assertFalse(self.dhcp.dirty_networks)
+
+    def test_flush_allocations_skips_removed_networks(self):
+        self.dhcp.dirty_networks = set(['net-id'])
+        self.cache.get_network_by_id.return_value = None
+        self.dhcp.flush_allocations()
+        self.dhcp.queue.wait()
+        self.assertFalse(self.call_driver.called)
+        self.assertFalse(self.dhcp.dirty_networks)
+
+    def test_refresh_dhcp_helper_clears_dirty_network(self):
+        self.dhcp.dirty_networks = set([fake_network.id])
+        self.cache.get_network_by_id.return_value = fake_network
+        self.plugin.get_network_info.return_value = fake_network
+        self.dhcp.device_manager.update = mock.Mock()
+        self.dhcp.refresh_dhcp_helper(fake_network.id)
+        self.call_driver.assert_called_once_with('reload_allocations',
+                                                 fake_network)
+        self.assertFalse(self.dhcp.dirty_networks)
+
+    def test_port_delete_end_of_queued_port(self):
+        network = FakeModel(fake_network.id, ports=[])
+        self.cache.get_network_by_id.return_value = network
+        self.cache.get_port_by_id.return_value = fake_port2
+        self.cache.get_network_by_port_id.return_value = None
+
+        with mock.patch.object(self.dhcp.queue, 'put') as put:
+            self.dhcp.port_create_end(None, dict(port=vars(fake_port2)))
+            self.dhcp.port_delete_end(None, dict(port_id=fake_port2.id))
+
+        put.assert_has_calls([
+            mock.call(fake_network.id, self.dhcp._update_port, mock.ANY),
+            mock.call(fake_network.id, self.dhcp._delete_port,
+                      fake_port2.id)])
+        self.assertFalse(self.dhcp.queued_port_networks)
+
     def test_port_delete_end_unknown_port(self):
         payload = dict(port_id='unknown')
-        self.cache.get_port_by_id.return_value = None
+        self.cache.get_network_by_port_id.return_value = None
 
         self.dhcp.port_delete_end(None, payload)
+        self.dhcp.queue.wait()
 
-        self.cache.assert_has_calls([mock.call.get_port_by_id('unknown')])
+        self.cache.assert_has_calls(
+            [mock.call.get_network_by_port_id('unknown')])
         self.assertEqual(self.call_driver.call_count, 0)
 
 
@@ -825,6 +1024,19 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
         self.make_msg.assert_called_once_with('get_active_networks_info',
                                               host='foo')
 
+    def test_get_active_networks(self):
+        self.proxy.get_active_networks()
+        self.make_msg.assert_called_once_with('get_active_networks',
+                                              host='foo')
+
+    def test_get_networks_info(self):
+        self.call.return_value = [dict(id='a'), dict(id='b')]
+        networks = self.proxy.get_networks_info(['a', 'b'])
+        self.make_msg.assert_called_once_with('get_networks_info',
+                                              network_ids=['a', 'b'],
+                                              host='foo')
+        self.assertEqual([network.id for network in networks], ['a', 'b'])
+
     def test_create_dhcp_port(self):
         port_body = (
             {'port':
@@ -865,6 +1077,14 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
                                               device_id='devid',
                                               host='foo')
 
+    def test_update_lease_expirations(self):
+        leases = {'netid': {'ipaddr': 1}}
+        self.proxy.update_lease_expirations(leases)
+        self.assertTrue(self.call.called)
+        self.make_msg.assert_called_once_with('update_lease_expirations',
+                                              leases=leases,
+                                              host='foo')
+
     def test_update_lease_expiration(self):
         with mock.patch.object(self.proxy, 'cast') as mock_cast:
             self.proxy.update_lease_expiration('netid', 'ipaddr', 1)
@@ -876,6 +1096,55 @@ class TestDhcpPluginApiProxy(base.BaseTestCase):
                                               host='foo')
 
 
+class TestNetworkEventQueue(base.BaseTestCase):
+    def setUp(self):
+        super(TestNetworkEventQueue, self).setUp()
+        self.queue = dhcp_agent.NetworkEventQueue(2)
+        self.events = []
+
+    def _event(self, network_id, index, sleep=0):
+        eventlet.sleep(sleep)
+        self.events.append((network_id, index))
+
+    def test_put_orders_events_of_a_network(self):
+        self.queue.put('net1', self._event, 'net1', 1, 0.01)
+        self.queue.put('net1', self._event, 'net1', 2)
+        self.queue.put('net2', self._event, 'net2', 1)
+        self.queue.wait()
+        self.assertEqual(self.events,
+                         [('net2', 1), ('net1', 1), ('net1', 2)])
+
+    def test_put_waits_for_a_free_thread(self):
+        for network_id in ('net1', 'net2', 'net3'):
+            self.queue.put(network_id, self._event, network_id, 1, 0.01)
+        # the third network waited for one of the first two to be done
+        self.assertTrue(self.events)
+        self.assertNotIn(('net3', 1), self.events)
+        self.queue.wait()
+        self.assertEqual(len(self.events), 3)
+
+    def test_process_continues_after_failure(self):
+        failing = mock.Mock(side_effect=RuntimeError)
+        with mock.patch.object(dhcp_agent.LOG, 'exception') as log:
+            self.queue.put('net1', failing)
+            self.queue.put('net1', self._event, 'net1', 1)
+            self.queue.wait()
+        self.assertTrue(log.called)
+        self.assertEqual(self.events, [('net1', 1)])
+
+    def test_get_state(self):
+        self.queue.put('net1', self._event, 'net1', 1)
+        self.queue.put('net1', self._event, 'net1', 2)
+        self.assertEqual(self.queue.get_state()['queued_events'], 2)
+        self.queue.wait()
+        state = self.queue.get_state()
+        self.assertEqual(state['queued_events'], 0)
+        self.assertEqual(state['max_queued_events'], 2)
+        self.assertEqual(self.queue.stats['events'], 2)
+        self.assertTrue(state['max_event_latency'] >=
+                        state['mean_event_latency'] >= 0)
+
+
 class TestNetworkCache(base.BaseTestCase):
     def test_put_network(self):
         nc = dhcp_agent.NetworkCache()
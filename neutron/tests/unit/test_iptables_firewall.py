@@ -32,9 +32,9 @@ FAKE_IP = {'IPv4': '10.0.0.1',
            'IPv6': 'fe80::1'}
 
 
-class IptablesFirewallTestCase(base.BaseTestCase):
+class BaseIptablesFirewallTestCase(base.BaseTestCase):
     def setUp(self):
-        super(IptablesFirewallTestCase, self).setUp()
+        super(BaseIptablesFirewallTestCase, self).setUp()
         cfg.CONF.register_opts(a_cfg.ROOT_HELPER_OPTS, 'AGENT')
         self.utils_exec_p = mock.patch(
             'neutron.agent.linux.utils.execute')
@@ -60,6 +60,9 @@ class IptablesFirewallTestCase(base.BaseTestCase):
                 'fixed_ips': [FAKE_IP['IPv4'],
                               FAKE_IP['IPv6']]}
 
+
+class IptablesFirewallTestCase(BaseIptablesFirewallTestCase):
+
     def test_prepare_port_filter_with_no_sg(self):
         port = self._fake_port()
         self.firewall.prepare_port_filter(port)
@@ -993,3 +996,80 @@ class IptablesFirewallTestCase(base.BaseTestCase):
                  call.add_rule('ofake_dev', '-j $sg-fallback'),
                  call.add_rule('sg-chain', '-j ACCEPT')]
         self.v4filter_inst.assert_has_calls(calls)
+
+
+class IptablesFirewallIpsetTestCase(BaseIptablesFirewallTestCase):
+    def setUp(self):
+        cfg.CONF.set_override('enable_ipset', True, 'SECURITYGROUP')
+        super(IptablesFirewallIpsetTestCase, self).setUp()
+        self.iptables_inst.iptables_apply_deferred = False
+        self.sg_id = _uuid()
+        self.ipset_name = ('NETIPv4' + self.sg_id)[:31]
+
+    def _port_with_remote_group(self):
+        port = self._fake_port()
+        port['security_group_rules'] = [
+            {'ethertype': 'IPv4',
+             'direction': 'ingress',
+             'protocol': 'tcp',
+             'port_range_min': 22,
+             'port_range_max': 22,
+             'remote_group_id': self.sg_id}]
+        return port
+
+    def _restore(self, lines):
+        return call(['ipset', 'restore', '-exist'],
+                    process_input='\n'.join(lines) + '\n',
+                    root_helper=mock.ANY)
+
+    def test_uses_ipset(self):
+        self.assertTrue(self.firewall.uses_ipset)
+
+    def test_prepare_port_filter_with_remote_group(self):
+        self.firewall.update_security_group_members(
+            self.sg_id, {'IPv4': ['10.0.0.2'], 'IPv6': ['fe80::2']})
+        self.assertFalse(self.utils_exec.called)
+        self.firewall.prepare_port_filter(self._port_with_remote_group())
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev',
+            '-p tcp -m tcp --dport 22 -m set --match-set %s src '
+            '-j RETURN' % self.ipset_name)
+        self.utils_exec.assert_has_calls([
+            self._restore(['create %s hash:ip family inet' %
+                           self.ipset_name,
+                           'flush %s' % self.ipset_name,
+                           'add %s 10.0.0.2' % self.ipset_name])])
+        self.assertEqual(1, self.utils_exec.call_count)
+
+    def test_update_security_group_members(self):
+        self.firewall.update_security_group_members(
+            self.sg_id, {'IPv4': ['10.0.0.2', '10.0.0.3'], 'IPv6': []})
+        self.firewall.prepare_port_filter(self._port_with_remote_group())
+        self.utils_exec.reset_mock()
+        self.v4filter_inst.reset_mock()
+
+        self.firewall.update_security_group_members(
+            self.sg_id, {'IPv4': ['10.0.0.3', '10.0.0.4'], 'IPv6': []})
+        self.utils_exec.assert_called_once_with(
+            ['ipset', 'restore', '-exist'],
+            process_input='add %(name)s 10.0.0.4\ndel %(name)s 10.0.0.2\n'
+            % {'name': self.ipset_name},
+            root_helper=mock.ANY)
+        self.assertFalse(self.v4filter_inst.add_rule.called)
+
+    def test_remove_port_filter_destroys_ipset(self):
+        port = self._port_with_remote_group()
+        self.firewall.prepare_port_filter(port)
+        self.utils_exec.reset_mock()
+        self.firewall.remove_port_filter(port)
+        self.utils_exec.assert_called_once_with(
+            ['ipset', 'destroy', self.ipset_name], root_helper=mock.ANY)
+        self.assertEqual({}, self.firewall.ipset.ipsets)
+
+    def test_expanded_remote_group_rule(self):
+        port = self._port_with_remote_group()
+        port['security_group_rules'][0]['source_ip_prefix'] = '10.0.0.2/32'
+        self.firewall.prepare_port_filter(port)
+        self.v4filter_inst.add_rule.assert_any_call(
+            'ifake_dev', '-s 10.0.0.2/32 -p tcp -m tcp --dport 22 -j RETURN')
+        self.assertFalse(self.utils_exec.called)
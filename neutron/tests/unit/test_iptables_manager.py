@@ -114,11 +114,11 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
                               process_input=NAT_DUMP + filter_dump_mod,
                               root_helper=self.root_helper).AndReturn(None)
 
-        self.iptables.execute(['iptables-save', '-c'],
-                              root_helper=self.root_helper).AndReturn('')
-
-        self.iptables.execute(['iptables-restore', '-c'],
-                              process_input=NAT_DUMP + FILTER_DUMP,
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*filter\n'
+                                             ':%(bn)s-filter - [0:0]\n'
+                                             '-X %(bn)s-filter\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
                               root_helper=self.root_helper).AndReturn(None)
 
         self.mox.ReplayAll()
@@ -160,13 +160,13 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
                               process_input=NAT_DUMP + filter_dump_mod,
                               root_helper=self.root_helper).AndReturn(None)
 
-        self.iptables.execute(['iptables-save', '-c'],
-                              root_helper=self.root_helper).AndReturn('')
-
-        self.iptables.execute(['iptables-restore', '-c'],
-                              process_input=NAT_DUMP + FILTER_DUMP,
-                              root_helper=self.root_helper
-                              ).AndReturn(None)
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*filter\n'
+                                             ':%(bn)s-INPUT - [0:0]\n'
+                                             ':%(bn)s-filter - [0:0]\n'
+                                             '-X %(bn)s-filter\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
+                              root_helper=self.root_helper).AndReturn(None)
 
         self.mox.ReplayAll()
 
@@ -188,24 +188,6 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
         self.mox.VerifyAll()
 
     def test_add_nat_rule(self):
-        nat_dump = ('# Generated by iptables_manager\n'
-                    '*nat\n'
-                    ':neutron-postrouting-bottom - [0:0]\n'
-                    ':%(bn)s-float-snat - [0:0]\n'
-                    ':%(bn)s-POSTROUTING - [0:0]\n'
-                    ':%(bn)s-PREROUTING - [0:0]\n'
-                    ':%(bn)s-OUTPUT - [0:0]\n'
-                    ':%(bn)s-snat - [0:0]\n'
-                    '[0:0] -A PREROUTING -j %(bn)s-PREROUTING\n'
-                    '[0:0] -A OUTPUT -j %(bn)s-OUTPUT\n'
-                    '[0:0] -A POSTROUTING -j %(bn)s-POSTROUTING\n'
-                    '[0:0] -A POSTROUTING -j neutron-postrouting-bottom\n'
-                    '[0:0] -A neutron-postrouting-bottom -j %(bn)s-snat\n'
-                    '[0:0] -A %(bn)s-snat -j %(bn)s-float-snat\n'
-                    'COMMIT\n'
-                    '# Completed by iptables_manager\n'
-                    % IPTABLES_ARG)
-
         nat_dump_mod = ('# Generated by iptables_manager\n'
                         '*nat\n'
                         ':neutron-postrouting-bottom - [0:0]\n'
@@ -236,11 +218,12 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
                               process_input=nat_dump_mod + FILTER_DUMP,
                               root_helper=self.root_helper).AndReturn(None)
 
-        self.iptables.execute(['iptables-save', '-c'],
-                              root_helper=self.root_helper).AndReturn('')
-
-        self.iptables.execute(['iptables-restore', '-c'],
-                              process_input=nat_dump + FILTER_DUMP,
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*nat\n'
+                                             ':%(bn)s-PREROUTING - [0:0]\n'
+                                             ':%(bn)s-nat - [0:0]\n'
+                                             '-X %(bn)s-nat\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
                               root_helper=self.root_helper).AndReturn(None)
 
         self.mox.ReplayAll()
@@ -265,6 +248,187 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
         self.iptables.apply()
         self.mox.VerifyAll()
 
+    def _apply_initial_rules(self):
+        self.iptables.execute(['iptables-save', '-c'],
+                              root_helper=self.root_helper).AndReturn('')
+        self.iptables.execute(['iptables-restore', '-c'],
+                              process_input=NAT_DUMP + FILTER_DUMP,
+                              root_helper=self.root_helper).AndReturn(None)
+
+    def test_apply_unchanged_tables(self):
+        self._apply_initial_rules()
+        self.mox.ReplayAll()
+
+        self.iptables.apply()
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.ipv4['filter'].remove_rule('INPUT', '-j DROP')
+        self.iptables.apply()
+
+        self.mox.VerifyAll()
+        self.assertEqual(3, self.iptables.stats['applies'])
+        self.assertEqual(2, self.iptables.stats['skipped'])
+        self.assertEqual(1, self.iptables.stats['full_restores'])
+        self.assertEqual(len(NAT_DUMP + FILTER_DUMP),
+                         self.iptables.stats['restored_bytes'])
+
+    def test_apply_modified_chain(self):
+        self._apply_initial_rules()
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*filter\n'
+                                             ':%(bn)s-INPUT - [0:0]\n'
+                                             '-A %(bn)s-INPUT -j ACCEPT\n'
+                                             '-A %(bn)s-INPUT -j DROP\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
+                              root_helper=self.root_helper).AndReturn(None)
+        self.mox.ReplayAll()
+
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j ACCEPT', top=True)
+        self.iptables.ipv4['filter'].add_chain('OUTPUT')
+        self.iptables.apply()
+
+        self.mox.VerifyAll()
+        self.assertEqual(1, self.iptables.stats['partial_restores'])
+
+    def test_apply_modified_unwrapped_chain(self):
+        self._apply_initial_rules()
+        self.iptables.execute(['iptables-save', '-c'],
+                              root_helper=self.root_helper).AndReturn('')
+        self.iptables.execute(['iptables-restore', '-c'],
+                              process_input=mox.IgnoreArg(),
+                              root_helper=self.root_helper).AndReturn(None)
+        self.mox.ReplayAll()
+
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('neutron-filter-top',
+                                              '-j DROP', wrap=False)
+        self.iptables.apply()
+
+        self.mox.VerifyAll()
+        self.assertEqual(2, self.iptables.stats['full_restores'])
+
+    def test_apply_modified_chain_failure(self):
+        self._apply_initial_rules()
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=mox.IgnoreArg(),
+                              root_helper=self.root_helper
+                              ).AndRaise(RuntimeError())
+        self.iptables.execute(['iptables-save', '-c'],
+                              root_helper=self.root_helper).AndReturn('')
+        self.iptables.execute(['iptables-restore', '-c'],
+                              process_input=mox.IgnoreArg(),
+                              root_helper=self.root_helper).AndReturn(None)
+        self.mox.ReplayAll()
+
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.apply()
+
+        self.mox.VerifyAll()
+        self.assertFalse(self.iptables.ipv4['filter'].dirty)
+
+    def test_apply_changed_while_restoring(self):
+        self._apply_initial_rules()
+
+        def add_rule(*args, **kwargs):
+            self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*filter\n'
+                                             ':%(bn)s-INPUT - [0:0]\n'
+                                             '-A %(bn)s-INPUT -j ACCEPT\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
+                              root_helper=self.root_helper
+                              ).WithSideEffects(add_rule).AndReturn(None)
+        self.iptables.execute(['iptables-restore', '--noflush'],
+                              process_input=('*filter\n'
+                                             ':%(bn)s-INPUT - [0:0]\n'
+                                             '-A %(bn)s-INPUT -j ACCEPT\n'
+                                             '-A %(bn)s-INPUT -j DROP\n'
+                                             'COMMIT\n' % IPTABLES_ARG),
+                              root_helper=self.root_helper).AndReturn(None)
+        self.mox.ReplayAll()
+
+        self.iptables.apply()
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j ACCEPT')
+        self.iptables.apply()
+        self.assertTrue(self.iptables.ipv4['filter'].dirty)
+        self.iptables.apply()
+
+        self.mox.VerifyAll()
+        self.assertFalse(self.iptables.ipv4['filter'].dirty)
+        self.assertEqual(2, self.iptables.stats['partial_restores'])
+
+    def test_apply_failure_keeps_tables_dirty(self):
+        self.iptables.execute(['iptables-save', '-c'],
+                              root_helper=self.root_helper).AndReturn('')
+        self.iptables.execute(['iptables-restore', '-c'],
+                              process_input=mox.IgnoreArg(),
+                              root_helper=self.root_helper
+                              ).AndRaise(RuntimeError())
+        self.mox.ReplayAll()
+
+        self.assertRaises(RuntimeError, self.iptables.apply)
+
+        self.mox.VerifyAll()
+        self.assertTrue(self.iptables.ipv4['filter'].dirty)
+        self.assertTrue(self.iptables.ipv4['nat'].dirty)
+        self.assertFalse(self.iptables.applied_state)
+
+    def test_modify_rules(self):
+        table = iptables_manager.IptablesTable()
+        table.add_chain('neutron-filter-top', wrap=False)
+        table.add_rule('FORWARD', '-j neutron-filter-top', wrap=False,
+                       top=True)
+        table.add_chain('INPUT')
+        table.add_rule('INPUT', '-j $i_port1')
+        table.add_chain('i_port1')
+        table.add_rule('i_port1', '-j DROP')
+        table.add_chain('i_port10')
+        table.add_rule('i_port10', '-j ACCEPT')
+        table.remove_chain('neutron-filter-top', wrap=False)
+        current = ['# Generated by iptables-save',
+                   '*filter',
+                   ':INPUT ACCEPT [10:1000]',
+                   ':FORWARD ACCEPT [0:0]',
+                   ':neutron-filter-top - [0:0]',
+                   ':%(bn)s-INPUT - [1:10]',
+                   ':%(bn)s-i_port10 - [2:20]',
+                   ':%(bn)s-stale - [0:0]',
+                   '[5:50] -A FORWARD -j neutron-filter-top',
+                   '[3:30] -A INPUT -j %(bn)s-INPUT',
+                   '[7:70] -A %(bn)s-INPUT -j %(bn)s-i_port1',
+                   '[8:80] -A %(bn)s-stale -j DROP',
+                   '[4:40] -A INPUT -j other',
+                   'COMMIT',
+                   '# Completed by iptables-save']
+        current = [line % IPTABLES_ARG for line in current]
+        expected = ['# Generated by iptables-save',
+                    '*filter',
+                    ':INPUT ACCEPT [10:1000]',
+                    ':FORWARD ACCEPT [0:0]']
+        chains = {'INPUT': ':%(bn)s-INPUT - [1:10]',
+                  'i_port1': ':%(bn)s-i_port1 - [0:0]',
+                  'i_port10': ':%(bn)s-i_port10 - [2:20]'}
+        expected += [chains[name] % IPTABLES_ARG for name in table.chains]
+        expected += [line % IPTABLES_ARG for line in (
+            '[7:70] -A %(bn)s-INPUT -j %(bn)s-i_port1',
+            '[0:0] -A %(bn)s-i_port1 -j DROP',
+            '[0:0] -A %(bn)s-i_port10 -j ACCEPT',
+            '[3:30] -A INPUT -j %(bn)s-INPUT',
+            '[4:40] -A INPUT -j other',
+            'COMMIT',
+            '# Completed by iptables-save')]
+        table.add_rule('INPUT', '-j %(bn)s-INPUT' % IPTABLES_ARG,
+                       wrap=False)
+
+        self.assertEqual(expected, self.iptables._modify_rules(
+            current, table, 'filter'))
+        self.assertEqual([], table.remove_rules)
+        self.assertEqual(set(), table.remove_chains)
+
     def test_add_rule_to_a_nonexistent_chain(self):
         self.assertRaises(LookupError, self.iptables.ipv4['filter'].add_rule,
                           'nonexistent', '-j DROP')
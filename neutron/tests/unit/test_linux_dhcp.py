@@ -234,6 +234,7 @@ class TestBase(base.BaseTestCase):
         self.safe = self.replace_p.start()
         self.addCleanup(self.replace_p.stop)
         self.execute = self.execute_p.start()
+        self.addCleanup(dhcp.Dnsmasq._hosts_lines.clear)
 
 
 class TestDhcpLocalProcess(TestBase):
@@ -663,6 +664,50 @@ tag:tag1,option:classless-static-route,%s,%s""".lstrip() % (fake_v6,
                                     mock.call(exp_opt_name, exp_opt_data)])
         self.execute.assert_called_once_with(exp_args, 'sudo')
 
+    def test_output_hosts_file_renders_changed_ports(self):
+        exp_host_name = '/dhcp/cccccccc-cccc-cccc-cccc-cccccccccccc/host'
+        network = FakeDualNetwork()
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+        with mock.patch('os.path.isdir') as isdir:
+            isdir.return_value = True
+            dm._output_hosts_file()
+            port1 = FakePort1()
+            port1.fixed_ips = [FakeIPAllocation('192.168.0.4')]
+            network.ports = [port1, FakePort3()]
+            dm._output_hosts_file()
+
+        exp_host_data = """
+00:00:80:aa:bb:cc,192-168-0-4.openstacklocal,192.168.0.4
+00:00:0f:aa:bb:cc,192-168-0-3.openstacklocal,192.168.0.3
+00:00:0f:aa:bb:cc,fdca-3ba5-a17a-4ba3--3.openstacklocal,fdca:3ba5:a17a:4ba3::3
+""".lstrip()
+        self.assertEqual(self.safe.call_args, mock.call(exp_host_name,
+                                                        exp_host_data))
+        self.assertEqual(set(dm._hosts_lines[network.id]),
+                         set([FakePort1.id, FakePort3.id]))
+
+    def test_output_hosts_file_reuses_unchanged_ports(self):
+        network = FakeDualNetwork()
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+        with mock.patch('os.path.isdir') as isdir:
+            isdir.return_value = True
+            dm._output_hosts_file()
+            with mock.patch.object(dhcp.re, 'compile') as compile:
+                dm._output_hosts_file()
+        self.assertFalse(compile.return_value.sub.called)
+        self.assertEqual(self.safe.call_args_list[0],
+                         self.safe.call_args_list[1])
+
+    def test_remove_config_files_drops_hosts_lines(self):
+        network = FakeV4Network()
+        dm = dhcp.Dnsmasq(self.conf, network, version=float(2.59))
+        with mock.patch('os.path.isdir') as isdir:
+            isdir.return_value = True
+            dm._output_hosts_file()
+        with mock.patch('shutil.rmtree'):
+            dm._remove_config_files()
+        self.assertNotIn(network.id, dhcp.Dnsmasq._hosts_lines)
+
     def test_make_subnet_interface_ip_map(self):
         with mock.patch('neutron.agent.linux.ip_lib.IPDevice') as ip_dev:
             ip_dev.return_value.addr.list.return_value = [
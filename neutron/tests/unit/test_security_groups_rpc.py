@@ -29,6 +29,8 @@ from neutron.agent import securitygroups_rpc as sg_rpc
 from neutron import context
 from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import securitygroup as ext_sg
+from neutron.openstack.common.rpc import common as rpc_common
+from neutron.openstack.common.rpc import dispatcher
 from neutron.openstack.common.rpc import proxy
 from neutron.tests import base
 from neutron.tests.unit import test_extension_security_group as test_sg
@@ -197,22 +199,136 @@ class SGServerRpcCallBackMixinTestCase(test_sg.SecurityGroupDBTestCase):
                              'security_group_id': sg1_id},
                             {'direction': 'egress', 'ethertype': 'IPv6',
                              'security_group_id': sg1_id},
+                            {'direction': u'ingress',
+                             'source_ip_prefix': u'10.0.0.3/32',
+                             'protocol': u'tcp', 'ethertype': u'IPv4',
+                             'port_range_max': 25, 'port_range_min': 24,
+                             'remote_group_id': sg2_id,
+                             'security_group_id': sg1_id},
                             {'direction': 'egress', 'ethertype': 'IPv4',
                              'security_group_id': sg2_id},
                             {'direction': 'egress', 'ethertype': 'IPv6',
                              'security_group_id': sg2_id},
+                            ]
+                self.assertEqual(port_rpc['security_group_rules'],
+                                 expected)
+                self._delete('ports', port_id1)
+                self._delete('ports', port_id2)
+
+    def test_security_group_info_for_devices_ipv4_source_group(self):
+
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4,
+                                                   sg1,
+                                                   sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                rule1 = self._build_security_group_rule(
+                    sg1_id,
+                    'ingress', 'tcp', '24',
+                    '25', remote_group_id=sg2_id)
+                rules = {
+                    'security_group_rules': [rule1['security_group_rule']]}
+                res = self._create_security_group_rule(self.fmt, rules)
+                self.deserialize(self.fmt, res)
+                self.assertEqual(res.status_int, 201)
+
+                res1 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg1_id,
+                                     sg2_id])
+                ports_rest1 = self.deserialize(self.fmt, res1)
+                port_id1 = ports_rest1['port']['id']
+                self.rpc.devices = {port_id1: ports_rest1['port']}
+                devices = [port_id1, 'no_exist_device']
+
+                res2 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg2_id])
+                ports_rest2 = self.deserialize(self.fmt, res2)
+                port_id2 = ports_rest2['port']['id']
+                ctx = context.get_admin_context()
+                info = self.rpc.security_group_info_for_devices(
+                    ctx, devices=devices)
+                port_rpc = info['devices'][port_id1]
+                expected = [{'direction': 'egress', 'ethertype': 'IPv4',
+                             'security_group_id': sg1_id},
+                            {'direction': 'egress', 'ethertype': 'IPv6',
+                             'security_group_id': sg1_id},
                             {'direction': u'ingress',
-                             'source_ip_prefix': u'10.0.0.3/32',
                              'protocol': u'tcp', 'ethertype': u'IPv4',
                              'port_range_max': 25, 'port_range_min': 24,
                              'remote_group_id': sg2_id,
                              'security_group_id': sg1_id},
+                            {'direction': 'egress', 'ethertype': 'IPv4',
+                             'security_group_id': sg2_id},
+                            {'direction': 'egress', 'ethertype': 'IPv6',
+                             'security_group_id': sg2_id},
                             ]
                 self.assertEqual(port_rpc['security_group_rules'],
                                  expected)
+                self.assertEqual([sg2_id],
+                                 port_rpc['security_group_source_groups'])
+                members = info['sg_member_ips'][sg2_id]
+                self.assertEqual(['10.0.0.2', '10.0.0.3'],
+                                 sorted(members['IPv4']))
+                self.assertEqual([], members['IPv6'])
+                self.assertEqual(
+                    info['sg_member_ips'],
+                    self.rpc.security_group_member_ips(
+                        ctx, security_groups=[sg2_id]))
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
+    def test_security_group_info_for_groups(self):
+        with self.network() as n:
+            with nested(self.subnet(n),
+                        self.security_group(),
+                        self.security_group()) as (subnet_v4,
+                                                   sg1,
+                                                   sg2):
+                sg1_id = sg1['security_group']['id']
+                sg2_id = sg2['security_group']['id']
+                rule1 = self._build_security_group_rule(
+                    sg1_id,
+                    'ingress', 'tcp', '24',
+                    '25', remote_group_id=sg2_id)
+                rules = {
+                    'security_group_rules': [rule1['security_group_rule']]}
+                res = self._create_security_group_rule(self.fmt, rules)
+                self.assertEqual(res.status_int, 201)
+                res1 = self._create_port(
+                    self.fmt, n['network']['id'],
+                    security_groups=[sg2_id])
+                port_id1 = self.deserialize(self.fmt, res1)['port']['id']
+
+                ctx = context.get_admin_context()
+                groups = self.rpc.security_group_info_for_groups(
+                    ctx, security_groups=[sg1_id], versions={})
+                self.assertEqual(set([sg1_id, sg2_id]), set(groups))
+                self.assertIn({'direction': u'ingress',
+                               'protocol': u'tcp', 'ethertype': u'IPv4',
+                               'port_range_max': 25, 'port_range_min': 24,
+                               'remote_group_id': sg2_id,
+                               'security_group_id': sg1_id},
+                              groups[sg1_id]['rules'])
+                self.assertEqual({'IPv4': ['10.0.0.2'], 'IPv6': []},
+                                 groups[sg2_id]['members'])
+
+                versions = dict((sg_id, group['version'])
+                                for sg_id, group in groups.items())
+                self.assertEqual({}, self.rpc.security_group_info_for_groups(
+                    ctx, security_groups=[sg1_id], versions=versions))
+
+                self._delete('ports', port_id1)
+                groups = self.rpc.security_group_info_for_groups(
+                    ctx, security_groups=[sg1_id], versions=versions)
+                self.assertEqual([sg2_id], groups.keys())
+                self.assertEqual({'IPv4': [], 'IPv6': []},
+                                 groups[sg2_id]['members'])
+
     def test_security_group_rules_for_devices_ipv6_ingress(self):
         fake_prefix = test_fw.FAKE_PREFIX['IPv6']
         with self.network() as n:
@@ -377,16 +493,16 @@ class SGServerRpcCallBackMixinTestCase(test_sg.SecurityGroupDBTestCase):
                              'security_group_id': sg1_id},
                             {'direction': 'egress', 'ethertype': 'IPv6',
                              'security_group_id': sg1_id},
-                            {'direction': 'egress', 'ethertype': 'IPv4',
-                             'security_group_id': sg2_id},
-                            {'direction': 'egress', 'ethertype': 'IPv6',
-                             'security_group_id': sg2_id},
                             {'direction': 'ingress',
                              'source_ip_prefix': 'fe80::3/128',
                              'protocol': 'tcp', 'ethertype': 'IPv6',
                              'port_range_max': 25, 'port_range_min': 24,
                              'remote_group_id': sg2_id,
                              'security_group_id': sg1_id},
+                            {'direction': 'egress', 'ethertype': 'IPv4',
+                             'security_group_id': sg2_id},
+                            {'direction': 'egress', 'ethertype': 'IPv6',
+                             'security_group_id': sg2_id},
                             ]
                 self.assertEqual(port_rpc['security_group_rules'],
                                  expected)
@@ -435,6 +551,7 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         firewall_object = firewall_base.FirewallDriver()
         self.firewall.defer_apply.side_effect = firewall_object.defer_apply
         self.agent.firewall = self.firewall
+        self.agent.use_group_cache = False
         rpc = mock.Mock()
         self.agent.plugin_rpc = rpc
         self.fake_device = {'device': 'fake_device',
@@ -464,27 +581,25 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.prepare_devices_filter(['fake_port_id'])
         self.agent.security_groups_rule_updated(['fake_sgid1', 'fake_sgid3'])
-        self.agent.refresh_firewall.assert_has_calls(
-            [call.refresh_firewall()])
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
 
     def test_security_groups_rule_not_updated(self):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.prepare_devices_filter(['fake_port_id'])
         self.agent.security_groups_rule_updated(['fake_sgid3', 'fake_sgid4'])
-        self.agent.refresh_firewall.assert_has_calls([])
+        self.assertFalse(self.agent.refresh_firewall.called)
 
     def test_security_groups_member_updated(self):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.prepare_devices_filter(['fake_port_id'])
         self.agent.security_groups_member_updated(['fake_sgid2', 'fake_sgid3'])
-        self.agent.refresh_firewall.assert_has_calls(
-            [call.refresh_firewall()])
+        self.agent.refresh_firewall.assert_called_once_with(['fake_device'])
 
     def test_security_groups_member_not_updated(self):
         self.agent.refresh_firewall = mock.Mock()
         self.agent.prepare_devices_filter(['fake_port_id'])
         self.agent.security_groups_member_updated(['fake_sgid3', 'fake_sgid4'])
-        self.agent.refresh_firewall.assert_has_calls([])
+        self.assertFalse(self.agent.refresh_firewall.called)
 
     def test_security_groups_provider_updated(self):
         self.agent.refresh_firewall = mock.Mock()
@@ -502,6 +617,255 @@ class SecurityGroupAgentRpcTestCase(base.BaseTestCase):
         self.firewall.assert_has_calls(calls)
 
 
+class FirewallApplySchedulerTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(FirewallApplySchedulerTestCase, self).setUp()
+        self.firewall = mock.Mock()
+        self.scheduler = sg_rpc.FirewallApplyScheduler(self.firewall, 1, 5)
+        self.spawn_after = mock.patch(
+            'eventlet.greenthread.spawn_after').start()
+        self.time = mock.patch('time.time').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _change(self, now):
+        self.time.return_value = now
+        with self.scheduler.defer_apply():
+            pass
+
+    def test_changes_coalesced(self):
+        self._change(100)
+        self._change(100.5)
+        self.firewall.filter_defer_apply_on.assert_called_once_with()
+        self.spawn_after.assert_has_calls([
+            call(1, self.scheduler.apply),
+            call().cancel(),
+            call(1, self.scheduler.apply)])
+        self.assertFalse(self.firewall.filter_defer_apply_off.called)
+
+        self.scheduler.apply()
+        self.firewall.filter_defer_apply_off.assert_called_once_with()
+        self.assertEqual({'applies': 1, 'changes': 2, 'max_coalesced': 2},
+                         self.scheduler.stats)
+
+        self._change(110)
+        self.assertEqual(2, self.firewall.filter_defer_apply_on.call_count)
+
+    def test_max_latency(self):
+        self._change(100)
+        self._change(104.5)
+        self.spawn_after.assert_called_with(0.5, self.scheduler.apply)
+        self._change(106)
+        self.spawn_after.assert_called_with(0, self.scheduler.apply)
+
+    def test_apply_while_changing(self):
+        self.time.return_value = 100
+        with self.scheduler.defer_apply():
+            self.scheduler.apply()
+            self.assertFalse(self.firewall.filter_defer_apply_off.called)
+        self.spawn_after.assert_called_once_with(1, self.scheduler.apply)
+
+    def test_apply_without_changes(self):
+        self.scheduler.apply()
+        self.assertFalse(self.firewall.filter_defer_apply_off.called)
+
+    def test_apply_failure(self):
+        self._change(100)
+        self.firewall.filter_defer_apply_off.side_effect = RuntimeError()
+        self.scheduler.apply()
+        self.assertTrue(self.scheduler.apply_failed)
+
+        agent = sg_rpc.SecurityGroupAgentRpcMixin()
+        agent.apply_scheduler = self.scheduler
+        self.assertTrue(agent.firewall_apply_failed())
+        self.assertFalse(agent.firewall_apply_failed())
+
+    def test_agent_uses_scheduler(self):
+        cfg.CONF.set_override('defer_apply_window', 0.5, 'SECURITYGROUP')
+        self.addCleanup(cfg.CONF.clear_override, 'defer_apply_window',
+                        'SECURITYGROUP')
+        agent = sg_rpc.SecurityGroupAgentRpcMixin()
+        agent.context = None
+        agent.init_firewall()
+        agent.plugin_rpc = mock.Mock()
+        agent.plugin_rpc.security_group_rules_for_devices.return_value = {
+            'fake_device': {'device': 'fake_device'}}
+        agent.firewall = self.firewall
+        agent.apply_scheduler.firewall = self.firewall
+        agent.prepare_devices_filter(['fake_device'])
+        self.firewall.assert_has_calls([
+            call.filter_defer_apply_on(),
+            call.prepare_port_filter({'device': 'fake_device'})])
+        self.assertFalse(self.firewall.defer_apply.called)
+        self.assertFalse(self.firewall.filter_defer_apply_off.called)
+
+
+class SecurityGroupAgentGroupCacheTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupAgentGroupCacheTestCase, self).setUp()
+        self.agent = sg_rpc.SecurityGroupAgentRpcMixin()
+        self.agent.context = None
+        self.agent.init_firewall()
+        self.firewall = mock.Mock()
+        firewall_object = firewall_base.FirewallDriver()
+        self.firewall.defer_apply.side_effect = firewall_object.defer_apply
+        self.agent.firewall = self.firewall
+        self.rpc = mock.Mock()
+        self.agent.plugin_rpc = self.rpc
+        self.agent.refresh_firewall = mock.Mock()
+        self.dhcp_rule = {'direction': 'ingress', 'ethertype': 'IPv4',
+                          'protocol': 'udp', 'port_range_min': 68,
+                          'port_range_max': 68,
+                          'source_ip_prefix': '10.0.0.5/32'}
+        self.device1 = self._device('dev1', '10.0.0.2', ['sg1'])
+        self.device2 = self._device('dev2', '10.0.0.3', ['sg2'])
+        self.firewall.ports = {'dev1': self.device1, 'dev2': self.device2}
+        self.groups = {
+            'sg1': {'version': 'v1',
+                    'rules': [{'security_group_id': 'sg1',
+                               'direction': 'ingress', 'ethertype': 'IPv4',
+                               'protocol': 'tcp', 'port_range_min': 22,
+                               'port_range_max': 22,
+                               'remote_group_id': 'sg3'}],
+                    'members': {'IPv4': ['10.0.0.2'], 'IPv6': []}},
+            'sg3': {'version': 'v3',
+                    'rules': [],
+                    'members': {'IPv4': ['10.0.0.2', '10.0.0.4'],
+                                'IPv6': []}}}
+
+    def _device(self, device, ip, security_groups):
+        return {'device': device,
+                'fixed_ips': [ip],
+                'security_groups': security_groups,
+                'security_group_source_groups': [],
+                'security_group_rules': [
+                    self.dhcp_rule,
+                    {'security_group_id': security_groups[0],
+                     'direction': 'egress', 'ethertype': 'IPv4'}]}
+
+    def test_security_groups_rule_updated(self):
+        self.rpc.security_group_info_for_groups.return_value = self.groups
+        self.agent.security_groups_rule_updated(['sg1'])
+        self.rpc.security_group_info_for_groups.assert_called_once_with(
+            None, ['sg1'], {})
+        expected = dict(self.device1)
+        expected['security_group_rules'] = [
+            self.dhcp_rule,
+            {'security_group_id': 'sg1', 'direction': 'ingress',
+             'ethertype': 'IPv4', 'protocol': 'tcp', 'port_range_min': 22,
+             'port_range_max': 22, 'remote_group_id': 'sg3',
+             'source_ip_prefix': '10.0.0.4/32'}]
+        expected['security_group_source_groups'] = ['sg3']
+        self.firewall.update_port_filter.assert_called_once_with(expected)
+        self.assertFalse(self.agent.refresh_firewall.called)
+        self.assertEqual(self.groups, self.agent.sg_cache)
+
+    def test_security_groups_rule_not_changed(self):
+        self.agent.sg_cache = self.groups
+        self.rpc.security_group_info_for_groups.return_value = {}
+        self.agent.security_groups_rule_updated(['sg1'])
+        self.rpc.security_group_info_for_groups.assert_called_once_with(
+            None, ['sg1'], {'sg1': 'v1', 'sg3': 'v3'})
+        self.assertFalse(self.firewall.update_port_filter.called)
+
+    def test_security_groups_member_updated(self):
+        self.firewall.update_port_filter.side_effect = (
+            lambda device: self.firewall.ports.update(
+                {device['device']: device}))
+        self.rpc.security_group_info_for_groups.return_value = self.groups
+        self.agent.security_groups_rule_updated(['sg1'])
+        self.firewall.reset_mock()
+
+        sg3 = {'version': 'v3-2',
+               'rules': [],
+               'members': {'IPv4': ['10.0.0.6'], 'IPv6': []}}
+        self.rpc.security_group_info_for_groups.return_value = {'sg3': sg3}
+        self.agent.security_groups_member_updated(['sg3'])
+        device = self.firewall.update_port_filter.call_args[0][0]
+        self.assertEqual('dev1', device['device'])
+        self.assertEqual('10.0.0.6/32',
+                         device['security_group_rules'][1][
+                             'source_ip_prefix'])
+        self.assertEqual(1, self.firewall.update_port_filter.call_count)
+
+    def test_old_server(self):
+        self.rpc.security_group_info_for_groups.side_effect = (
+            rpc_common.RemoteError('UnsupportedRpcVersion'))
+        self.agent.security_groups_rule_updated(['sg2'])
+        self.agent.refresh_firewall.assert_called_once_with(['dev2'])
+        self.assertFalse(self.agent.use_group_cache)
+
+    def test_remove_devices_filter_prunes_cache(self):
+        self.agent.sg_cache = dict(self.groups)
+        del self.firewall.ports['dev1']
+        self.agent.remove_devices_filter(['dev1'])
+        self.assertEqual({}, self.agent.sg_cache)
+
+
+class SecurityGroupAgentIpsetRpcTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SecurityGroupAgentIpsetRpcTestCase, self).setUp()
+        self.agent = sg_rpc.SecurityGroupAgentRpcMixin()
+        self.agent.context = None
+        self.agent.firewall = mock.Mock()
+        firewall_object = firewall_base.FirewallDriver()
+        self.agent.firewall.defer_apply.side_effect = (
+            firewall_object.defer_apply)
+        self.agent.use_ipset = True
+        self.agent.plugin_rpc = mock.Mock()
+        self.fake_device = {'device': 'fake_device',
+                            'security_groups': ['fake_sgid1'],
+                            'security_group_source_groups': ['fake_sgid2'],
+                            'security_group_rules': [{'security_group_id':
+                                                      'fake_sgid1',
+                                                      'remote_group_id':
+                                                      'fake_sgid2'}]}
+        self.members = {'fake_sgid2': {'IPv4': ['10.0.0.2'], 'IPv6': []}}
+        self.agent.firewall.ports = {'fake_device': self.fake_device}
+        self.agent.plugin_rpc.security_group_info_for_devices.return_value = {
+            'devices': {'fake_device': self.fake_device},
+            'sg_member_ips': self.members}
+        self.agent.refresh_firewall = mock.Mock()
+
+    def test_prepare_devices_filter(self):
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.agent.firewall.assert_has_calls([
+            call.update_security_group_members('fake_sgid2',
+                                               self.members['fake_sgid2']),
+            call.defer_apply(),
+            call.prepare_port_filter(self.fake_device)])
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_rules_for_devices.called)
+
+    def test_prepare_devices_filter_old_server(self):
+        rpc = self.agent.plugin_rpc
+        rpc.security_group_info_for_devices.side_effect = (
+            rpc_common.RemoteError('UnsupportedRpcVersion'))
+        rpc.security_group_rules_for_devices.return_value = {
+            'fake_device': self.fake_device}
+        self.agent.prepare_devices_filter(['fake_device'])
+        self.assertFalse(self.agent.use_ipset)
+        self.agent.firewall.prepare_port_filter.assert_called_once_with(
+            self.fake_device)
+
+    def test_security_groups_member_updated(self):
+        rpc = self.agent.plugin_rpc
+        rpc.security_group_member_ips.return_value = self.members
+        self.agent.security_groups_member_updated(['fake_sgid2',
+                                                   'fake_sgid3'])
+        rpc.security_group_member_ips.assert_called_once_with(
+            None, ['fake_sgid2'])
+        self.agent.firewall.update_security_group_members.assert_has_calls(
+            [call('fake_sgid2', self.members['fake_sgid2'])])
+        self.assertFalse(self.agent.refresh_firewall.called)
+
+    def test_security_groups_member_not_updated(self):
+        self.agent.security_groups_member_updated(['fake_sgid1',
+                                                   'fake_sgid3'])
+        self.assertFalse(
+            self.agent.plugin_rpc.security_group_member_ips.called)
+        self.assertFalse(self.agent.refresh_firewall.called)
+
+
 class FakeSGRpcApi(agent_rpc.PluginApi,
                    sg_rpc.SecurityGroupServerRpcApiMixin):
     pass
@@ -524,6 +888,52 @@ class SecurityGroupServerRpcApiTestCase(base.BaseTestCase):
              version=sg_rpc.SG_RPC_VERSION,
              topic='fake_topic')])
 
+    def test_security_group_info_for_devices(self):
+        self.rpc.security_group_info_for_devices(None, ['fake_device'])
+        self.rpc.call.assert_has_calls(
+            [call(None,
+             {'args':
+                 {'devices': ['fake_device']},
+             'method': 'security_group_info_for_devices',
+             'namespace': None},
+             version=sg_rpc.SG_INFO_RPC_VERSION,
+             topic='fake_topic')])
+
+    def test_security_group_info_for_groups(self):
+        self.rpc.security_group_info_for_groups(None, ['fake_sgid'],
+                                                {'fake_sgid': 'v1'})
+        self.rpc.call.assert_has_calls(
+            [call(None,
+             {'args':
+                 {'security_groups': ['fake_sgid'],
+                  'versions': {'fake_sgid': 'v1'}},
+             'method': 'security_group_info_for_groups',
+             'namespace': None},
+             version=sg_rpc.SG_INFO_RPC_VERSION,
+             topic='fake_topic')])
+
+    def test_security_group_member_ips(self):
+        self.rpc.security_group_member_ips(None, ['fake_sgid'])
+        self.rpc.call.assert_has_calls(
+            [call(None,
+             {'args':
+                 {'security_groups': ['fake_sgid']},
+             'method': 'security_group_member_ips',
+             'namespace': None},
+             version=sg_rpc.SG_INFO_RPC_VERSION,
+             topic='fake_topic')])
+
+    def test_old_server_rejects_info_rpcs(self):
+        class OldCallbacks(object):
+            RPC_API_VERSION = sg_rpc.SG_RPC_VERSION
+
+        rpc_dispatcher = dispatcher.RpcDispatcher([OldCallbacks()])
+        self.assertRaises(rpc_common.UnsupportedRpcVersion,
+                          rpc_dispatcher.dispatch, None,
+                          sg_rpc.SG_INFO_RPC_VERSION,
+                          'security_group_member_ips', None,
+                          security_groups=['fake_sgid'])
+
 
 class FakeSGNotifierAPI(proxy.RpcProxy,
                         sg_rpc.SecurityGroupAgentRpcApiMixin):
@@ -1115,9 +1525,15 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
         self.root_helper = 'sudo'
         self.agent.root_helper = 'sudo'
         self.agent.init_firewall()
+        # refresh devices with security_group_rules_for_devices
+        self.agent.use_group_cache = False
 
         self.iptables = self.agent.firewall.iptables
         self.mox.StubOutWithMock(self.iptables, "execute")
+        # compare the whole ruleset on every apply
+        self.full_restore = mock.patch.object(
+            self.iptables, '_need_full_restore', return_value=True)
+        self.full_restore.start()
 
         self.rpc = mock.Mock()
         self.agent.plugin_rpc = self.rpc
@@ -1241,6 +1657,34 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
 
         self.mox.VerifyAll()
 
+    def test_security_group_member_updated_partial_restore(self):
+        self.full_restore.stop()
+        self.rpc.security_group_rules_for_devices.return_value = self.devices1
+        self._replay_iptables(IPTABLES_FILTER_1, IPTABLES_FILTER_V6_1)
+        self.iptables.execute(
+            ['iptables-restore', '--noflush'],
+            process_input=self._regex(
+                '*filter\n'
+                ':%(bn)s-i_port1 - [0:0]\n'
+                '-A %(bn)s-i_port1 -m state --state INVALID -j DROP\n'
+                '-A %(bn)s-i_port1 -m state --state RELATED,ESTABLISHED '
+                '-j RETURN\n'
+                '-A %(bn)s-i_port1 -s 10.0.0.2 -p udp -m udp --sport 67 '
+                '--dport 68 -j RETURN\n'
+                '-A %(bn)s-i_port1 -p tcp -m tcp --dport 22 -j RETURN\n'
+                '-A %(bn)s-i_port1 -s 10.0.0.4 -j RETURN\n'
+                '-A %(bn)s-i_port1 -j %(bn)s-sg-fallback\n'
+                'COMMIT\n' % IPTABLES_ARG),
+            root_helper=self.root_helper).AndReturn('')
+        self.mox.ReplayAll()
+
+        self.agent.prepare_devices_filter(['tap_port1'])
+        self.rpc.security_group_rules_for_devices.return_value = self.devices2
+        self.agent.security_groups_member_updated(['security_group1'])
+
+        self.mox.VerifyAll()
+        self.assertEqual(1, self.iptables.stats['partial_restores'])
+
     def test_security_group_rule_udpated(self):
         self.rpc.security_group_rules_for_devices.return_value = self.devices2
         self._replay_iptables(IPTABLES_FILTER_2, IPTABLES_FILTER_V6_2)
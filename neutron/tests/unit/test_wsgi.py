@@ -15,6 +15,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
 import os
 import socket
 import urllib2
@@ -28,6 +29,8 @@ import webob.exc
 from neutron.api.v2 import attributes
 from neutron.common import constants
 from neutron.common import exceptions as exception
+from neutron.db import api as db_api
+from neutron.openstack.common.db.sqlalchemy import session as db_session
 from neutron.tests import base
 from neutron import wsgi
 
@@ -55,6 +58,51 @@ class TestWSGIServer(base.BaseTestCase):
         server.stop()
         server.wait()
 
+    def test_start_multiple_workers(self):
+        server = wsgi.Server("test_multiple_processes")
+        with contextlib.nested(
+            mock.patch('neutron.openstack.common.service.ProcessLauncher'),
+            mock.patch('neutron.db.api.dispose')
+        ) as (launcher, dispose):
+            server.start(None, 0, host="127.0.0.1", workers=2)
+            launcher.return_value.launch_service.assert_called_once_with(
+                mock.ANY, workers=2)
+            self.assertTrue(dispose.called)
+
+            server.stop()
+            server.wait()
+            launcher.return_value.wait.assert_called_once_with()
+
+    def test_worker_service(self):
+        server = wsgi.Server("test_worker")
+        server.start(None, 0, host="127.0.0.1")
+        server.stop()
+        worker = wsgi.WorkerService(server, None)
+        with contextlib.nested(
+            mock.patch('neutron.db.api.reset_pool'),
+            mock.patch('neutron.common.rpc.reset_connection_pool')
+        ) as (reset_pool, reset_connection_pool):
+            worker.start()
+            reset_pool.assert_called_once_with()
+            reset_connection_pool.assert_called_once_with()
+        self.assertNotEqual(0, server.port)
+        worker.stop()
+        worker.wait()
+        self.assertIsNone(worker._server)
+
+    def test_worker_reset_pool(self):
+        db_api.configure_db()
+        self.addCleanup(db_api.clear_db)
+        engine = db_session.get_engine(sqlite_fk=True)
+        inherited_pool = engine.pool
+        with mock.patch.object(inherited_pool, 'dispose') as dispose:
+            db_api.reset_pool()
+            self.assertFalse(dispose.called)
+        self.addCleanup(db_api._INHERITED_POOLS.remove, inherited_pool)
+        self.assertIsNot(inherited_pool, engine.pool)
+        self.assertIn(inherited_pool, db_api._INHERITED_POOLS)
+        engine.execute('SELECT 1')
+
     def test_ipv6_listen_called_with_scope(self):
         server = wsgi.Server("test_app")
 
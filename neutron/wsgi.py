@@ -36,9 +36,12 @@ import webob.exc
 
 from neutron.common import constants
 from neutron.common import exceptions as exception
+from neutron.common import rpc as q_rpc
 from neutron import context
+from neutron.db import api
 from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import service as common_service
 
 socket_opts = [
     cfg.IntOpt('backlog',
@@ -74,6 +77,9 @@ CONF.register_opts(socket_opts)
 
 LOG = logging.getLogger(__name__)
 
+# seconds a worker being stopped waits for the requests in progress
+WORKER_SHUTDOWN_TIMEOUT = 30
+
 
 def run_server(application, port):
     """Run a WSGI server with the given application."""
@@ -81,12 +87,46 @@ def run_server(application, port):
     eventlet.wsgi.server(sock, application)
 
 
+class WorkerService(object):
+    """Wraps a worker to be handled by ProcessLauncher."""
+
+    def __init__(self, service, application):
+        self._service = service
+        self._application = application
+        self._server = None
+
+    def start(self):
+        # We have just been forked: the database and message broker
+        # connections inherited from the parent must not be used here.
+        api.reset_pool()
+        q_rpc.reset_connection_pool()
+        # Outside of the pool of the requests, which eventlet waits for
+        # once the server stops accepting connections
+        self._server = eventlet.spawn(self._service._run, self._application,
+                                      self._service._socket)
+
+    def wait(self):
+        if isinstance(self._server, eventlet.greenthread.GreenThread):
+            self._server.wait()
+
+    def stop(self):
+        if isinstance(self._server, eventlet.greenthread.GreenThread):
+            # stop accepting connections and let the requests in progress
+            # complete
+            self._server.kill()
+            self._server = None
+            with eventlet.Timeout(WORKER_SHUTDOWN_TIMEOUT, False):
+                self._service.pool.waitall()
+
+
 class Server(object):
     """Server class to manage multiple WSGI sockets and applications."""
 
     def __init__(self, name, threads=1000):
         self.pool = eventlet.GreenPool(threads)
         self.name = name
+        self._launcher = None
+        self._server = None
 
     def _get_socket(self, host, port, backlog):
         bind_addr = (host, port)
@@ -165,8 +205,13 @@ class Server(object):
 
         return sock
 
-    def start(self, application, port, host='0.0.0.0'):
-        """Run a WSGI server with the given application."""
+    def start(self, application, port, host='0.0.0.0', workers=0):
+        """Run a WSGI server with the given application.
+
+        With workers, the application is served by that many processes
+        forked from this one, which all accept connections on the same
+        socket; this process only watches and respawns them.
+        """
         self._host = host
         self._port = port
         backlog = CONF.backlog
@@ -174,7 +219,15 @@ class Server(object):
         self._socket = self._get_socket(self._host,
                                         self._port,
                                         backlog=backlog)
-        self._server = self.pool.spawn(self._run, application, self._socket)
+        if workers < 1:
+            self._server = self.pool.spawn(self._run, application,
+                                           self._socket)
+        else:
+            # do not hand idle database connections down to the workers
+            api.dispose()
+            self._launcher = common_service.ProcessLauncher()
+            self._server = WorkerService(self, application)
+            self._launcher.launch_service(self._server, workers=workers)
 
     @property
     def host(self):
@@ -185,12 +238,17 @@ class Server(object):
         return self._socket.getsockname()[1] if self._socket else self._port
 
     def stop(self):
-        self._server.kill()
+        if isinstance(self._server, eventlet.greenthread.GreenThread):
+            self._server.kill()
+            self._server = None
 
     def wait(self):
         """Wait until all servers have completed running."""
         try:
-            self.pool.waitall()
+            if self._launcher:
+                self._launcher.wait()
+            else:
+                self.pool.waitall()
         except KeyboardInterrupt:
             pass
 